@@ -32,6 +32,10 @@ except:
 
 from PIL import Image, ImageTk
 from fpdf import FPDF
+try:
+    import numpy
+except ImportError:
+    numpy = None
 import sys
 import os
 import sqlite3
@@ -39,9 +43,42 @@ import time
 import hashlib
 import csv
 import json
+import argparse
+import html
+import string
+import shlex
+import subprocess
+import itertools
+import heapq
+import datetime
+import threading
+import concurrent.futures
+import gzip
+import shutil
+import re
+import asyncio
+import base64
+import urllib.parse
+import queue
+import collections
 
 __version__ = "1.0.0"
 
+# Transaction dates are saved as DD-MM-YYYY text. This expression turns a
+# date column into a sortable YYYY-MM-DD string so it can be compared and
+# indexed, e.g. ISO_DATE.format("outgoing.date").
+ISO_DATE = "(substr({0}, 7, 4) || '-' || substr({0}, 4, 2) || '-' || substr({0}, 1, 2))"
+
+def isoDate(date):
+    """Convert a DD-MM-YYYY date into YYYY-MM-DD, raise ValueError if invalid."""
+    return time.strftime("%Y-%m-%d", time.strptime(date, "%d-%m-%Y"))
+
+def lastMonthEnd():
+    """Return the last day of the previous month as DD-MM-YYYY."""
+    now = time.localtime()
+    first = time.mktime((now.tm_year, now.tm_mon, 1, 12, 0, 0, 0, 0, -1))
+    return time.strftime("%d-%m-%Y", time.localtime(first - 86400))
+
 class Application(tk.Tk):
     pass
 
@@ -87,8 +124,7 @@ class MainWindow(tk.Frame):
         
     def setupUI(self):
         # This code sets the title of the window.
-        title = ["JTS-Inventory", __version__]
-        self.master.title(" ".join(title))
+        self.updateTitle()
         self.master.iconbitmap('jtsinventory_icon.ico')
         # Sets the default position of the application.
         self.master.geometry("+10+10")
@@ -112,54 +148,7 @@ class MainWindow(tk.Frame):
                              width=15,
                              foreground="blue"
                              )
-        # Create menubars and menus.
-        menubar = tk.Menu(self.master)
-        self.master["menu"] = menubar
-
-        filemenu = tk.Menu(menubar, tearoff=0)
-        optionmenu = tk.Menu(menubar, tearoff=0)
-        helpmenu = tk.Menu(menubar, tearoff=0)
-
-        menubar.add_cascade(label="File", menu=filemenu)
-        menubar.add_cascade(label="Option", menu=optionmenu)
-        menubar.add_cascade(label="Help", menu=helpmenu)
-
-        filemenu.add_command(label="Products",
-                             command=lambda: self.menuHandler("PRODUCT"))
-        filemenu.add_command(label="Incoming",
-                             command=lambda: self.menuHandler("IN"))
-        filemenu.add_command(label="Outgoing",
-                             command=lambda: self.menuHandler("OUT"))
-        filemenu.add_command(label="Adjustment",
-                             command=lambda: self.menuHandler("ADJUST"))
-        filemenu.add_command(label="Reports",
-                             command=lambda: self.menuHandler("REPORT"))
-        filemenu.add_separator()
-        filemenu.add_command(label="Quit", accelerator="Ctrl+Q",
-                             command=self._close)
-        # Check if the user is if type ADMIN, meaning he/she has the
-        # authority to change master data from the system. If not ADMIN
-        # then disable the option menu to avoid changes.
-        if self.login.usertype == "ADMIN":
-            optionmenu.add_command(label="User Management",
-                                   command=lambda: self.menuHandler("USERS"))
-            optionmenu.add_command(label="Cost Centers",
-                                   command=lambda: self.menuHandler("CCENTERS"))
-            print_trans_menu = tk.Menu(optionmenu, tearoff=0)
-            optionmenu.add_cascade(label="Print Transaction", menu=print_trans_menu)
-            print_trans_menu.add_command(label="Incoming",
-                                         command=lambda: self.menuHandler("PRINT_IN"))
-            print_trans_menu.add_command(label="Outgoing",
-                                         command=lambda: self.menuHandler("PRINT_OUT"))
-            print_trans_menu.add_command(label="Adjustment",
-                                         command=lambda: self.menuHandler("PRINT_ADJ"))
-
-        helpmenu.add_command(label="Help",
-                             command=lambda: self.menuHandler("HELP"))
-        helpmenu.add_command(label="License",
-                             command=lambda: self.menuHandler("LICENSE"))
-        helpmenu.add_command(label="About",
-                             command=lambda: self.menuHandler("ABOUT"))
+        self.setupMenu()
 
         # Create 6 buttons for product, in, out, adjustment,
         # reports, & settings.
@@ -235,17 +224,308 @@ class MainWindow(tk.Frame):
                                    fg="blue",
                                    bd=3,
                                    font=("Tahoma", 8, "bold"))
-        self.status_bar.grid(row=3, column=0, columnspan=2, sticky="we")
+        self.status_bar.grid(row=3, column=0, columnspan=3, sticky="we")
         # The function below will update the status bar every second to be
         # able to update the clock.
         self.updateStatusBar()
 
+        # Create the dashboard beside the buttons. Its figures are kept up
+        # to date by the database at posting time, so a refresh only reads
+        # a few rows and it is skipped when nothing changed.
+        data = loadConfig()
+        self.db = Database()
+        self.db.openDB(databaseName(data))
+        self.dashboard_ms = int(data.get('dashboard_refresh', 5) * 1000)
+        self.dashboard_key = None
+        self.dashboard = ttk.LabelFrame(self, text="Dashboard", padding=5)
+        self.dashboard.grid(row=0, column=2, rowspan=3, sticky="nesw")
+        self.kpi_vars = {}
+        labels = (("stock_value", "Stock Value"),
+                  ("below_min", "To Reorder"),
+                  ("receipts", "Receipts Today"),
+                  ("issues", "Issues Today"))
+        for row, (key, label) in enumerate(labels):
+            self.kpi_vars[key] = tk.StringVar()
+            tk.Label(self.dashboard, text=label + ":", anchor="w",
+                     font=("Tahoma", 10)).grid(row=row, column=0, sticky="w")
+            tk.Label(self.dashboard, textvariable=self.kpi_vars[key],
+                     anchor="e", fg="blue", font=("Tahoma", 10, "bold")
+                     ).grid(row=row, column=1, sticky="e")
+        tk.Label(self.dashboard, text="Top Consumers This Month:", anchor="w",
+                 font=("Tahoma", 10)).grid(row=len(labels), column=0,
+                                           columnspan=2, sticky="w")
+        self.top_var = tk.StringVar()
+        tk.Label(self.dashboard, textvariable=self.top_var, anchor="nw",
+                 justify="left", fg="blue", width=36, height=5,
+                 font=("Courier", 9)).grid(row=len(labels) + 1, column=0,
+                                           columnspan=2, sticky="w")
+        self.updateDashboard()
+        # Finish the backfills the migrations left when the database was
+        # opened, a batch at a time so the window stays responsive.
+        self.runBackfills()
+        # Tell the open windows about the products and cost centers added
+        # or changed here or on other terminals.
+        self.feed = ChangeFeed(self.db)
+        self.change_ms = int(data.get('change_poll', 1) * 1000)
+        self.dashboard.after(self.change_ms, self.pollChanges)
+        # Maintain the database now and then while the data is not being
+        # changed, in steps short enough not to be noticed.
+        self.idle_since = time.time()
+        self.maintenance_ms = int(data.get('maintenance_interval', 600) * 1000)
+        self.dashboard.after(self.maintenance_ms, self.runMaintenance)
+        # Back up the database in the background every backup_hours.
+        self.db_name = databaseName(data)
+        self.backup = backupSettings(data)
+        self.backup_hours = data.get('backup_hours', 24)
+        self.backup_thread = None
+        if self.backup_hours:
+            self.dashboard.after(60000, self.scheduleBackup)
+        # An offline terminal works on a replica and exchanges its changes
+        # with master_db every sync_minutes when it can be reached.
+        self.master_db = data.get('master_db')
+        self.sync_minutes = data.get('sync_minutes', 5)
+        self.sync_thread = None
+        if self.master_db and self.sync_minutes and self.db.isReplica():
+            self.dashboard.after(60000, self.scheduleSync)
+        # With report_snapshot "copy" the reports read a copy of the
+        # database which is made again every report_snapshot_minutes.
+        self.snapshot = snapshotSettings(data)[1]
+        self.snapshot_thread = None
+        self.dashboard.after(1000, self.scheduleSnapshot)
+
+    def setupMenu(self):
+        """Create the menus, the options depend on the type of the user."""
+        # Create menubars and menus.
+        menubar = tk.Menu(self.master)
+        self.master["menu"] = menubar
+
+        filemenu = tk.Menu(menubar, tearoff=0)
+        optionmenu = tk.Menu(menubar, tearoff=0)
+        helpmenu = tk.Menu(menubar, tearoff=0)
+
+        menubar.add_cascade(label="File", menu=filemenu)
+        menubar.add_cascade(label="Option", menu=optionmenu)
+        menubar.add_cascade(label="Help", menu=helpmenu)
+
+        filemenu.add_command(label="Products",
+                             command=lambda: self.menuHandler("PRODUCT"))
+        filemenu.add_command(label="Incoming",
+                             command=lambda: self.menuHandler("IN"))
+        filemenu.add_command(label="Outgoing",
+                             command=lambda: self.menuHandler("OUT"))
+        filemenu.add_command(label="Adjustment",
+                             command=lambda: self.menuHandler("ADJUST"))
+        filemenu.add_command(label="Reports",
+                             command=lambda: self.menuHandler("REPORT"))
+        if len(warehouses(loadConfig())) > 1:
+            filemenu.add_command(label="Switch Warehouse",
+                                 command=lambda: self.menuHandler("SWITCH"))
+        if loadConfig().get('master_db'):
+            filemenu.add_command(label="Sync Now",
+                                 command=lambda: self.menuHandler("SYNC"))
+        filemenu.add_separator()
+        filemenu.add_command(label="Quit", accelerator="Ctrl+Q",
+                             command=self._close)
+        # Check if the user is if type ADMIN, meaning he/she has the
+        # authority to change master data from the system. If not ADMIN
+        # then disable the option menu to avoid changes.
+        if self.login.usertype == "ADMIN":
+            optionmenu.add_command(label="User Management",
+                                   command=lambda: self.menuHandler("USERS"))
+            optionmenu.add_command(label="Cost Centers",
+                                   command=lambda: self.menuHandler("CCENTERS"))
+            print_trans_menu = tk.Menu(optionmenu, tearoff=0)
+            optionmenu.add_cascade(label="Print Transaction", menu=print_trans_menu)
+            print_trans_menu.add_command(label="Incoming",
+                                         command=lambda: self.menuHandler("PRINT_IN"))
+            print_trans_menu.add_command(label="Outgoing",
+                                         command=lambda: self.menuHandler("PRINT_OUT"))
+            print_trans_menu.add_command(label="Adjustment",
+                                         command=lambda: self.menuHandler("PRINT_ADJ"))
+            optionmenu.add_command(label="Close Period",
+                                   command=lambda: self.menuHandler("CLOSE_PERIOD"))
+            optionmenu.add_command(label="Update Reorder Levels",
+                                   command=lambda: self.menuHandler("REORDER_LEVELS"))
+            optionmenu.add_command(label="Backup Now",
+                                   command=lambda: self.menuHandler("BACKUP"))
+            optionmenu.add_command(label="Archive Year",
+                                   command=lambda: self.menuHandler("ARCHIVE"))
+
+        helpmenu.add_command(label="Help",
+                             command=lambda: self.menuHandler("HELP"))
+        helpmenu.add_command(label="License",
+                             command=lambda: self.menuHandler("LICENSE"))
+        helpmenu.add_command(label="About",
+                             command=lambda: self.menuHandler("ABOUT"))
+
+    def updateTitle(self):
+        """Show the version and, with several warehouses, the selected one
+        in the title bar."""
+        title = ["JTS-Inventory", __version__]
+        if len(warehouses(loadConfig())) > 1:
+            title += ["-", warehouseName()]
+        self.master.title(" ".join(title))
+
     def updateStatusBar(self):
         """This method takes no argument and use only to update the statusbar."""
         mytime = time.strftime("%I:%M:%S %p | %A | %d-%b-%y | ")
         self.status_var.set(mytime+self.login.username.title())
         self.status_bar.after(1000, self.updateStatusBar)
 
+    def updateDashboard(self):
+        """Refresh the dashboard when the data or the day changed since the
+        last time and check again after the refresh interval."""
+        day = time.strftime("%Y-%m-%d")
+        key = (self.db.changeCounter(), day)
+        if key != self.dashboard_key:
+            self.dashboard_key = key
+            self.idle_since = time.time()
+            data = self.db.dashboard(day)
+            self.kpi_vars['stock_value'].set(
+                "{:0,.2f}".format(data['stock_value']))
+            self.kpi_vars['below_min'].set(
+                "%d item/s" % data['below_min'])
+            for kind in ("receipts", "issues"):
+                self.kpi_vars[kind].set(
+                    "{0} line/s, {1:0,.2f}".format(*data[kind]))
+            self.top_var.set("\n".join(
+                "{0:<10.10} {1:<12.12} {2:>12,.2f}".format(*item)
+                for item in data['top']))
+        self.dashboard.after(self.dashboard_ms, self.updateDashboard)
+
+    def runBackfills(self):
+        """Backfill one batch of the queued rows and come back while some
+        are left. The dashboard is read again after each batch."""
+        if self.db.backfillsLeft():
+            self.db.runBackfills(batch=BACKFILL_BATCH // 10, budget=0)
+            self.dashboard_key = None
+            self.after(100, self.runBackfills)
+
+    def pollChanges(self):
+        """Pass the changed master data to the windows which subscribed to
+        it, then check again after the poll interval."""
+        self.feed.poll()
+        self.dashboard.after(self.change_ms, self.pollChanges)
+
+    def scheduleBackup(self):
+        """Start a backup when the newest one is older than backup_hours,
+        then check again in ten minutes."""
+        age = time.time() - self.backup.latest(self.db_name)
+        if age >= self.backup_hours * 3600:
+            self.startBackup()
+        self.dashboard.after(600000, self.scheduleBackup)
+
+    def startBackup(self, notify=False):
+        """Back up the database in a thread so the windows stay usable,
+        with notify the outcome is shown when it is done."""
+        if self.backup_thread is not None and self.backup_thread.is_alive():
+            if notify:
+                mb.showinfo("Information", "A backup is already running.")
+            return
+        self.backup_result = None
+
+        def run():
+            try:
+                self.backup_result = self.backup.run(self.db_name)
+            except (OSError, sqlite3.Error) as error:
+                self.backup_result = error
+
+        self.backup_thread = threading.Thread(target=run, daemon=True)
+        self.backup_thread.start()
+        if notify:
+            self.dashboard.after(1000, self.checkBackup)
+
+    def checkBackup(self):
+        """Show the outcome of the backup once its thread is done."""
+        if self.backup_thread.is_alive():
+            self.dashboard.after(1000, self.checkBackup)
+        elif isinstance(self.backup_result, Exception):
+            mb.showerror("Error", "Backup failed: %s" % self.backup_result)
+        else:
+            mb.showinfo("Information", "Database saved to %s in %.1f s."
+                        % (self.backup_result, self.backup.seconds))
+
+    def scheduleSync(self):
+        """Sync the replica with the master database, then again after
+        sync_minutes."""
+        self.startSync()
+        self.dashboard.after(int(self.sync_minutes * 60000), self.scheduleSync)
+
+    def startSync(self, notify=False):
+        """Sync the replica in a thread with its own connection so the
+        windows stay usable, with notify the outcome is shown when it is
+        done. An unreachable master is tried again next time."""
+        if not self.db.isReplica():
+            if notify:
+                mb.showwarning("Warning", "%s is not a replica of %s."
+                               % (self.db_name, self.master_db))
+            return
+        if self.sync_thread is not None and self.sync_thread.is_alive():
+            if notify:
+                mb.showinfo("Information", "A sync is already running.")
+            return
+        self.sync_result = None
+
+        def run():
+            db = Database()
+            try:
+                db.openDB(self.db_name)
+                self.sync_result = db.sync(self.master_db)
+            except (IOError, ValueError, sqlite3.Error) as error:
+                self.sync_result = error
+            finally:
+                db.closeDB()
+
+        self.sync_thread = threading.Thread(target=run, daemon=True)
+        self.sync_thread.start()
+        if notify:
+            self.dashboard.after(1000, self.checkSync)
+
+    def checkSync(self):
+        """Show the outcome of the sync once its thread is done."""
+        if self.sync_thread.is_alive():
+            self.dashboard.after(1000, self.checkSync)
+        elif isinstance(self.sync_result, Exception):
+            mb.showerror("Error", "Sync failed: %s" % self.sync_result)
+        else:
+            result = self.sync_result
+            text = ("%d document/s sent, %d rejected, %d row/s received."
+                    % (result['pushed'], result['rejected'], result['pulled']))
+            if result['conflicts']:
+                text += "\nKept as on the master: %s" % ", ".join(
+                    code for table, code in result['conflicts'])
+            mb.showinfo("Information", text)
+
+    def scheduleSnapshot(self):
+        """Copy the database for the reports in a thread when the copy is
+        stale, then check again in a minute."""
+        if (self.snapshot is not None and self.snapshot.stale() and
+                (self.snapshot_thread is None or
+                 not self.snapshot_thread.is_alive())):
+            snapshot = self.snapshot
+
+            def run():
+                try:
+                    snapshot.refresh()
+                except (OSError, sqlite3.Error):
+                    # The reports make the copy themselves if there is none.
+                    pass
+
+            self.snapshot_thread = threading.Thread(target=run, daemon=True)
+            self.snapshot_thread.start()
+        self.dashboard.after(60000, self.scheduleSnapshot)
+
+    def runMaintenance(self):
+        """Run the due database maintenance for half a second at most when
+        no data changed for a minute, then check again later."""
+        if time.time() - self.idle_since >= 60:
+            try:
+                self.db.maintain(budget=0.5)
+            except sqlite3.OperationalError:
+                # Another window is writing, try again next time.
+                pass
+        self.dashboard.after(self.maintenance_ms, self.runMaintenance)
+
     def menuHandler(self, data):
         """This method is use for menubar bar commands handler."""
         if data.title() == "Product":
@@ -262,6 +542,24 @@ class MainWindow(tk.Frame):
             UsersWindow(self)
         elif data.title() == "Ccenters":
             CostCenterWindow(self)
+        elif data.title() == "Close_Period":
+            self.closePeriod()
+        elif data.title() == "Reorder_Levels":
+            self.updateReorderLevels()
+        elif data.title() == "Backup":
+            self.startBackup(notify=True)
+        elif data.title() == "Archive":
+            self.archiveYear()
+        elif data.title() == "Switch":
+            self.switchWarehouse()
+        elif data.title() == "Sync":
+            self.startSync(notify=True)
+        elif data.title() == "Print_In":
+            ReprintWindow(self, kind="incoming")
+        elif data.title() == "Print_Out":
+            ReprintWindow(self, kind="outgoing")
+        elif data.title() == "Print_Adj":
+            ReprintWindow(self, kind="adjustment")
         elif data.title() == "Help":
             HelpWindow(self)
         elif data.title() == "License":
@@ -271,6 +569,97 @@ class MainWindow(tk.Frame):
         else:
             pass
 
+    def switchWarehouse(self):
+        """Log in to another warehouse and show its figures. The windows
+        already open work on the current one so they are closed first."""
+        if any(isinstance(child, tk.Toplevel)
+               for child in self.winfo_children()):
+            mb.showwarning("Warning", "Close the other windows first.")
+            return
+        if self.backup_thread is not None and self.backup_thread.is_alive():
+            mb.showwarning("Warning", "Wait for the backup to finish.")
+            return
+        if self.sync_thread is not None and self.sync_thread.is_alive():
+            mb.showwarning("Warning", "Wait for the sync to finish.")
+            return
+        login = LoginWindow(self.master, switch=True)
+        self.wait_window(login)
+        if not login.status:
+            return
+        self.login = login
+        self.setupMenu()
+        self.setting_btn.config(
+            state="normal" if login.usertype == "ADMIN" else "disable")
+        self.updateTitle()
+        self.db.closeDB()
+        self.db = Database()
+        self.db.openDB(databaseName(loadConfig()))
+        self.db_name = databaseName(loadConfig())
+        self.feed = ChangeFeed(self.db)
+        self.snapshot = snapshotSettings(loadConfig())[1]
+        self.dashboard_key = None
+        self.idle_since = time.time()
+
+    def closePeriod(self):
+        """Ask for a period end date and write its closing stock snapshot."""
+        ask = DateWindow(self, title="Close Period", date=lastMonthEnd())
+        self.wait_window(ask)
+        if not ask.status:
+            return
+        db = Database()
+        db.openDB(databaseName(loadConfig()))
+        try:
+            count = db.closePeriod(ask.date_to)
+        finally:
+            db.closeDB()
+        mb.showinfo("Information",
+                    "Period closed on %s for %d product/s." % (ask.date_to, count))
+
+    def archiveYear(self):
+        """Ask for a date and move the transactions up to the end of its
+        year into the archive databases."""
+        last_year = int(time.strftime("%Y")) - 1
+        ask = DateWindow(self, title="Archive Up To Year End",
+                         date="31-12-%d" % last_year)
+        self.wait_window(ask)
+        if not ask.status:
+            return
+        year = int(ask.date_to[6:10])
+        if year > last_year:
+            mb.showerror("Error", "Only past years can be archived.")
+            return
+        check = mb.askokcancel(
+            "Warning", "Move all transactions up to 31-12-%d into the "
+            "archives? Back up the database first." % year)
+        if not check:
+            return
+        data = loadConfig()
+        db = Database()
+        db.openDB(databaseName(data))
+        try:
+            count = db.archiveYear(year, data.get('archive_dir', 'archive'))
+        finally:
+            db.closeDB()
+        mb.showinfo("Information", "%d line/s archived." % count)
+
+    def updateReorderLevels(self):
+        """Replace the min and max of the products with issues by the
+        levels suggested by the demand forecast."""
+        check = mb.askokcancel(
+            "Warning", "Replace the min and max of the products with the "
+            "forecast levels?")
+        if not check:
+            return
+        data = loadConfig()
+        db = Database()
+        db.openDB(databaseName(data))
+        try:
+            count = applyForecast(
+                db, demandForecast(db, **forecastSettings(data)))
+        finally:
+            db.closeDB()
+        mb.showinfo("Information", "%d product/s updated." % count)
+
     def eventHandler(self, event):
         """This method is use for button event handling."""
         command = event.widget.cget('text')
@@ -306,10 +695,63 @@ class MainWindow(tk.Frame):
         # Ask first if user wants to quit or not. If so close the app.
         askquit = mb.askokcancel("Quit?", "Close the application?")
         if askquit:
+            if getattr(self, 'db', None) is not None and self.db.status:
+                self.db.closeDB()
             self.master.destroy()
         else:
             return
 
+# Start of ChangeFeed class.
+class ChangeFeed:
+    """Tell the open windows which products and cost centers changed.
+
+    Windows subscribe a callback per table. poll() reads the changelog
+    entries written since the last poll, by this or any other terminal,
+    and calls every callback of a table once with a dictionary of the
+    changed row ids to their last operation, I, U or D. When maintenance
+    pruned entries written since the last poll every callback gets None
+    instead and reads its rows again."""
+
+    def __init__(self, db):
+        self.db = db
+        self.last = db.lastChange()
+        self.subscribers = {}
+
+    def subscribe(self, table, callback):
+        self.subscribers.setdefault(table, []).append(callback)
+
+    def unsubscribe(self, table, callback):
+        if callback in self.subscribers.get(table, []):
+            self.subscribers[table].remove(callback)
+
+    def poll(self):
+        """Deliver the changes since the last poll, return their number."""
+        entries = self.db.changes(self.last)
+        if not entries:
+            return 0
+        # The ids have no gaps, unless maintenance pruned entries which
+        # this feed has not delivered yet.
+        pruned = self.db.firstChange() > self.last + 1
+        self.last = entries[-1][0]
+        if pruned:
+            for table, callbacks in self.subscribers.items():
+                for callback in list(callbacks):
+                    callback(table, None)
+            return len(entries)
+        tables = {}
+        for entry_id, table, row_id, op in entries:
+            rows = tables.setdefault(table, {})
+            # A row inserted and changed since the last poll is still new
+            # to the windows.
+            if op == "U" and rows.get(row_id) == "I":
+                continue
+            rows[row_id] = op
+        for table, rows in tables.items():
+            for callback in list(self.subscribers.get(table, [])):
+                callback(table, rows)
+        return len(entries)
+# End of ChangeFeed class.
+
 # Start of ReportWindow class.
 class ReportWindow(tk.Toplevel):
 
@@ -318,12 +760,28 @@ class ReportWindow(tk.Toplevel):
         # Open the config file using json module.
         with open('config.json', 'r') as cf:
             data = json.load(cf)
-        # Initialize database.
+        # Initialize database. The reports read a snapshot so they never
+        # slow the postings down and all their pages agree, either a read
+        # transaction held while one is written or a copy of the database.
         self.db = Database()
-        db = data['default_db']
-        self.db.openDB(db)
+        self.db_name = databaseName(data)
+        self.snapshot_mode, snapshot = snapshotSettings(data)
+        if snapshot is not None:
+            self.db.openDB(snapshot.path())
+        else:
+            self.db.openDB(self.db_name)
+        # Rendered reports are served again until the data changes.
+        self.cache = ReportCache(max_bytes=data.get('report_cache_mb', 50) * 1024 * 1024)
+        ReportOutput(keep_days=data.get('report_keep_days', 30)).cleanup()
         # Load the grahical user interface.
         self.setupUI()
+        if self.snapshot_mode != data.get('report_snapshot', 'transaction'):
+            copied = time.localtime(os.path.getmtime(self.db.dbName()))
+            tk.Label(self, text="The database is not in WAL mode, the "
+                     "reports read a copy made at %s."
+                     % time.strftime("%H:%M", copied),
+                     fg="blue", wraplength=190,
+                     justify="left").pack(side="bottom", fill="x")
 
     def setupUI(self):
         self.title("Reports")
@@ -335,8 +793,13 @@ class ReportWindow(tk.Toplevel):
         rep_config = ["Current_Stock", "Stock_Ledger",
                       "Closing_Stock", "Reorder_Level",
                       "Incoming", "Outgoing",
-                      "Adjustment", "Consumption"
+                      "Adjustment", "Consumption",
+                      "Valuation", "Analytics",
+                      "ABC_Analysis", "Slow_Movers",
+                      "Forecast"
                       ]
+        if len(warehouses(loadConfig())) > 1:
+            rep_config.append("Group_Stock")
         rep_config.sort()
         self.option_list = tk.Listbox(mainframe, activestyle='none',
                                       relief="flat", selectforeground="white",
@@ -353,90 +816,102 @@ class ReportWindow(tk.Toplevel):
     def eventHandler(self, event):
         pos = event.widget.curselection()[0]
         list_value = event.widget.get(pos)
-        stock = """
-                Select
-                products.id,
-                code,
-                description,
-                unit,
-                (Select Avg(price) From in_transaction Where product_id=products.id),
-                (Select Sum(quantity) From in_transaction Where product_id=products.id),
-                (Select Sum(quantity) From out_transaction Where product_id=products.id),
-                (Select Sum(quantity) From adjust_trans Where product_id=products.id)
-                From products
-                Left Outer Join in_transaction On products.id = in_transaction.product_id
-                Left Outer Join out_transaction On products.id = out_transaction.product_id
-                Left Outer Join adjust_trans On products.id = adjust_trans.product_id
-                Group By products.id
-                """
-        query = self.db.cur.execute(stock)
-        data = query.fetchall()
+        today = time.strftime("%d-%b-%Y")
+        formats = ("PDF", "CSV", "HTML", "JSON")
         if list_value == "Current_Stock":
-            amount = 0
-            options = {'mode': "currentstock"}
-            pdf = PDF(**options)
-            pdf.alias_nb_pages()
-            pdf.add_page()
-            # The rest of the report will be inserted here.
-            pdf.set_font('Courier', '', 10)
-            for item in data:
-                rate = item[4]
-                rec_qty = item[5]
-                iss_qty = item[6]
-                adj_qty = item[7]
-                if item[5] == None:
-                    rec_qty = 0.0
-                if item[4] == None:
-                    rate = 0.0
-                if item[6] == None:
-                    iss_qty = 0.0
-                if item[7] == None:
-                    adj_qty = 0.0
-                qty = rec_qty - iss_qty + adj_qty
-                value = qty * rate
-                amount += value
-                pdf.cell(15, 10, str(item[0]), 0, 0, 'C')
-                pdf.cell(30, 10, item[1], 0, 0, 'C')
-                pdf.cell(60, 10, item[2][0:25])
-                pdf.cell(15, 10, item[3], 0, 0, 'C')
-                pdf.cell(20, 10, format(qty, '0.2f'), 0, 0, 'R')
-                pdf.cell(20, 10, format(rate, '0.2f'), 0, 0, 'R')
-                pdf.cell(30, 10, format(value, '0,.2f'), 0, 0, 'R')
-                pdf.ln(5)
-            pdf.ln(25)
-            pdf.set_font('Courier', 'B', 10)
-            pdf.cell(0, 7, "Total Amount: " + format(amount, '0,.2f'), 1, 0, 'R')
-            pdf.output('reports/currentstock.pdf', 'F')
-
-            try:
-                os.system('start '+'reports/currentstock.pdf')
-                self._close()
-            except:
-                print("Error Printing")
+            path = self.cachedReport("currentstock", (today,), "pdf")
         elif list_value == "Stock_Ledger":
             mb.showinfo("Information", "Available Soon!")
             self._close()
+            return
         elif list_value == "Closing_Stock":
-            mb.showinfo("Information", "Available Soon!")
-            self._close()
+            ask = DateWindow(self, title="Closing Stock", formats=formats)
+            self.wait_window(ask)
+            if not ask.status:
+                return
+            path = self.cachedReport("closingstock", (ask.date_to,),
+                                     ask.output.lower(), ask.date_to)
         elif list_value == "Reorder_Level":
-            mb.showinfo("Information", "Available Soon!")
-            self._close()
-        elif list_value == "Incoming":
-            mb.showinfo("Information", "Available Soon!")
-            self._close()
-        elif list_value == "Outgoing":
-            mb.showinfo("Information", "Available Soon!")
-            self._close()
-        elif list_value == "Adjustment":
-            mb.showinfo("Information", "Available Soon!")
-            self._close()
+            path = self.cachedReport("reorder", (today,), "pdf")
+        elif list_value == "Valuation":
+            path = self.cachedReport("valuation", (today,), "pdf")
+        elif list_value in ("Incoming", "Outgoing", "Adjustment"):
+            kind = list_value.lower()
+            ask = DateWindow(self, title=list_value, date_range=True,
+                             formats=formats)
+            self.wait_window(ask)
+            if not ask.status:
+                return
+            path = self.cachedReport(kind + "_register",
+                                     (ask.date_from, ask.date_to),
+                                     ask.output.lower(), kind,
+                                     ask.date_from, ask.date_to)
+        elif list_value == "ABC_Analysis":
+            ask = DateWindow(self, title="ABC Analysis", formats=formats)
+            self.wait_window(ask)
+            if not ask.status:
+                return
+            path = self.cachedReport("abc", (ask.date_to,),
+                                     ask.output.lower(), ask.date_to)
+        elif list_value == "Slow_Movers":
+            path = self.cachedReport("slow_movers", (today,), "pdf")
+        elif list_value == "Forecast":
+            # The forecast is made with the settings of config.json, which
+            # can change without a change to the database.
+            settings = tuple(sorted(forecastSettings(loadConfig()).items()))
+            path = self.cachedReport("forecast", (today, settings), "pdf")
+        elif list_value == "Group_Stock":
+            # The change counter only covers this warehouse, so the group
+            # report is not cached.
+            try:
+                path = ReportOutput().create("group_stock", "pdf", writeReport,
+                                             self.db, "group_stock", "pdf")
+            except ValueError as error:
+                mb.showerror("Error", str(error))
+                return
+        elif list_value == "Analytics":
+            ask = DateWindow(self, title="Analytics", date_range=True,
+                             formats=formats)
+            self.wait_window(ask)
+            if not ask.status:
+                return
+            path = self.cachedReport("analytics",
+                                     (ask.date_from, ask.date_to),
+                                     ask.output.lower(),
+                                     ask.date_from, ask.date_to)
         elif list_value == "Consumption":
-            mb.showinfo("Information", "Available Soon!")
-            self._close()
+            ask = DateWindow(self, title="Consumption", date_range=True,
+                             formats=formats)
+            self.wait_window(ask)
+            if not ask.status:
+                return
+            path = self.cachedReport("consumption",
+                                     (ask.date_from, ask.date_to),
+                                     ask.output.lower(),
+                                     ask.date_from, ask.date_to)
         else:
             return
 
+        openReport(path)
+        self._close()
+
+    def cachedReport(self, name, params, fmt, *args):
+        """Return the file of report name in format fmt for params, writing
+        it only when the data changed since the last time the same report
+        was made. args are passed to the report source."""
+        pinned = self.snapshot_mode == "transaction" and self.db.beginSnapshot()
+        try:
+            seq = self.db.changeCounter()
+            # Every warehouse has its own counter, so its file is in the key.
+            path = self.cache.path(name, params + (self.db_name,), seq, fmt)
+            if not self.cache.fetch(path):
+                writeAtomic(path, writeReport, self.db, name, fmt, *args)
+                self.cache.evict(keep=path)
+        finally:
+            if pinned:
+                self.db.endSnapshot()
+        return path
+
     def _closeEvent(self, event):
         self._close()
 
@@ -449,6 +924,147 @@ class ReportWindow(tk.Toplevel):
             self.destroy()
 # End of ReportWindow class.
 
+# Start of ReprintWindow class.
+class ReprintWindow(tk.Toplevel):
+    """Print a saved incoming, outgoing or adjustment transaction."""
+
+    def __init__(self, master=None, kind="incoming", **kwargs):
+        tk.Toplevel.__init__(self, master, **kwargs)
+        self.kind = kind
+        with open('config.json', 'r') as cf:
+            data = json.load(cf)
+        self.db = Database()
+        db = databaseName(data)
+        self.db.openDB(db)
+        self.setupUI()
+
+    def setupUI(self):
+        self.title("Print " + self.kind.title())
+        self.protocol("WM_DELETE_WINDOW", self._close)
+        self.grab_set()
+        mainframe = ttk.Frame(self, padding="0.2i")
+        mainframe.pack(expand=True, fill="both")
+
+        ttk.Label(mainframe, text="Transaction ID:").grid(row=0, column=0,
+                                                          sticky="e")
+        self.transid_entry = tk.Entry(mainframe, width=12)
+        self.transid_entry.grid(row=0, column=1, padx=2, pady=2)
+        self.transid_entry.bind("<Return>", self._printEvent)
+        self.transid_entry.focus_set()
+
+        btn_frame = ttk.Frame(mainframe)
+        btn_frame.grid(row=1, column=0, columnspan=2,
+                       sticky="we", padx=5, pady=5)
+        self.print_btn = ttk.Button(btn_frame, text="Print",
+                                    command=self.printTransaction)
+        self.print_btn.grid(row=0, column=1, padx=2, pady=2)
+        self.close_btn = ttk.Button(btn_frame, text="Close",
+                                    command=self._close)
+        self.close_btn.grid(row=0, column=0, padx=2, pady=2)
+
+    def _printEvent(self, event):
+        self.printTransaction()
+
+    def printTransaction(self):
+        transid = self.transid_entry.get().strip()
+        if not transid.isdigit():
+            mb.showwarning("Invalid", "Invalid transaction id.")
+            return
+        path = reprintTransaction(self.db, self.kind, transid)
+        if path is None:
+            mb.showwarning("Invalid", "Transaction not found.")
+            return
+        openReport(path)
+
+    def _closeEvent(self, event):
+        self._close()
+
+    def _close(self):
+        try:
+            if self.db.status:
+                self.db.closeDB()
+        finally:
+            self.grab_release()
+            self.destroy()
+# End of ReprintWindow class.
+
+# Start of DateWindow class.
+class DateWindow(tk.Toplevel):
+    """Ask for a report date, or a date range if date_range is True."""
+
+    def __init__(self, master=None, title="Date", date=None,
+                 date_range=False, formats=None, **kwargs):
+        tk.Toplevel.__init__(self, master, **kwargs)
+        self.status = False
+        self.date_from = None
+        self.date_to = None
+        self.output = None
+        self.date_range = date_range
+        self.formats = formats
+        if date is None:
+            date = time.strftime("%d-%m-%Y")
+        self.setupUI(title, date)
+
+    def setupUI(self, title, date):
+        self.title(title)
+        self.protocol("WM_DELETE_WINDOW", self._close)
+        self.grab_set()
+        mainframe = ttk.Frame(self, padding="0.2i")
+        mainframe.pack(expand=True, fill="both")
+
+        ttk.Label(mainframe, text="(DD-MM-YYYY)").grid(row=0, column=1)
+        self.from_entry = tk.Entry(mainframe, width=12)
+        if self.date_range:
+            ttk.Label(mainframe, text="From:").grid(row=1, column=0, sticky="e")
+            self.from_entry.grid(row=1, column=1, padx=2, pady=2)
+            self.from_entry.insert('end', "01" + date[2:])
+        ttk.Label(mainframe, text="Date:").grid(row=2, column=0, sticky="e")
+        self.to_entry = tk.Entry(mainframe, width=12)
+        self.to_entry.grid(row=2, column=1, padx=2, pady=2)
+        self.to_entry.insert('end', date)
+        self.to_entry.focus_set()
+        if self.formats:
+            ttk.Label(mainframe, text="Output:").grid(row=3, column=0, sticky="e")
+            self.output_entry = ttk.Combobox(mainframe, values=self.formats,
+                                             state="readonly", width=9)
+            self.output_entry.grid(row=3, column=1, padx=2, pady=2)
+            self.output_entry.current(0)
+
+        btn_frame = ttk.Frame(mainframe)
+        btn_frame.grid(row=4, column=0, columnspan=2,
+                       sticky="we", padx=5, pady=5)
+        self.ok_btn = ttk.Button(btn_frame, text="Ok", command=self.accept)
+        self.ok_btn.grid(row=0, column=1, padx=2, pady=2)
+        self.cancel_btn = ttk.Button(btn_frame, text="Cancel",
+                                     command=self._close)
+        self.cancel_btn.grid(row=0, column=0, padx=2, pady=2)
+
+    def accept(self):
+        try:
+            if self.date_range:
+                isoDate(self.from_entry.get())
+                self.date_from = self.from_entry.get()
+            isoDate(self.to_entry.get())
+            self.date_to = self.to_entry.get()
+        except ValueError:
+            mb.showwarning("Invalid", "Invalid date.\nPlease use DD-MM-YYYY.")
+            return
+        if self.date_range and isoDate(self.date_from) > isoDate(self.date_to):
+            mb.showwarning("Invalid", "Invalid date range.")
+            return
+        if self.formats:
+            self.output = self.output_entry.get()
+        self.status = True
+        self._close()
+
+    def _closeEvent(self, event):
+        self._close()
+
+    def _close(self):
+        self.grab_release()
+        self.destroy()
+# End of DateWindow class.
+
 # Start of IncomingWindow class.
 class IncomingWindow(tk.Toplevel):
 
@@ -457,7 +1073,7 @@ class IncomingWindow(tk.Toplevel):
         with open('config.json', 'r') as cf:
             data = json.load(cf)
         self.db = Database()
-        db = data['default_db']
+        db = databaseName(data)
         self.db.openDB(db)
         self.setupUI()
 
@@ -661,7 +1277,6 @@ class IncomingWindow(tk.Toplevel):
 
             item_list = []
             counter = 1
-            amount = 0
             for child in children:
                 serial = counter
                 itemcode = self.product_view.item(child)['values'][0]
@@ -672,7 +1287,6 @@ class IncomingWindow(tk.Toplevel):
                 quantity = float(self.product_view.item(child)['values'][3])
                 price = float(self.product_view.item(child)['values'][4])
                 value = float(self.product_view.item(child)['values'][5])
-                amount += float(value)
                 item_list.append((str(serial), itemcode, desc, unit,
                                   quantity, price, value))
                 counter += 1
@@ -681,32 +1295,10 @@ class IncomingWindow(tk.Toplevel):
                        'date': date,
                        'dn_number': dn_number,
                        'supplier': supplier}
-            pdf = PDF(**options)
-            pdf.alias_nb_pages()
-            pdf.add_page()
-            # The rest of the report will be inserted here.
-            pdf.set_font('Courier', '', 10)
-            for item in item_list:
-                pdf.cell(15, 10, item[0])
-                pdf.cell(30, 10, item[1])
-                pdf.cell(60, 10, item[2][0:25])
-                pdf.cell(15, 10, item[3], 0, 0, 'C')
-                pdf.cell(20, 10, format(item[4], '0.2f'))
-                pdf.cell(20, 10, format(item[5], '0.2f'))
-                pdf.cell(30, 10, format(item[6], '0,.2f'))
-                pdf.ln(5)
-            pdf.ln(25)
-            pdf.set_font('Courier', 'B', 10)
-            pdf.cell(105, 7, "Remarks: "+remarks)
-            pdf.cell(15, 7, "")
-            pdf.cell(40, 7, "Total Amount:", 0, 0, 'C')
-            pdf.cell(30, 7, format(amount, '0,.2f'), 1, 0, 'C')
-            pdf.output('reports/incoming.pdf', 'F')
+            path = ReportOutput().create("incoming", "pdf", renderTransaction,
+                                         options, item_list, remarks)
 
-            try:
-                os.system('start '+'reports/incoming.pdf')
-            except:
-                print("Error Printing")
+            openReport(path)
         elif command == "Close":
             self._close()
 
@@ -923,9 +1515,11 @@ class ProductWindow(tk.Toplevel):
         with open('config.json', 'r') as cf:
             data = json.load(cf)
         self.db = Database()
-        db = data['default_db']
+        db = databaseName(data)
         self.db.openDB(db)
         self.setupUI()
+        self.feed = self.master.feed
+        self.feed.subscribe("products", self.applyChanges)
 
     def setupUI(self):
         pro_img_open = Image.open('images/barcode.png')
@@ -1007,16 +1601,47 @@ class ProductWindow(tk.Toplevel):
         if len(data) == 0:
             return
         for product in data:
-            price = str(format(product[4], '.2f'))
-            max_qty = str(format(product[5], '.2f'))
-            min_qty = str(format(product[6], '.2f'))
+            self.showProduct(product)
+
+    def showProduct(self, product):
+        """Add a products row to the view or refresh its line."""
+        price = str(format(product[4], '.2f'))
+        max_qty = str(format(product[5], '.2f'))
+        min_qty = str(format(product[6], '.2f'))
+        if not self.product_view.exists(str(product[0])):
             self.product_view.insert('', 'end', str(product[0]), text=str(product[0]))
-            self.product_view.set(str(product[0]), 'itemcode', str(product[1]))
-            self.product_view.set(str(product[0]), 'description', str(product[2]))
-            self.product_view.set(str(product[0]), 'unit', str(product[3]))
-            self.product_view.set(str(product[0]), 'price', price)
-            self.product_view.set(str(product[0]), 'max', max_qty)
-            self.product_view.set(str(product[0]), 'min', min_qty)
+        self.product_view.set(str(product[0]), 'itemcode', str(product[1]))
+        self.product_view.set(str(product[0]), 'description', str(product[2]))
+        self.product_view.set(str(product[0]), 'unit', str(product[3]))
+        self.product_view.set(str(product[0]), 'price', price)
+        self.product_view.set(str(product[0]), 'max', max_qty)
+        self.product_view.set(str(product[0]), 'min', min_qty)
+
+    def applyChanges(self, table, rows):
+        """Apply the changed products, a dictionary of id to operation
+        from the ChangeFeed, to the view instead of reloading it. While
+        search results are shown only their lines are refreshed. rows is
+        None when the changes were pruned, then the whole list is shown
+        again."""
+        if rows is None:
+            self.updateView()
+            self.search_status = False
+            return
+        ids = []
+        for product_id, op in rows.items():
+            if op == "D":
+                if self.product_view.exists(str(product_id)):
+                    self.product_view.delete(str(product_id))
+            elif (not self.search_status or
+                  self.product_view.exists(str(product_id))):
+                ids.append(product_id)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            query = self.db.cur.execute(
+                """SELECT * FROM products WHERE id IN (%s) ORDER BY id"""
+                % ",".join("?" * len(chunk)), chunk)
+            for product in query.fetchall():
+                self.showProduct(product)
 
     def buttonHandler(self, data):
         if data == "NEW":
@@ -1077,6 +1702,7 @@ class ProductWindow(tk.Toplevel):
         self._close()
 
     def _close(self):
+        self.feed.unsubscribe("products", self.applyChanges)
         try:
             if self.db.status:
                 self.db.closeDB()
@@ -1160,7 +1786,7 @@ class NewProduct(tk.Toplevel):
                                         description=description, unit=unit,
                                         price=price, max_qty=max_qty,
                                         min_qty=min_qty)
-            self.master.updateView()
+            self.master.feed.poll()
             self._close()
         
     def _closeEvent(self, event):
@@ -1253,7 +1879,7 @@ class EditProduct(tk.Toplevel):
         self.master.db.updateRecord(table="products", productid=productid,
                                     description=description, price=price,
                                     max_qty=max_qty, min_qty=min_qty)
-        self.master.updateView()
+        self.master.feed.poll()
         self._close()
 
     def _closeEvent(self, event):
@@ -1264,9 +1890,13 @@ class EditProduct(tk.Toplevel):
         self.destroy()
 
 class LoginWindow(tk.Toplevel):
+    """Ask for the username, password and warehouse. Cancelling closes the
+    application unless switch is True, when the user is changing the
+    warehouse of a running session."""
 
-    def __init__(self, master=None, **kwargs):
+    def __init__(self, master=None, switch=False, **kwargs):
         tk.Toplevel.__init__(self, master, **kwargs)
+        self.switch = switch
         self.usertype = None
         self.username = None
         self.counter = 0
@@ -1306,6 +1936,20 @@ class LoginWindow(tk.Toplevel):
         self.pass_entry.grid(row=2, column=1, padx=2, pady=2)
         self.pass_entry.bind("<Return>", self.doLoginEvent)
 
+        # Let the user pick the warehouse when there are several of them.
+        self.stores = warehouses(loadConfig())
+        names = [name for name, db_name in self.stores]
+        self.store_box = None
+        if len(self.stores) > 1:
+            store_lbl = ttk.Label(top_frame, text="Warehouse:")
+            store_lbl.grid(row=3, column=0)
+            self.store_box = ttk.Combobox(top_frame, values=names,
+                                          state="readonly", width=18)
+            self.store_box.grid(row=3, column=1, padx=2, pady=2)
+            current = warehouseName()
+            self.store_box.current(names.index(current)
+                                   if current in names else 0)
+
         self.login_btn = ttk.Button(bottom_frame, text="Login")
         self.login_btn.config(command=self.doLogin)
         self.login_btn.pack(side="right")
@@ -1320,10 +1964,11 @@ class LoginWindow(tk.Toplevel):
         self.doLogin()
 
     def doLogin(self):
-        with open("config.json", "r") as cf:
-            data = json.load(cf)
+        if self.store_box is not None:
+            store, db = self.stores[self.store_box.current()]
+        else:
+            store, db = self.stores[0]
         self.db = Database()
-        db = data['default_db']
         self.db.openDB(db)
         self.counter += 1
         username = self.user_entry.get()
@@ -1353,6 +1998,7 @@ class LoginWindow(tk.Toplevel):
             mb.showinfo("Success", message)
             self.username = username
             self.usertype = str(data[3])
+            selectWarehouse(store, db)
             self.master.focus_set()
             self._close()
 
@@ -1376,7 +2022,7 @@ class LoginWindow(tk.Toplevel):
         self.geometry(pos)
 
     def _close(self):
-        if not self.status:
+        if not self.status and not self.switch:
             self.grab_release()
             self.destroy()
             self.master.iconify()
@@ -1397,7 +2043,7 @@ class UsersWindow(tk.Toplevel):
                 data = json.load(cf)
                 
             self.db = Database()
-            db = data['default_db']
+            db = databaseName(data)
             self.db.openDB(db)
         except:
             print(sys.exc_info()[1])
@@ -1644,9 +2290,11 @@ class OutgoingWindow(tk.Toplevel):
         with open('config.json', 'r') as cf:
             data = json.load(cf)
         self.db = Database()
-        db = data['default_db']
+        db = databaseName(data)
         self.db.openDB(db)
         self.setupUI()
+        self.feed = self.master.feed
+        self.feed.subscribe("costcenters", self.applyCostCenters)
 
     def setupUI(self):
         self.title("Outgoing")
@@ -1691,11 +2339,10 @@ class OutgoingWindow(tk.Toplevel):
         self.date_entry = tk.Entry(top_frame, width=12)
         self.date_entry.grid(row=1, column=3, padx=2, pady=2)
         self.date_entry.insert('end', time.strftime("%d-%m-%Y"))
-        query = self.db.cur.execute("""SELECT code from costcenters""")
-        combo_values = []
-        data = query.fetchall()
-        for code in data:
-            combo_values.append(code[0])
+        query = self.db.cur.execute("""SELECT id, code from costcenters""")
+        # The cost center codes by id, kept up to date by applyCostCenters.
+        self.costcenters = dict(query.fetchall())
+        combo_values = list(self.costcenters.values())
         self.costctr_entry = ttk.Combobox(top_frame, values=combo_values)
         self.costctr_entry.grid(row=1, column=1, sticky="w", padx=2, pady=2)
         self.rem_entry = tk.Entry(top_frame, width=60)
@@ -1848,7 +2495,6 @@ class OutgoingWindow(tk.Toplevel):
 
             item_list = []
             counter = 1
-            amount = 0
             for child in children:
                 serial = counter
                 itemcode = self.product_view.item(child)['values'][0]
@@ -1859,7 +2505,6 @@ class OutgoingWindow(tk.Toplevel):
                 quantity = float(self.product_view.item(child)['values'][3])
                 price = float(self.product_view.item(child)['values'][4])
                 value = float(self.product_view.item(child)['values'][5])
-                amount += float(value)
                 item_list.append((str(serial), itemcode, desc, unit,
                                   quantity, price, value))
                 counter += 1
@@ -1868,33 +2513,10 @@ class OutgoingWindow(tk.Toplevel):
                        'date': date,
                        'costctrcode': costctrcode,
                        'costctrname': costctrname}
-            pdf = PDF(**options)
-            pdf.alias_nb_pages()
-            pdf.add_page()
-            # The rest of the report will be inserted here.
-            pdf.set_font('Courier', '', 10)
-
-            for item in item_list:
-                pdf.cell(15, 10, item[0])
-                pdf.cell(30, 10, item[1])
-                pdf.cell(60, 10, item[2][0:25])
-                pdf.cell(15, 10, item[3], 0, 0, 'C')
-                pdf.cell(20, 10, format(item[4], '0.2f'))
-                pdf.cell(20, 10, format(item[5], '0.2f'))
-                pdf.cell(30, 10, format(item[6], '0,.2f'))
-                pdf.ln(5)
-            pdf.ln(25)
-            pdf.set_font('Courier', 'B', 10)
-            pdf.cell(105, 7, "Remarks: "+remarks)
-            pdf.cell(15, 7, "")
-            pdf.cell(40, 7, "Total Amount:", 0, 0, 'C')
-            pdf.cell(30, 7, format(amount, '0,.2f'), 1, 0, 'C')
-            pdf.output('reports/outgoing.pdf', 'F')
+            path = ReportOutput().create("outgoing", "pdf", renderTransaction,
+                                         options, item_list, remarks)
 
-            try:
-                os.system('start '+'reports/outgoing.pdf')
-            except:
-                print("Error Printing")
+            openReport(path)
         elif command == "Close":
             self._close()
 
@@ -1915,10 +2537,33 @@ class OutgoingWindow(tk.Toplevel):
         amount = "Total: %s" % format(amount, '0.2f')
         self.total_var.set(amount)
 
+    def applyCostCenters(self, table, rows):
+        """Apply the changed cost centers from the ChangeFeed to the codes
+        of the cost center box, all of them are read again if rows is
+        None."""
+        ids = []
+        if rows is None:
+            query = self.db.cur.execute("""SELECT id, code FROM costcenters""")
+            self.costcenters = dict(query.fetchall())
+            rows = {}
+        for costcenter_id, op in rows.items():
+            if op == "D":
+                self.costcenters.pop(costcenter_id, None)
+            else:
+                ids.append(costcenter_id)
+        if ids:
+            query = self.db.cur.execute(
+                """SELECT id, code FROM costcenters WHERE id IN (%s)"""
+                % ",".join("?" * len(ids)), ids)
+            self.costcenters.update(query.fetchall())
+        self.costctr_entry['values'] = [
+            self.costcenters[key] for key in sorted(self.costcenters)]
+
     def _closeEvent(self, event):
         self._close()
 
     def _close(self):
+        self.feed.unsubscribe("costcenters", self.applyCostCenters)
         try:
             if self.db.status:
                 self.db.closeDB()
@@ -2092,11 +2737,13 @@ class CostCenterWindow(tk.Toplevel):
                 data = json.load(cf)
                 
             self.db = Database()
-            db = data['default_db']
+            db = databaseName(data)
             self.db.openDB(db)
         except:
             print(sys.exc_info()[1])
         self.setupUI()
+        self.feed = self.master.feed
+        self.feed.subscribe("costcenters", self.applyChanges)
 
     def setupUI(self):
         self.title("Cost Centers")
@@ -2190,14 +2837,40 @@ class CostCenterWindow(tk.Toplevel):
             return
         else:
             for code in data:
-                self.costctr_view.insert('', 'end', str(code[0]), text=str(code[0]))
-                self.costctr_view.set(str(code[0]), 'code', str(code[1]))
-                self.costctr_view.set(str(code[0]), 'name', str(code[2]))
+                self.showCostCenter(code)
+
+    def showCostCenter(self, code):
+        """Add a costcenters row to the view or refresh its line."""
+        if not self.costctr_view.exists(str(code[0])):
+            self.costctr_view.insert('', 'end', str(code[0]), text=str(code[0]))
+        self.costctr_view.set(str(code[0]), 'code', str(code[1]))
+        self.costctr_view.set(str(code[0]), 'name', str(code[2]))
+
+    def applyChanges(self, table, rows):
+        """Apply the changed cost centers from the ChangeFeed to the view
+        instead of reloading it, unless rows is None."""
+        if rows is None:
+            self.updateView()
+            return
+        ids = []
+        for costcenter_id, op in rows.items():
+            if op == "D":
+                if self.costctr_view.exists(str(costcenter_id)):
+                    self.costctr_view.delete(str(costcenter_id))
+            else:
+                ids.append(costcenter_id)
+        if ids:
+            query = self.db.cur.execute(
+                """SELECT * FROM costcenters WHERE id IN (%s) ORDER BY id"""
+                % ",".join("?" * len(ids)), ids)
+            for code in query.fetchall():
+                self.showCostCenter(code)
 
     def _closeEvent(self, event):
         self._close()
 
     def _close(self):
+        self.feed.unsubscribe("costcenters", self.applyChanges)
         try:
             if self.db.status:
                 self.db.closeDB()
@@ -2250,7 +2923,7 @@ class NewCostCenter(tk.Toplevel):
             self.master.db.insertRecord(table="costcenters",
                                         code=code,
                                         name=name)
-            self.master.updateView()
+            self.master.feed.poll()
             self._close()
 
     def _closeEvent(self, event):
@@ -2261,11 +2934,90 @@ class NewCostCenter(tk.Toplevel):
         self.destroy()
 # End of NewCostCenter class.
 
+def applyMove(state, layers, move_id, qty, price):
+    """Apply a stock movement to the valuation of one product.
+
+    state is [quantity, average cost] and layers the open FIFO cost layers,
+    oldest first, as [move_id, remaining, cost]. Receipts (qty > 0) update
+    the moving weighted average and add a layer, after first covering any
+    negative stock. Issues leave the average as it is and use up the
+    oldest layers.
+    """
+    held, avg = state
+    if qty > 0:
+        state[1] = price if held <= 0 else (held * avg + qty * price) / (held + qty)
+        layer = qty + min(held, 0)
+        if layer > 0:
+            layers.append([move_id, layer, price])
+    else:
+        issue = -qty
+        used = 0
+        while issue > 1e-9 and used < len(layers):
+            take = min(issue, layers[used][1])
+            layers[used][1] -= take
+            issue -= take
+            if layers[used][1] <= 1e-9:
+                used += 1
+        del layers[:used]
+    state[0] = held + qty
+
+# Schema migrations applied by Database._migrate in this order, each in
+# its own transaction. PRAGMA user_version keeps the number of the last one
+# applied. Add new migrations at the end and never renumber them.
+MIGRATIONS = (
+    (1, "_createBackfill"),
+    (2, "_createSnapshot"),
+    (3, "_createStockBalance"),
+    (4, "_createChangeCounter"),
+    (5, "_createValuation"),
+    (6, "_createDailyUsage"),
+    (7, "_createKPI"),
+    (8, "_createMaintenance"),
+    (9, "_createArchives"),
+    (10, "_createChangelog"),
+    (11, "_createSync"),
+)
+# Rows handled per transaction by the backfills of the migrations.
+BACKFILL_BATCH = 100000
+# Seconds of backfilling done when a database is opened. The rest is done
+# by the main window while it is idle or by the migrate command.
+BACKFILL_BUDGET = 1.0
+# Days between two runs of ANALYZE and the pages freed per incremental
+# vacuum step by Database.maintain.
+ANALYZE_DAYS = 7
+VACUUM_PAGES = 256
+# Changelog entries kept by Database.maintain, the open windows only need
+# those since their last poll.
+CHANGELOG_KEEP = 100000
+# The ledger tables moved to the archives by Database.archiveYear and the
+# opening balance adjustments it leaves in their place.
+LEDGER_TABLES = ("incoming", "in_transaction", "outgoing", "out_transaction",
+                 "adjustment", "adjust_trans")
+OPENINGS = "SELECT opening_id FROM main.archives WHERE opening_id IS NOT NULL"
+# The documents Database.postDocument saves: header table, header fields
+# and line table.
+DOCUMENTS = {'incoming': ("incoming", ("date", "dn_number", "supplier",
+                                       "remarks"), "in_transaction"),
+             'outgoing': ("outgoing", ("date", "costcenter_id", "remarks"),
+                          "out_transaction"),
+             'adjustment': ("adjustment", ("date", "remarks"), "adjust_trans")}
+# The rows a replica adds are numbered from REPLICA_BASE up so they never
+# meet the ids of the master, Database.sync sends or reads SYNC_BATCH rows
+# per step. MASTER_TABLES are the master data a replica can change, with
+# the columns it sends, the code first.
+REPLICA_BASE = 1 << 40
+SYNC_BATCH = 500
+MASTER_TABLES = {'products': ("code", "description", "unit", "price", "max",
+                              "min"),
+                 'costcenters': ("code", "description")}
+
 class Database:
     
     def __init__(self):
         self.status = False
         self.salt = "mahalKitaPwedeBa@02251980"
+        self.history_views = False
+        self.snapshot = False
 
     def openDB(self, db_name):
         try:
@@ -2282,8 +3034,19 @@ class Database:
             else:
                 self.con = sqlite3.connect(db_name)
                 self.cur = self.con.cursor()
+                # Free pages can only be returned to the file system bit
+                # by bit if this is set before the first table.
+                self.cur.execute("""PRAGMA auto_vacuum = INCREMENTAL""")
                 self._createDB()
                 self.status = True
+            self._migrate()
+            # Value the moves a previous session journaled but did not post.
+            # _postValuation reads them again under the write lock, so two
+            # connections opening at once do not both post them.
+            if self._pendingMoves():
+                self.cur.execute("""BEGIN IMMEDIATE""")
+                self._postValuation()
+                self.con.commit()
 
     def closeDB(self):
         if self.status:
@@ -2347,6 +3110,1773 @@ class Database:
 
         self.con.commit()
 
+    def _migrate(self):
+        """Apply the migrations newer than the user_version of the database,
+        each in its own transaction, then run the backfills they queued for
+        up to BACKFILL_BUDGET seconds.
+
+        A failing migration is rolled back and raised, which leaves the
+        database at the last version applied.
+        """
+        query = self.cur.execute("""PRAGMA user_version""")
+        version = query.fetchone()[0]
+        for number, name in MIGRATIONS:
+            if number <= version:
+                continue
+            self.cur.execute("""BEGIN""")
+            try:
+                getattr(self, name)()
+                self.cur.execute("""PRAGMA user_version = %d""" % number)
+            except Exception:
+                self.con.rollback()
+                raise
+            self.con.commit()
+        self.runBackfills(budget=BACKFILL_BUDGET)
+
+    def _createBackfill(self):
+        """Create the backfill table of the jobs which fill new tables from
+        the rows of source up to id last. done is the last id handled."""
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS
+            backfill(name TEXT, source TEXT, done INTEGER, last INTEGER,
+            PRIMARY KEY(name, source))""")
+
+    def _queueBackfill(self, name, source):
+        """Queue the backfill method name over the rows of source which
+        exist now, rows added later are left to the triggers."""
+        self.cur.execute(
+            """INSERT OR REPLACE INTO backfill
+            SELECT ?, ?, 0, IFNULL(MAX(id), 0) FROM %s""" % source,
+            (name, source))
+
+    def runBackfills(self, batch=BACKFILL_BATCH, budget=None):
+        """Run the queued backfills batch rows at a time and return the
+        number of rows left.
+
+        Each batch is committed with its progress so an interrupted run
+        resumes where it stopped. With a budget in seconds it stops after
+        the first batch which ends past it, a budget of 0 runs one batch.
+        """
+        start = time.time()
+        query = self.cur.execute(
+            """SELECT name, source, done, last FROM backfill
+            WHERE done < last ORDER BY rowid""")
+        for name, source, done, last in query.fetchall():
+            while done < last:
+                end = min(done + batch, last)
+                getattr(self, name)(source, done + 1, end)
+                self.cur.execute(
+                    """UPDATE backfill SET done=?
+                    WHERE name=? AND source=?""", (end, name, source))
+                self.con.commit()
+                done = end
+                if budget is not None and time.time() - start >= budget:
+                    return self.backfillsLeft()
+        return 0
+
+    def backfillsLeft(self):
+        """Return the number of rows the queued backfills still have to
+        handle."""
+        query = self.cur.execute(
+            """SELECT IFNULL(SUM(last - done), 0) FROM backfill""")
+        return query.fetchone()[0]
+
+    def schemaVersion(self):
+        """Return the number of the last migration applied."""
+        return self.pragma("user_version")
+
+    def _createMaintenance(self):
+        """Create the maintenance table of the last run of every step."""
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS
+            maintenance(step TEXT PRIMARY KEY, run REAL, seconds REAL,
+            detail TEXT)""")
+
+    def maintain(self, budget=1.0, analyze_days=ANALYZE_DAYS):
+        """Run the maintenance steps which are due and return the
+        (step, seconds, detail) of those run. No step is started after
+        budget seconds.
+
+        ANALYZE samples the indexes (analysis_limit) and runs when the
+        statistics are older than analyze_days. Free pages are returned to
+        the file system VACUUM_PAGES at a time, which needs auto_vacuum
+        INCREMENTAL, and a WAL is checkpointed without waiting for readers.
+        The changelog is cut to its last CHANGELOG_KEEP entries.
+        """
+        self.con.commit()
+        start = time.time()
+        query = self.cur.execute("""SELECT step, run FROM maintenance""")
+        last = dict(query.fetchall())
+        done = []
+        for step in ("analyze", "optimize", "changelog", "vacuum",
+                     "checkpoint"):
+            began = time.time()
+            if began - start >= budget:
+                break
+            detail = None
+            if step == "analyze":
+                if began - last.get(step, 0) >= analyze_days * 86400:
+                    self.cur.execute("""PRAGMA analysis_limit = 1000""")
+                    self.cur.execute("""ANALYZE""")
+                    query = self.cur.execute(
+                        """SELECT COUNT(DISTINCT tbl) FROM sqlite_stat1""")
+                    detail = "%d tables" % query.fetchone()[0]
+            elif step == "optimize":
+                self.cur.execute("""PRAGMA optimize""")
+                detail = ""
+            elif step == "changelog":
+                self.cur.execute(
+                    """DELETE FROM changelog WHERE id <= ?""",
+                    (self.lastChange() - CHANGELOG_KEEP,))
+                removed = self.cur.rowcount
+                self.con.commit()
+                if removed > 0:
+                    detail = "%d entries removed" % removed
+            elif step == "vacuum":
+                page_size = self.pragma("page_size")
+                free = self.pragma("freelist_count")
+                if free and self.pragma("auto_vacuum") != 2:
+                    detail = ("%d bytes free, needs a full VACUUM"
+                              % (free * page_size))
+                elif free:
+                    pages = self.pragma("page_count")
+                    while free and time.time() - start < budget:
+                        self.cur.execute(
+                            """PRAGMA incremental_vacuum(%d)"""
+                            % VACUUM_PAGES).fetchall()
+                        free = self.pragma("freelist_count")
+                    pages -= self.pragma("page_count")
+                    detail = "%d bytes reclaimed, %d bytes free" % (
+                        pages * page_size, free * page_size)
+            elif step == "checkpoint":
+                if self.pragma("journal_mode") == "wal":
+                    query = self.cur.execute("""PRAGMA wal_checkpoint(PASSIVE)""")
+                    busy, frames, copied = query.fetchone()
+                    detail = "%d of %d frames copied" % (copied, frames)
+            if detail is None:
+                continue
+            seconds = time.time() - began
+            self.cur.execute(
+                """INSERT OR REPLACE INTO maintenance VALUES(?, ?, ?, ?)""",
+                (step, began, seconds, detail))
+            self.con.commit()
+            done.append((step, seconds, detail))
+        return done
+
+    def compact(self):
+        """Rebuild the database file with auto_vacuum INCREMENTAL, which
+        needs as much free disk space as the file, and return the bytes
+        reclaimed."""
+        self.con.commit()
+        before = os.path.getsize(self.dbName())
+        self.cur.execute("""PRAGMA auto_vacuum = INCREMENTAL""")
+        self.cur.execute("""VACUUM""")
+        return before - os.path.getsize(self.dbName())
+
+    def pragma(self, name):
+        """Return the value of PRAGMA name."""
+        return self.cur.execute("""PRAGMA %s""" % name).fetchone()[0]
+
+    def beginSnapshot(self):
+        """Start a read transaction in which every query of this connection
+        sees the database as it was at its start, until endSnapshot, and
+        return True. Writers go on meanwhile only in WAL mode, otherwise
+        nothing is started and False is returned, the reports then read a
+        copy (see snapshotSettings)."""
+        if self.pragma("journal_mode") != "wal":
+            return False
+        self.con.commit()
+        self.cur.execute("""BEGIN""")
+        # The snapshot is taken by the first read.
+        self.cur.execute("""SELECT COUNT(*) FROM sqlite_master""").fetchone()
+        self.snapshot = True
+        return True
+
+    def endSnapshot(self):
+        """End the read transaction of beginSnapshot."""
+        self.snapshot = False
+        self.con.rollback()
+
+    def dbName(self):
+        """Return the file name of the main database."""
+        query = self.cur.execute("""PRAGMA database_list""")
+        return query.fetchone()[2]
+
+    def _createArchives(self):
+        """Create the archives table of the years moved out by
+        archiveYear, with the file and the opening balance adjustment left
+        for each run."""
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS
+            archives(id INTEGER PRIMARY KEY AUTOINCREMENT, year INTEGER,
+            path TEXT, opening_id INTEGER, lines INTEGER, archived TEXT)""")
+
+    def archiveYear(self, year, folder='archive'):
+        """Move the transactions dated up to the end of year into one
+        database per year in folder and return the number of lines moved.
+
+        The stock is kept by an opening balance adjustment dated the first
+        day of the next year, and the cumulative receipts by the closing
+        snapshot of the year end. Neither changes the valuation or the
+        usage and dashboard tables.
+        """
+        if year >= int(time.strftime("%Y")):
+            raise ValueError("only past years can be archived")
+        query = self.cur.execute(
+            """SELECT MIN(day) FROM (
+            SELECT MIN({0}) AS day FROM incoming UNION ALL
+            SELECT MIN({0}) FROM outgoing UNION ALL
+            SELECT MIN({0}) FROM adjustment)""".format(ISO_DATE.format("date")))
+        first = query.fetchone()[0]
+        if first is None:
+            return 0
+        moved = 0
+        for each in range(int(first[0:4]), year + 1):
+            moved += self._archiveYear(each, folder)
+        return moved
+
+    def _archiveYear(self, year, folder):
+        start, end = "%d-01-01" % year, "%d-12-31" % year
+        where = "%s BETWEEN ? AND ?" % ISO_DATE.format("date")
+        count = 0
+        for header in ("incoming", "outgoing", "adjustment"):
+            query = self.cur.execute(
+                """SELECT COUNT(*) FROM main.%s WHERE %s""" % (header, where),
+                (start, end))
+            count += query.fetchone()[0]
+        if not count:
+            return 0
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        stem = os.path.splitext(os.path.basename(self.dbName()))[0]
+        path = '%s/%s-%d.db' % (folder, stem, year)
+        # The receipts up to the year end are needed for the rates of the
+        # closing stock after the lines are gone.
+        self.closePeriod("31-12-%d" % year)
+        self.cur.execute("""ATTACH DATABASE ? AS arch""", (path,))
+        try:
+            self._copySchema("arch")
+            self.cur.execute("""BEGIN""")
+            try:
+                moved = self._moveYear(year, path, where, (start, end))
+            except Exception:
+                self.con.rollback()
+                raise
+            self.con.commit()
+        finally:
+            self.cur.execute("""DETACH DATABASE arch""")
+        return moved
+
+    def _copySchema(self, schema):
+        """Create the master and ledger tables and the ledger indexes in the
+        attached database schema unless they exist."""
+        tables = ("products", "costcenters") + LEDGER_TABLES
+        query = self.cur.execute(
+            """SELECT type, sql FROM main.sqlite_master
+            WHERE tbl_name IN (%s) AND sql IS NOT NULL
+            AND type IN ('table', 'index')
+            ORDER BY type DESC""" % ", ".join("?" * len(tables)), tables)
+        for kind, sql in query.fetchall():
+            self.cur.execute(re.sub(
+                r"^CREATE (TABLE|INDEX)\s+(IF NOT EXISTS\s+)?",
+                r"CREATE \1 IF NOT EXISTS %s." % schema, sql))
+
+    def _moveYear(self, year, path, where, dates):
+        """Move the documents of year into the attached archive arch, leave
+        the opening balance adjustment and return the lines moved."""
+        net = {}
+        moved = 0
+        for header, lines, key, sign in (
+                ("incoming", "in_transaction", "incoming_id", 1),
+                ("outgoing", "out_transaction", "outgoing_id", -1),
+                ("adjustment", "adjust_trans", "adjustment_id", 1)):
+            in_year = "%s IN (SELECT id FROM main.%s WHERE %s)" % (
+                key, header, where)
+            query = self.cur.execute(
+                """SELECT product_id, SUM(quantity) FROM main.%s
+                WHERE %s GROUP BY product_id""" % (lines, in_year), dates)
+            for product_id, quantity in query:
+                net[product_id] = net.get(product_id, 0.0) + sign * quantity
+            query = self.cur.execute(
+                """SELECT MIN(id), MAX(id), COUNT(*) FROM main.%s WHERE %s"""
+                % (lines, in_year), dates)
+            first, last, count = query.fetchone()
+            moved += count
+            self.cur.execute(
+                """INSERT INTO arch.%s SELECT * FROM main.%s WHERE %s"""
+                % (header, header, where), dates)
+            self.cur.execute(
+                """INSERT INTO arch.%s SELECT * FROM main.%s WHERE %s"""
+                % (lines, lines, in_year), dates)
+            # The delete triggers take the lines off the balances and the
+            # usage tables, the usage of the past is added back below.
+            self.cur.execute(
+                """DELETE FROM main.%s WHERE %s""" % (lines, in_year), dates)
+            self.cur.execute(
+                """DELETE FROM main.%s WHERE %s""" % (header, where), dates)
+            if count and lines != "adjust_trans":
+                self._backfillTotals(lines, first, last, schema="arch")
+            if count and lines == "out_transaction":
+                self._backfillUsage(lines, first, last, schema="arch")
+        for table in ("products", "costcenters"):
+            self.cur.execute(
+                """INSERT OR REPLACE INTO arch.%s SELECT * FROM main.%s"""
+                % (table, table))
+        opening_id = None
+        rows = [(quantity, product_id) for product_id, quantity in net.items()
+                if abs(quantity) > 1e-9]
+        if rows:
+            self.cur.execute(
+                """INSERT INTO adjustment VALUES(null, ?, ?)""",
+                ("01-01-%d" % (year + 1), "Opening balance %d" % (year + 1)))
+            opening_id = self.cur.lastrowid
+            self.cur.executemany(
+                """INSERT INTO adjust_trans
+                SELECT null, %d, id, ?1, price,
+                CASE WHEN ?1 < 0 THEN 'minus' ELSE 'plus' END
+                FROM products WHERE id=?2""" % opening_id, rows)
+            # The stock was valued when the archived lines were posted.
+            self.cur.execute(
+                """DELETE FROM stock_move WHERE source='adj' AND line_id IN
+                (SELECT id FROM adjust_trans WHERE adjustment_id=?)""",
+                (opening_id,))
+        self.cur.execute(
+            """INSERT INTO archives VALUES(null, ?, ?, ?, ?, ?)""",
+            (year, path, opening_id, moved, time.strftime("%Y-%m-%d %H:%M:%S")))
+        return moved
+
+    def archivedUntil(self):
+        """Return the last day (YYYY-MM-DD) of the archived years, "" if
+        nothing is archived."""
+        query = self.cur.execute("""SELECT MAX(year) FROM archives""")
+        year = query.fetchone()[0]
+        return "%d-12-31" % year if year else ""
+
+    def history(self, date):
+        """Make the archived transactions part of the ledger tables of this
+        connection when date (YYYY-MM-DD, None for any date) is archived
+        and return True if they are.
+
+        The archives are attached and temporary views named after the
+        ledger tables, which hide the main ones, add their rows and leave
+        out the opening balance adjustments. The connection can only read
+        the ledgers after that.
+        """
+        if self.history_views:
+            return True
+        until = self.archivedUntil()
+        if not until or (date is not None and date > until):
+            return False
+        # Databases cannot be attached in a transaction, a snapshot is
+        # taken again after it.
+        snapshot = self.snapshot
+        if snapshot:
+            self.endSnapshot()
+        self.con.commit()
+        query = self.cur.execute(
+            """SELECT year, path FROM archives GROUP BY year ORDER BY year""")
+        schemas = ["main"]
+        for year, path in query.fetchall():
+            if not os.path.isfile(path):
+                raise IOError("archive of %d not found: %s" % (year, path))
+            self.cur.execute(
+                """ATTACH DATABASE ? AS arch%d""" % year, (path,))
+            schemas.append("arch%d" % year)
+        for table in LEDGER_TABLES:
+            where = ""
+            if table == "adjustment":
+                where = " WHERE id NOT IN (%s)" % OPENINGS
+            elif table == "adjust_trans":
+                where = " WHERE adjustment_id NOT IN (%s)" % OPENINGS
+            self.cur.execute("""CREATE TEMP VIEW %s AS %s""" % (
+                table, " UNION ALL ".join(
+                    "SELECT * FROM %s.%s%s" % (schema, table, where)
+                    for schema in schemas)))
+        self.history_views = True
+        if snapshot:
+            self.beginSnapshot()
+        return True
+
+    def _createSnapshot(self):
+        """Create the stock_snapshot table and the date and join indexes."""
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS
+            stock_snapshot(period TEXT, product_id INTEGER, quantity REAL,
+            value REAL, rec_qty REAL, rec_amount REAL,
+            PRIMARY KEY(period, product_id),
+            FOREIGN KEY(product_id) REFERENCES products(id))""")
+
+        # Date range lookups on the headers and header to line joins.
+        for table in ("incoming", "adjustment"):
+            self.cur.execute(
+                "CREATE INDEX IF NOT EXISTS idx_%s_date ON %s(%s)"
+                % (table, table, ISO_DATE.format("date")))
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS idx_in_transaction_incoming
+            ON in_transaction(incoming_id)""")
+        # The consumption report finds the issues of a period through the
+        # date index, then reads their lines from the covering line index
+        # alone. The headers themselves are still read, SQLite cannot take
+        # outgoing.date out of an index on an expression of it.
+        self.cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outgoing_date ON outgoing(%s, costcenter_id)"
+            % ISO_DATE.format("date"))
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS idx_out_transaction_outgoing
+            ON out_transaction(outgoing_id, product_id, quantity, price)""")
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS idx_adjust_trans_adjustment
+            ON adjust_trans(adjustment_id)""")
+
+    def _createChangeCounter(self):
+        """Create the data_seq table holding a counter which triggers raise
+        on every change of the master and transaction tables.
+
+        PRAGMA data_version only tells a connection about changes made by
+        other connections, the counter can be compared across connections
+        and sessions.
+        """
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS
+            data_seq(id INTEGER PRIMARY KEY, seq INTEGER)""")
+        self.cur.execute("""INSERT OR IGNORE INTO data_seq VALUES(1, 0)""")
+        for table in ("products", "costcenters", "incoming", "in_transaction",
+                      "outgoing", "out_transaction", "adjustment",
+                      "adjust_trans"):
+            for action in ("INSERT", "UPDATE", "DELETE"):
+                self.cur.execute("""CREATE TRIGGER IF NOT EXISTS
+                    data_seq_{0}_{2} AFTER {1} ON {0} BEGIN
+                    UPDATE data_seq SET seq = seq + 1 WHERE id=1; END
+                    """.format(table, action, action.lower()))
+
+    def changeCounter(self):
+        """Return the counter which changes whenever the data changes."""
+        query = self.cur.execute("""SELECT seq FROM data_seq WHERE id=1""")
+        return query.fetchone()[0]
+
+    def _createChangelog(self):
+        """Create the changelog table where triggers note the id of every
+        product and cost center inserted (I), updated (U) or deleted (D),
+        so open windows can apply just those rows."""
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS
+            changelog(id INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT,
+            row_id INTEGER, op TEXT)""")
+        for table in ("products", "costcenters"):
+            for action, op, row in (("INSERT", "I", "new"),
+                                    ("UPDATE", "U", "new"),
+                                    ("DELETE", "D", "old")):
+                self.cur.execute("""CREATE TRIGGER IF NOT EXISTS
+                    changelog_{0}_{1} AFTER {2} ON {0} BEGIN
+                    INSERT INTO changelog(tbl, row_id, op)
+                    VALUES('{0}', {3}.id, '{4}'); END
+                    """.format(table, action.lower(), action, row, op))
+
+    def lastChange(self):
+        """Return the id of the latest changelog entry, 0 if none."""
+        query = self.cur.execute("""SELECT IFNULL(MAX(id), 0) FROM changelog""")
+        return query.fetchone()[0]
+
+    def firstChange(self):
+        """Return the id of the oldest changelog entry, 0 if none."""
+        query = self.cur.execute("""SELECT IFNULL(MIN(id), 0) FROM changelog""")
+        return query.fetchone()[0]
+
+    def changes(self, since):
+        """Return the (id, table, row id, operation) changelog entries after
+        id since, oldest first."""
+        query = self.cur.execute(
+            """SELECT id, tbl, row_id, op FROM changelog WHERE id > ?
+            ORDER BY id""", (since,))
+        return query.fetchall()
+
+    def _createSync(self):
+        """Create the tables of the offline terminals. On a replica outbox
+        lists the documents saved there with the globally unique id they
+        are sent under, rejected those the master refused and sync_state
+        the high water marks of the sync. On the master received keeps
+        the ids already saved, so a document sent twice is saved once."""
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS
+            outbox(seq INTEGER PRIMARY KEY AUTOINCREMENT, uuid TEXT UNIQUE,
+            tbl TEXT, row_id INTEGER, created TEXT)""")
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS
+            rejected(uuid TEXT PRIMARY KEY, tbl TEXT, document TEXT,
+            error TEXT, rejected TEXT)""")
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS
+            sync_state(name TEXT PRIMARY KEY, value INTEGER)""")
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS
+            received(uuid TEXT PRIMARY KEY, tbl TEXT, transid INTEGER,
+            terminal TEXT, received TEXT)""")
+
+    def isReplica(self):
+        """Return True if the database is the replica of an offline
+        terminal."""
+        query = self.cur.execute(
+            """SELECT COUNT(*) FROM sync_state WHERE name='push'""")
+        return query.fetchone()[0] > 0
+
+    def syncMark(self, name):
+        """Return the high water mark name of the replica, 0 if not set."""
+        query = self.cur.execute(
+            """SELECT value FROM sync_state WHERE name=?""", (name,))
+        row = query.fetchone()
+        return row[0] if row else 0
+
+    def _setSyncMark(self, name, value):
+        self.cur.execute(
+            """INSERT OR REPLACE INTO sync_state VALUES(?, ?)""", (name, value))
+
+    def makeReplica(self):
+        """Turn this copy of a master database into a replica: the rows it
+        adds are numbered from REPLICA_BASE, every document saved is noted
+        in the outbox and the high water marks start at the copied rows."""
+        if self.isReplica():
+            raise ValueError("%s is a replica already" % self.dbName())
+        self.con.commit()
+        self.cur.execute("""BEGIN""")
+        try:
+            for table in (LEDGER_TABLES + tuple(MASTER_TABLES)
+                          + ("stock_move",)):
+                self.cur.execute(
+                    """UPDATE sqlite_sequence SET seq=MAX(seq, ?)
+                    WHERE name=?""", (REPLICA_BASE, table))
+                if not self.cur.rowcount:
+                    self.cur.execute(
+                        """INSERT INTO sqlite_sequence VALUES(?, ?)""",
+                        (table, REPLICA_BASE))
+            for table in DOCUMENTS:
+                self.cur.execute("""CREATE TRIGGER IF NOT EXISTS
+                    outbox_{0} AFTER INSERT ON {0} WHEN NEW.id >= {1} BEGIN
+                    INSERT INTO outbox(uuid, tbl, row_id, created)
+                    VALUES(lower(hex(randomblob(16))), '{0}', NEW.id,
+                    datetime('now')); END""".format(table, REPLICA_BASE))
+            for table in LEDGER_TABLES:
+                query = self.cur.execute(
+                    """SELECT IFNULL(MAX(id), 0) FROM %s""" % table)
+                self._setSyncMark(table, query.fetchone()[0])
+            self._setSyncMark('changelog', self.lastChange())
+            self._setSyncMark('local_changelog', self.lastChange())
+            self._setSyncMark('push', 0)
+            self._setSyncMark('synced', 0)
+        except Exception:
+            self.con.rollback()
+            raise
+        self.con.commit()
+
+    def pendingPostings(self):
+        """Return the number of documents of the replica not sent yet."""
+        query = self.cur.execute(
+            """SELECT COUNT(*) FROM outbox WHERE seq > ?""",
+            (self.syncMark('push'),))
+        return query.fetchone()[0]
+
+    def sync(self, master_name, batch=SYNC_BATCH):
+        """Send what this replica saved since the last sync to the database
+        master_name, bring over what changed there and return the counts.
+
+        The documents are saved on the master batch per transaction under
+        their outbox id, so a sync broken off after the master committed
+        sends them again without saving them twice. The replica then drops
+        its own copies, which come back with the ids the master gave them,
+        and takes the valuation of the products moved from the master.
+        The replica is locked for writing until the sync is done.
+        """
+        if not self.isReplica():
+            raise ValueError("%s is not a replica" % self.dbName())
+        if not os.path.isfile(master_name):
+            raise IOError("master database not reachable: %s" % master_name)
+        master = Database()
+        master.openDB(master_name)
+        try:
+            query = master.cur.execute("""SELECT COUNT(*) FROM archives""")
+            archived = query.fetchone()[0]
+            query = self.cur.execute("""SELECT COUNT(*) FROM archives""")
+            if archived != query.fetchone()[0]:
+                raise ValueError("the master archived a year since the "
+                                 "replica was made, make a new replica")
+            result = {'pushed': 0, 'duplicates': 0, 'rejected': 0,
+                      'master_data': 0, 'conflicts': [], 'pulled': 0}
+            self.con.commit()
+            self.cur.execute("""BEGIN IMMEDIATE""")
+            try:
+                mapping = self._pushMasterData(master, result)
+                self._pushPostings(master, mapping, batch, result)
+                self._pull(master, batch, result)
+                self._setSyncMark('synced', int(time.time()))
+            except Exception:
+                self.con.rollback()
+                raise
+            self.con.commit()
+        finally:
+            master.closeDB()
+        return result
+
+    def _pushMasterData(self, master, result):
+        """Send the products and cost centers changed on the replica to the
+        master and return {table: {replica id: master id}} of the rows it
+        added.
+
+        Conflicts keep the master's version and are listed in
+        result['conflicts']: a row the master changed or deleted since the
+        last pull, and a new row whose code the master has already, which
+        is then taken for it. Rows deleted on the replica are not sent, the
+        pull restores them. A row the master has as it is on the replica
+        is neither sent again nor a conflict, so a sync broken off after
+        the master committed can be repeated.
+        """
+        mark = self.syncMark('changelog')
+        query = master.cur.execute("""SELECT MIN(id) FROM changelog""")
+        first = query.fetchone()[0]
+        # Entries after the mark were removed by the maintenance, every
+        # row may have changed on the master.
+        pruned = first is not None and first > mark + 1
+        changed = set((table, row_id)
+                      for _, table, row_id, _ in master.changes(mark))
+        local = sorted(set((table, row_id) for _, table, row_id, op in
+                           self.changes(self.syncMark('local_changelog'))
+                           if op != "D"))
+        mapping = dict((table, {}) for table in MASTER_TABLES)
+        master.cur.execute("""BEGIN IMMEDIATE""")
+        try:
+            for table, row_id in local:
+                columns = MASTER_TABLES[table]
+                query = self.cur.execute(
+                    """SELECT %s FROM %s WHERE id=?"""
+                    % (", ".join(columns), table), (row_id,))
+                row = query.fetchone()
+                if row is None:
+                    continue
+                if row_id >= REPLICA_BASE:
+                    query = master.cur.execute(
+                        """SELECT id, %s FROM %s WHERE code=?
+                        ORDER BY id LIMIT 1""" % (", ".join(columns), table),
+                        (row[0],))
+                    found = query.fetchone()
+                    if found is not None:
+                        mapping[table][row_id] = found[0]
+                        if found[1:] != row:
+                            result['conflicts'].append((table, row[0]))
+                        continue
+                    master.cur.execute(
+                        """INSERT INTO %s(%s) VALUES(%s)"""
+                        % (table, ", ".join(columns),
+                           ", ".join("?" * len(columns))), row)
+                    mapping[table][row_id] = master.cur.lastrowid
+                else:
+                    query = master.cur.execute(
+                        """SELECT %s FROM %s WHERE id=?"""
+                        % (", ".join(columns), table), (row_id,))
+                    found = query.fetchone()
+                    if found == row:
+                        continue
+                    if (pruned or (table, row_id) in changed
+                            or found is None):
+                        result['conflicts'].append((table, row[0]))
+                        continue
+                    master.cur.execute(
+                        """UPDATE %s SET %s WHERE id=?"""
+                        % (table, ", ".join("%s=?" % c for c in columns)),
+                        row + (row_id,))
+                result['master_data'] += 1
+        except Exception:
+            master.con.rollback()
+            raise
+        master.con.commit()
+        return mapping
+
+    def _pushPostings(self, master, mapping, batch, result):
+        """Save the documents of the outbox after the push mark on the
+        master, batch per transaction. Those it refuses are kept in
+        rejected with the error."""
+        query = self.cur.execute(
+            """SELECT seq, uuid, tbl, row_id FROM outbox WHERE seq > ?
+            ORDER BY seq""", (self.syncMark('push'),))
+        entries = query.fetchall()
+        terminal = os.path.basename(self.dbName())
+        for start in range(0, len(entries), batch):
+            chunk = entries[start:start + batch]
+            master.cur.execute("""BEGIN IMMEDIATE""")
+            try:
+                for seq, uuid, kind, row_id in chunk:
+                    query = master.cur.execute(
+                        """SELECT transid FROM received WHERE uuid=?""",
+                        (uuid,))
+                    if query.fetchone() is not None:
+                        result['duplicates'] += 1
+                        continue
+                    header, items = self._outboxDocument(kind, row_id, mapping)
+                    master.cur.execute("""SAVEPOINT posting""")
+                    try:
+                        transid = master.postDocument(kind, header, items,
+                                                      commit=False)
+                    except (ValueError, sqlite3.IntegrityError) as error:
+                        master.cur.execute("""ROLLBACK TO posting""")
+                        master.cur.execute("""RELEASE posting""")
+                        self.cur.execute(
+                            """INSERT OR REPLACE INTO rejected
+                            VALUES(?, ?, ?, ?, datetime('now'))""",
+                            (uuid, kind, json.dumps(
+                                {'header': header, 'items': items}),
+                             str(error)))
+                        result['rejected'] += 1
+                        continue
+                    master.cur.execute(
+                        """INSERT INTO received
+                        VALUES(?, ?, ?, ?, datetime('now'))""",
+                        (uuid, kind, transid, terminal))
+                    master.cur.execute("""RELEASE posting""")
+                    result['pushed'] += 1
+            except Exception:
+                master.con.rollback()
+                raise
+            master.con.commit()
+            self._setSyncMark('push', chunk[-1][0])
+
+    def _outboxDocument(self, kind, row_id, mapping):
+        """Return the header dictionary and the items of the replica
+        document kind row_id with the master ids of its products and
+        cost center."""
+        table, fields, lines = DOCUMENTS[kind]
+        query = self.cur.execute(
+            """SELECT %s FROM %s WHERE id=?""" % (", ".join(fields), table),
+            (row_id,))
+        row = query.fetchone()
+        header = dict(zip(fields, row)) if row is not None else {}
+        if 'costcenter_id' in header:
+            header['costcenter_id'] = mapping['costcenters'].get(
+                header['costcenter_id'], header['costcenter_id'])
+        query = self.cur.execute(
+            """SELECT product_id, quantity, price FROM %s WHERE %s_id=?
+            ORDER BY id""" % (lines, table), (row_id,))
+        items = [(mapping['products'].get(product_id, product_id),
+                  quantity, price) for product_id, quantity, price in query]
+        return header, items
+
+    def _pull(self, master, batch, result):
+        """Replace the rows the replica added by those the master added or
+        changed since the high water marks, in one read transaction of the
+        master so the tables agree, and copy the valuation of the products
+        moved."""
+        moved = set()
+        # The lines go first, the usage triggers read the date of their
+        # header.
+        for kind in DOCUMENTS:
+            lines = DOCUMENTS[kind][2]
+            query = self.cur.execute(
+                """SELECT DISTINCT product_id FROM %s WHERE id >= ?"""
+                % lines, (REPLICA_BASE,))
+            moved.update(row[0] for row in query)
+            self.cur.execute(
+                """DELETE FROM %s WHERE id >= ?""" % lines, (REPLICA_BASE,))
+        for kind in DOCUMENTS:
+            query = self.cur.execute(
+                """SELECT DISTINCT date FROM %s WHERE id >= ?""" % kind,
+                (REPLICA_BASE,))
+            for row in query.fetchall():
+                self._reopenPeriods(row[0])
+            self.cur.execute(
+                """DELETE FROM %s WHERE id >= ?""" % kind, (REPLICA_BASE,))
+        self.cur.execute(
+            """DELETE FROM stock_move WHERE line_id >= ?""", (REPLICA_BASE,))
+        master.cur.execute("""BEGIN""")
+        try:
+            self._pullMasterData(master, result)
+            for table in ("incoming", "outgoing", "adjustment",
+                          "in_transaction", "out_transaction", "adjust_trans"):
+                mark = self.syncMark(table)
+                query = master.con.execute(
+                    """SELECT * FROM %s WHERE id > ? ORDER BY id""" % table,
+                    (mark,))
+                rows = query.fetchmany(batch)
+                while rows:
+                    self.cur.executemany(
+                        """INSERT INTO %s VALUES(%s)"""
+                        % (table, ", ".join("?" * len(rows[0]))), rows)
+                    if table in DOCUMENTS:
+                        for date in set(row[1] for row in rows):
+                            self._reopenPeriods(date)
+                    else:
+                        moved.update(row[2] for row in rows)
+                    result['pulled'] += len(rows)
+                    mark = rows[-1][0]
+                    rows = query.fetchmany(batch)
+                self._setSyncMark(table, mark)
+            self._pullValuation(master, sorted(moved))
+        finally:
+            master.con.rollback()
+        # The rows the replica added have come back with the master ids.
+        for table in ("stock_value", "cost_layer", "daily_usage",
+                      "monthly_usage", "stock_snapshot"):
+            self.cur.execute(
+                """DELETE FROM %s WHERE product_id >= ?""" % table,
+                (REPLICA_BASE,))
+        self.cur.execute(
+            """DELETE FROM costcenter_usage WHERE costcenter_id >= ?""",
+            (REPLICA_BASE,))
+        for table in MASTER_TABLES:
+            self.cur.execute(
+                """DELETE FROM %s WHERE id >= ?""" % table, (REPLICA_BASE,))
+        self._setSyncMark('local_changelog', self.lastChange())
+
+    def _pullMasterData(self, master, result):
+        """Copy the products and cost centers the master changed since the
+        changelog mark, or all of them when the master no longer has the
+        entries after it. Rows deleted on the replica are restored."""
+        mark = self.syncMark('changelog')
+        query = master.cur.execute("""SELECT MIN(id) FROM changelog""")
+        first = query.fetchone()[0]
+        ids = dict((table, set()) for table in MASTER_TABLES)
+        if first is not None and first > mark + 1:
+            for table in MASTER_TABLES:
+                for database in (master, self):
+                    query = database.cur.execute(
+                        """SELECT id FROM %s WHERE id < ?""" % table,
+                        (REPLICA_BASE,))
+                    ids[table].update(row[0] for row in query)
+        else:
+            for _, table, row_id, _ in master.changes(mark):
+                ids[table].add(row_id)
+        for _, table, row_id, op in self.changes(
+                self.syncMark('local_changelog')):
+            if op == "D" and row_id < REPLICA_BASE:
+                ids[table].add(row_id)
+        for table, row_ids in ids.items():
+            columns = ("id",) + MASTER_TABLES[table]
+            row_ids = sorted(row_ids)
+            for i in range(0, len(row_ids), 500):
+                chunk = row_ids[i:i + 500]
+                query = master.cur.execute(
+                    """SELECT %s FROM %s WHERE id IN (%s)"""
+                    % (", ".join(columns), table, ",".join("?" * len(chunk))),
+                    chunk)
+                rows = query.fetchall()
+                self.cur.executemany(
+                    """INSERT INTO %s(%s) VALUES(%s) ON CONFLICT(id)
+                    DO UPDATE SET %s""" % (
+                        table, ", ".join(columns), ", ".join("?" * len(columns)),
+                        ", ".join("%s=excluded.%s" % (c, c)
+                                  for c in columns[1:])), rows)
+                found = set(row[0] for row in rows)
+                self.cur.executemany(
+                    """DELETE FROM %s WHERE id=?""" % table,
+                    [(row_id,) for row_id in chunk if row_id not in found])
+                result['master_data'] += len(chunk)
+        self._setSyncMark('changelog', master.lastChange())
+
+    def _pullValuation(self, master, products):
+        """Copy the stock value and cost layers of products from the
+        master, the moves the replica journaled count as valued."""
+        for i in range(0, len(products), 500):
+            chunk = products[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            query = master.cur.execute(
+                """SELECT * FROM stock_value WHERE product_id IN (%s)"""
+                % marks, chunk)
+            rows = query.fetchall()
+            found = set(row[0] for row in rows)
+            self.cur.executemany(
+                """DELETE FROM stock_value WHERE product_id=?""",
+                [(product_id,) for product_id in chunk
+                 if product_id not in found])
+            self.cur.executemany(
+                """INSERT INTO stock_value VALUES(?, ?, ?, ?)
+                ON CONFLICT(product_id) DO UPDATE SET
+                quantity=excluded.quantity, avg_cost=excluded.avg_cost,
+                fifo_value=excluded.fifo_value""", rows)
+            self.cur.execute(
+                """DELETE FROM cost_layer WHERE product_id IN (%s)"""
+                % marks, chunk)
+            query = master.cur.execute(
+                """SELECT * FROM cost_layer WHERE product_id IN (%s)"""
+                % marks, chunk)
+            self.cur.executemany(
+                """INSERT INTO cost_layer VALUES(?, ?, ?, ?)""",
+                query.fetchall())
+        self.cur.execute(
+            """UPDATE valuation_state
+            SET last_move=(SELECT IFNULL(MAX(id), 0) FROM stock_move)
+            WHERE id=1""")
+
+    def _createStockBalance(self):
+        """Create the stock_balance table which keeps the on-hand quantity
+        and the min/max of every product, maintained by triggers."""
+        self.cur.execute("""CREATE TABLE
+            stock_balance(product_id INTEGER PRIMARY KEY, quantity REAL,
+            min REAL, max REAL,
+            FOREIGN KEY(product_id) REFERENCES products(id))""")
+        # Products below their minimum are found through this index, the
+        # query has to use the same expression "quantity - min".
+        self.cur.execute("""CREATE INDEX idx_stock_balance_short
+            ON stock_balance(quantity - min)""")
+        self.cur.execute("""CREATE TRIGGER stock_balance_product_insert
+            AFTER INSERT ON products BEGIN
+            INSERT OR REPLACE INTO stock_balance
+            VALUES(NEW.id, 0, NEW.min, NEW.max); END""")
+        self.cur.execute("""CREATE TRIGGER stock_balance_product_update
+            AFTER UPDATE OF min, max ON products BEGIN
+            UPDATE stock_balance SET min=NEW.min, max=NEW.max
+            WHERE product_id=NEW.id; END""")
+        self.cur.execute("""CREATE TRIGGER stock_balance_product_delete
+            AFTER DELETE ON products BEGIN
+            DELETE FROM stock_balance WHERE product_id=OLD.id; END""")
+        # Issues reduce the stock, receipts and adjustments (which are
+        # saved with their sign) add to it.
+        for table, sign in (("in_transaction", "+"),
+                            ("out_transaction", "-"),
+                            ("adjust_trans", "+")):
+            self.cur.execute("""CREATE TRIGGER stock_balance_{0}_insert
+                AFTER INSERT ON {0} BEGIN
+                UPDATE stock_balance SET quantity = quantity {1} NEW.quantity
+                WHERE product_id=NEW.product_id; END""".format(table, sign))
+            self.cur.execute("""CREATE TRIGGER stock_balance_{0}_delete
+                AFTER DELETE ON {0} BEGIN
+                UPDATE stock_balance SET quantity = quantity {1} -OLD.quantity
+                WHERE product_id=OLD.product_id; END""".format(table, sign))
+            self.cur.execute("""CREATE TRIGGER stock_balance_{0}_update
+                AFTER UPDATE OF product_id, quantity ON {0} BEGIN
+                UPDATE stock_balance SET quantity = quantity {1} -OLD.quantity
+                WHERE product_id=OLD.product_id;
+                UPDATE stock_balance SET quantity = quantity {1} NEW.quantity
+                WHERE product_id=NEW.product_id; END""".format(table, sign))
+        # Fill the balance of the products already in the database, the
+        # quantities are added by the backfills.
+        self.cur.execute("""INSERT INTO stock_balance
+            SELECT id, 0, min, max FROM products""")
+        for table in ("in_transaction", "out_transaction", "adjust_trans"):
+            self._queueBackfill("_backfillBalance", table)
+
+    def _backfillBalance(self, source, first, last):
+        """Add the quantities of the source lines first to last to
+        stock_balance."""
+        sign = "-" if source == "out_transaction" else "+"
+        self.cur.execute(
+            """UPDATE stock_balance
+            SET quantity = stock_balance.quantity {1} moved.quantity
+            FROM (SELECT product_id, SUM(quantity) AS quantity FROM {0}
+            WHERE id BETWEEN ? AND ? GROUP BY product_id) AS moved
+            WHERE stock_balance.product_id = moved.product_id
+            """.format(source, sign), (first, last))
+
+    def _createValuation(self):
+        """Create the stock valuation tables.
+
+        Triggers copy every receipt, issue and adjustment line into the
+        stock_move journal. _postValuation values the new moves into
+        stock_value, the quantity, moving average cost and FIFO value of
+        each product, and cost_layer, the open FIFO layers.
+        """
+        self.cur.execute("""CREATE TABLE
+            stock_move(id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER, source TEXT, line_id INTEGER,
+            quantity REAL, price REAL,
+            FOREIGN KEY(product_id) REFERENCES products(id))""")
+        self.cur.execute("""CREATE TABLE
+            stock_value(product_id INTEGER PRIMARY KEY, quantity REAL,
+            avg_cost REAL, fifo_value REAL,
+            FOREIGN KEY(product_id) REFERENCES products(id))""")
+        self.cur.execute("""CREATE TABLE
+            cost_layer(move_id INTEGER PRIMARY KEY, product_id INTEGER,
+            remaining REAL, cost REAL,
+            FOREIGN KEY(move_id) REFERENCES stock_move(id))""")
+        self.cur.execute("""CREATE INDEX idx_cost_layer_product
+            ON cost_layer(product_id, move_id)""")
+        self.cur.execute("""CREATE TABLE
+            valuation_state(id INTEGER PRIMARY KEY, last_move INTEGER)""")
+        self.cur.execute("""INSERT INTO valuation_state VALUES(1, 0)""")
+        # Issues are saved with a positive quantity, adjustments with
+        # their sign.
+        for table, source, sign in (("in_transaction", "in", ""),
+                                    ("out_transaction", "out", "-"),
+                                    ("adjust_trans", "adj", "")):
+            self.cur.execute("""CREATE TRIGGER stock_move_{0}_insert
+                AFTER INSERT ON {0} BEGIN
+                INSERT INTO stock_move(product_id, source, line_id,
+                quantity, price) VALUES(NEW.product_id, '{1}', NEW.id,
+                {2}NEW.quantity, NEW.price); END""".format(table, source, sign))
+        # Journal the lines already in the database in date order.
+        self.cur.execute("""INSERT INTO stock_move(product_id, source,
+            line_id, quantity, price)
+            SELECT product_id, source, line_id, quantity, price FROM (
+            SELECT {0} AS day, 0 AS rank, incoming.id AS head,
+            in_transaction.id AS line_id, product_id, 'in' AS source,
+            quantity, price FROM in_transaction
+            JOIN incoming ON incoming.id = in_transaction.incoming_id
+            UNION ALL
+            SELECT {1}, 1, adjustment.id, adjust_trans.id, product_id,
+            'adj', quantity, price FROM adjust_trans
+            JOIN adjustment ON adjustment.id = adjust_trans.adjustment_id
+            UNION ALL
+            SELECT {2}, 2, outgoing.id, out_transaction.id, product_id,
+            'out', -quantity, price FROM out_transaction
+            JOIN outgoing ON outgoing.id = out_transaction.outgoing_id)
+            ORDER BY day, rank, head, line_id
+            """.format(ISO_DATE.format("incoming.date"),
+                       ISO_DATE.format("adjustment.date"),
+                       ISO_DATE.format("outgoing.date")))
+        self._revalue()
+
+    def _pendingMoves(self):
+        """Return True if stock moves wait to be valued."""
+        query = self.cur.execute(
+            """SELECT EXISTS(SELECT 1 FROM stock_move WHERE id >
+            (SELECT last_move FROM valuation_state WHERE id=1))""")
+        return bool(query.fetchone()[0])
+
+    def _postValuation(self):
+        """Value the stock moves journaled since the last call, product by
+        product, and save the changed cost layers. The caller holds the
+        write lock, so no other connection values the same moves."""
+        query = self.cur.execute(
+            """SELECT last_move FROM valuation_state WHERE id=1""")
+        last = query.fetchone()[0]
+        query = self.cur.execute(
+            """SELECT id, product_id, quantity, price FROM stock_move
+            WHERE id > ? ORDER BY id""", (last,))
+        moves = {}
+        for move in query.fetchall():
+            moves.setdefault(move[1], []).append(move)
+            last = move[0]
+        if not moves:
+            # Nothing to post, so opening the database does not write.
+            return
+        for product_id, items in moves.items():
+            query = self.cur.execute(
+                """SELECT quantity, avg_cost FROM stock_value
+                WHERE product_id=?""", (product_id,))
+            state = list(query.fetchone() or (0.0, 0.0))
+            query = self.cur.execute(
+                """SELECT move_id, remaining, cost FROM cost_layer
+                WHERE product_id=? ORDER BY move_id""", (product_id,))
+            layers = [list(layer) for layer in query]
+            before = dict((layer[0], layer[1]) for layer in layers)
+            for move_id, _, qty, price in items:
+                applyMove(state, layers, move_id, qty, price)
+            after = dict((layer[0], layer[1]) for layer in layers)
+            self.cur.executemany(
+                """DELETE FROM cost_layer WHERE move_id=?""",
+                [(move_id,) for move_id in before if move_id not in after])
+            self.cur.executemany(
+                """UPDATE cost_layer SET remaining=? WHERE move_id=?""",
+                [(after[move_id], move_id) for move_id in before
+                 if move_id in after and after[move_id] != before[move_id]])
+            self.cur.executemany(
+                """INSERT INTO cost_layer VALUES(?, ?, ?, ?)""",
+                [(layer[0], product_id, layer[1], layer[2])
+                 for layer in layers if layer[0] not in before])
+            fifo_value = sum(layer[1] * layer[2] for layer in layers)
+            self.cur.execute(
+                """INSERT INTO stock_value VALUES(?, ?, ?, ?)
+                ON CONFLICT(product_id) DO UPDATE SET
+                quantity=excluded.quantity, avg_cost=excluded.avg_cost,
+                fifo_value=excluded.fifo_value""",
+                (product_id, state[0], state[1], fifo_value))
+        self.cur.execute(
+            """UPDATE valuation_state SET last_move=? WHERE id=1""", (last,))
+
+    def recomputeValuation(self):
+        """Value all stock moves again from the start and return the number
+        of moves. NumPy is used when it is installed, otherwise the moves
+        are replayed one by one."""
+        self._revalue()
+        self.con.commit()
+        query = self.cur.execute("""SELECT COUNT(*) FROM stock_move""")
+        return query.fetchone()[0]
+
+    def _revalue(self):
+        """Clear the valuation and value all stock moves without
+        committing."""
+        self.cur.execute("""DELETE FROM stock_value""")
+        self.cur.execute("""DELETE FROM cost_layer""")
+        self.cur.execute("""UPDATE valuation_state SET last_move=0 WHERE id=1""")
+        if numpy is None:
+            self._postValuation()
+        else:
+            self._recomputeArrays()
+
+    def _recomputeArrays(self):
+        """Value all stock moves with NumPy array operations.
+
+        The moves are sorted by product and posting order. The moving
+        average is computed for all products at once, one step per move
+        rank within the product. The FIFO layers left are the newest
+        receipts which add up to the quantity on hand, found with a
+        cumulative sum of the receipts taken newest first.
+        """
+        query = self.cur.execute(
+            """SELECT id, product_id, quantity, price FROM stock_move
+            ORDER BY product_id, id""")
+        data = numpy.array(query.fetchall(), dtype=float).reshape(-1, 4)
+        if not len(data):
+            return
+        move_id, product, qty, price = data.T
+        products, index, counts = numpy.unique(
+            product, return_inverse=True, return_counts=True)
+        # Moving weighted average.
+        rank = numpy.arange(len(qty)) - (numpy.cumsum(counts) - counts)[index]
+        order = numpy.argsort(rank, kind='stable')
+        held = numpy.zeros(len(products))
+        avg = numpy.zeros(len(products))
+        begin = 0
+        for end in numpy.cumsum(numpy.bincount(rank)):
+            step = order[begin:end]
+            begin = end
+            p = index[step]
+            before = held[p]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                mixed = (before * avg[p] + qty[step] * price[step]) / (before + qty[step])
+            avg[p] = numpy.where(qty[step] > 0,
+                                 numpy.where(before > 0, mixed, price[step]),
+                                 avg[p])
+            held[p] = before + qty[step]
+        # FIFO layers.
+        receipts = numpy.flatnonzero(qty > 0)[::-1]
+        r_index = index[receipts]
+        r_qty = qty[receipts]
+        newer = numpy.cumsum(r_qty) - r_qty
+        first = numpy.r_[True, r_index[1:] != r_index[:-1]]
+        newer -= newer[first][numpy.cumsum(first) - 1]
+        remaining = numpy.clip(held[r_index] - newer, 0, r_qty)
+        fifo_value = numpy.bincount(r_index, weights=remaining * price[receipts],
+                                    minlength=len(products))
+        open_layers = numpy.flatnonzero(remaining > 1e-9)[::-1]
+        self.cur.executemany(
+            """INSERT INTO cost_layer VALUES(?, ?, ?, ?)""",
+            zip(move_id[receipts][open_layers].astype(int).tolist(),
+                products[r_index][open_layers].astype(int).tolist(),
+                remaining[open_layers].tolist(),
+                price[receipts][open_layers].tolist()))
+        self.cur.executemany(
+            """INSERT INTO stock_value VALUES(?, ?, ?, ?)""",
+            zip(products.astype(int).tolist(), held.tolist(), avg.tolist(),
+                fifo_value.tolist()))
+        self.cur.execute(
+            """UPDATE valuation_state SET last_move=? WHERE id=1""",
+            (int(move_id.max()),))
+
+    def valuation(self):
+        """Return (id, code, description, unit, quantity, average cost,
+        average value, FIFO value) of every product."""
+        return self.con.execute(
+            """SELECT products.id, code, description, unit,
+            IFNULL(stock_value.quantity, 0), IFNULL(avg_cost, 0),
+            IFNULL(stock_value.quantity * avg_cost, 0),
+            IFNULL(fifo_value, 0)
+            FROM products
+            LEFT JOIN stock_value ON stock_value.product_id = products.id
+            ORDER BY products.id""")
+
+    def _createDailyUsage(self):
+        """Create the daily_usage and monthly_usage tables which keep the
+        quantity and amount issued of every product per day and per month
+        (YYYY-MM), maintained by triggers. The usage over a window reads
+        the whole months from monthly_usage and only the days at its ends
+        from daily_usage."""
+        self.cur.execute("""CREATE TABLE
+            daily_usage(day TEXT, product_id INTEGER, quantity REAL,
+            amount REAL, PRIMARY KEY(day, product_id),
+            FOREIGN KEY(product_id) REFERENCES products(id))""")
+        self.cur.execute("""CREATE TABLE
+            monthly_usage(month TEXT, product_id INTEGER, quantity REAL,
+            amount REAL, PRIMARY KEY(month, product_id),
+            FOREIGN KEY(product_id) REFERENCES products(id))""")
+        # The last issue of a product is found through this index.
+        self.cur.execute("""CREATE INDEX idx_daily_usage_product
+            ON daily_usage(product_id, day)""")
+        day = "(SELECT %s FROM outgoing WHERE id={0}.outgoing_id)" % (
+            ISO_DATE.format("date"))
+        for name, row, sign in (("insert", "NEW", ""), ("delete", "OLD", "-")):
+            self.cur.execute("""CREATE TRIGGER daily_usage_{0}
+                AFTER {1} ON out_transaction BEGIN
+                INSERT INTO daily_usage VALUES({2},
+                {3}.product_id, {4}{3}.quantity, {4}{3}.quantity * {3}.price)
+                ON CONFLICT(day, product_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                amount = amount + excluded.amount;
+                INSERT INTO monthly_usage VALUES(substr({2}, 1, 7),
+                {3}.product_id, {4}{3}.quantity, {4}{3}.quantity * {3}.price)
+                ON CONFLICT(month, product_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                amount = amount + excluded.amount; END
+                """.format(name, name.upper(), day.format(row), row, sign))
+        self._queueBackfill("_backfillUsage", "out_transaction")
+
+    def _backfillUsage(self, source, first, last, schema="main"):
+        """Add the issue lines first to last of schema to daily_usage and
+        monthly_usage."""
+        self.cur.execute("""CREATE TEMP TABLE IF NOT EXISTS
+            usage_batch(day TEXT, product_id INTEGER, quantity REAL,
+            amount REAL)""")
+        self.cur.execute("""DELETE FROM usage_batch""")
+        self.cur.execute(
+            """INSERT INTO usage_batch
+            SELECT {0}, product_id, SUM(quantity), SUM(quantity * price)
+            FROM {1}.out_transaction
+            JOIN {1}.outgoing ON outgoing.id = out_transaction.outgoing_id
+            WHERE out_transaction.id BETWEEN ? AND ? GROUP BY 1, 2
+            """.format(ISO_DATE.format("outgoing.date"), schema),
+            (first, last))
+        self.cur.execute("""INSERT INTO daily_usage
+            SELECT * FROM usage_batch WHERE true
+            ON CONFLICT(day, product_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            amount = amount + excluded.amount""")
+        self.cur.execute("""INSERT INTO monthly_usage
+            SELECT substr(day, 1, 7), product_id, SUM(quantity), SUM(amount)
+            FROM usage_batch GROUP BY 1, 2
+            ON CONFLICT(month, product_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            amount = amount + excluded.amount""")
+
+    def usage(self, start, end):
+        """Return a cursor of (product id, quantity, amount) issued from
+        start to end (YYYY-MM-DD)."""
+        first = datetime.date(int(start[0:4]), int(start[5:7]), 1)
+        if first.isoformat() != start:
+            first = (first + datetime.timedelta(days=31)).replace(day=1)
+        after = datetime.date.fromisoformat(end) + datetime.timedelta(days=1)
+        last = after.replace(day=1)
+        if last > first:
+            # Whole months from first to the day before last.
+            months = (first.isoformat()[0:7],
+                      (last - datetime.timedelta(days=1)).isoformat()[0:7])
+            days = (start, (first - datetime.timedelta(days=1)).isoformat(),
+                    last.isoformat(), end)
+        else:
+            months = ("1", "0")
+            days = (start, end, "1", "0")
+        return self.con.execute(
+            """SELECT product_id, SUM(quantity), SUM(amount) FROM (
+            SELECT product_id, quantity, amount FROM monthly_usage
+            WHERE month BETWEEN ? AND ?
+            UNION ALL
+            SELECT product_id, quantity, amount FROM daily_usage
+            WHERE day BETWEEN ? AND ?
+            UNION ALL
+            SELECT product_id, quantity, amount FROM daily_usage
+            WHERE day BETWEEN ? AND ?)
+            GROUP BY product_id HAVING SUM(quantity) != 0""", months + days)
+
+    def _createKPI(self):
+        """Create the tables behind the dashboard, maintained by triggers
+        so that reading them never scans the ledgers: kpi holds the stock
+        value and the number of products to reorder, daily_totals the
+        lines and amount received and issued per day (YYYY-MM-DD) and
+        costcenter_usage the amount issued to every cost center per month
+        (YYYY-MM)."""
+        self.cur.execute("""CREATE TABLE
+            kpi(name TEXT PRIMARY KEY, value REAL)""")
+        self.cur.execute("""CREATE TABLE
+            daily_totals(day TEXT, kind TEXT, lines INTEGER, amount REAL,
+            PRIMARY KEY(day, kind))""")
+        self.cur.execute("""CREATE TABLE
+            costcenter_usage(month TEXT, costcenter_id INTEGER, amount REAL,
+            PRIMARY KEY(month, costcenter_id),
+            FOREIGN KEY(costcenter_id) REFERENCES costcenters(id))""")
+        # The same condition as the reorder list, 1 or 0 for a row.
+        short = ("IFNULL({0}.quantity - {0}.min <= 0 "
+                 "AND {0}.max > {0}.quantity, 0)")
+        value = "IFNULL({0}.quantity * {0}.avg_cost, 0)"
+        for name, change in (("insert", "+ %s" % value.format("NEW")),
+                             ("delete", "- %s" % value.format("OLD")),
+                             ("update", "+ %s - %s" % (value.format("NEW"),
+                                                       value.format("OLD")))):
+            self.cur.execute("""CREATE TRIGGER kpi_stock_value_{0}
+                AFTER {1} ON stock_value BEGIN
+                UPDATE kpi SET value = value {2}
+                WHERE name='stock_value'; END
+                """.format(name, name.upper(), change))
+        for name, change in (("insert", "+ %s" % short.format("NEW")),
+                             ("delete", "- %s" % short.format("OLD")),
+                             ("update", "+ %s - %s" % (short.format("NEW"),
+                                                       short.format("OLD")))):
+            self.cur.execute("""CREATE TRIGGER kpi_stock_balance_{0}
+                AFTER {1} ON stock_balance BEGIN
+                UPDATE kpi SET value = value {2}
+                WHERE name='below_min'; END
+                """.format(name, name.upper(), change))
+        for table, header, kind in (("in_transaction", "incoming", "in"),
+                                    ("out_transaction", "outgoing", "out")):
+            day = "(SELECT %s FROM %s WHERE id={0}.%s_id)" % (
+                ISO_DATE.format("date"), header, header)
+            for name, row, sign in (("insert", "NEW", ""),
+                                    ("delete", "OLD", "-")):
+                self.cur.execute("""CREATE TRIGGER daily_totals_{0}_{1}
+                    AFTER {2} ON {0} BEGIN
+                    INSERT INTO daily_totals VALUES({3}, '{4}', {5}1,
+                    {5}{6}.quantity * {6}.price)
+                    ON CONFLICT(day, kind) DO UPDATE SET
+                    lines = lines + excluded.lines,
+                    amount = amount + excluded.amount; END
+                    """.format(table, name, name.upper(), day.format(row),
+                               kind, sign, row))
+        for name, row, sign in (("insert", "NEW", ""), ("delete", "OLD", "-")):
+            self.cur.execute("""CREATE TRIGGER costcenter_usage_{0}
+                AFTER {1} ON out_transaction BEGIN
+                INSERT INTO costcenter_usage
+                SELECT substr({2}, 1, 7), costcenter_id,
+                {3}{4}.quantity * {4}.price
+                FROM outgoing WHERE id={4}.outgoing_id
+                ON CONFLICT(month, costcenter_id) DO UPDATE SET
+                amount = amount + excluded.amount; END
+                """.format(name, name.upper(), ISO_DATE.format("date"),
+                           sign, row))
+        # Fill the counters from the data already in the database.
+        self.cur.execute("""INSERT INTO kpi
+            SELECT 'stock_value', IFNULL(SUM(quantity * avg_cost), 0)
+            FROM stock_value""")
+        self.cur.execute("""INSERT INTO kpi
+            SELECT 'below_min', COUNT(*) FROM stock_balance
+            WHERE quantity - min <= 0 AND max > quantity""")
+        self._queueBackfill("_backfillTotals", "in_transaction")
+        self._queueBackfill("_backfillTotals", "out_transaction")
+
+    def _backfillTotals(self, source, first, last, schema="main"):
+        """Add the source lines first to last of schema to daily_totals
+        and, for issues, to costcenter_usage."""
+        header, kind = {"in_transaction": ("incoming", "in"),
+                        "out_transaction": ("outgoing", "out")}[source]
+        day = ISO_DATE.format(header + ".date")
+        self.cur.execute(
+            """INSERT INTO daily_totals
+            SELECT {0}, '{1}', COUNT(*), SUM(quantity * price)
+            FROM {4}.{2} JOIN {4}.{3} ON {3}.id = {2}.{3}_id
+            WHERE {2}.id BETWEEN ? AND ? GROUP BY 1
+            ON CONFLICT(day, kind) DO UPDATE SET
+            lines = lines + excluded.lines,
+            amount = amount + excluded.amount
+            """.format(day, kind, source, header, schema), (first, last))
+        if source == "out_transaction":
+            self.cur.execute(
+                """INSERT INTO costcenter_usage
+                SELECT substr({0}, 1, 7), costcenter_id, SUM(quantity * price)
+                FROM {1}.out_transaction
+                JOIN {1}.outgoing ON outgoing.id = out_transaction.outgoing_id
+                WHERE out_transaction.id BETWEEN ? AND ? GROUP BY 1, 2
+                ON CONFLICT(month, costcenter_id) DO UPDATE SET
+                amount = amount + excluded.amount""".format(day, schema),
+                (first, last))
+
+    def dashboard(self, day, top=5):
+        """Return the dashboard figures for day (YYYY-MM-DD) as a dict:
+        stock_value, below_min, receipts and issues (lines, amount) and
+        top, the (code, description, amount) of the cost centers with the
+        largest issues in the month of day."""
+        query = self.cur.execute("""SELECT name, value FROM kpi""")
+        data = dict(query.fetchall())
+        for kind, key in (("in", "receipts"), ("out", "issues")):
+            query = self.cur.execute(
+                """SELECT lines, amount FROM daily_totals
+                WHERE day=? AND kind=?""", (day, kind))
+            data[key] = query.fetchone() or (0, 0.0)
+        query = self.cur.execute(
+            """SELECT code, description, amount FROM costcenter_usage
+            JOIN costcenters ON costcenters.id = costcenter_usage.costcenter_id
+            WHERE month=? AND amount > 0
+            ORDER BY amount DESC LIMIT ?""", (day[0:7], top))
+        data['top'] = query.fetchall()
+        return data
+
+    def monthlyUsage(self, month):
+        """Return a cursor of (product id, quantity) issued in month
+        (YYYY-MM) ordered by product id, the order of the primary key."""
+        return self.con.execute(
+            """SELECT product_id, quantity FROM monthly_usage
+            WHERE month=? ORDER BY product_id""", (month,))
+
+    def updateLevels(self, levels):
+        """Save the (min, max, product id) in levels in one transaction."""
+        self.cur.executemany(
+            """UPDATE products SET min=?, max=? WHERE id=?""", levels)
+        self.con.commit()
+
+    def lastIssued(self, product_id):
+        """Return the date (YYYY-MM-DD) of the last issue of product_id or
+        None."""
+        query = self.cur.execute(
+            """SELECT MAX(day) FROM daily_usage WHERE product_id=?""",
+            (product_id,))
+        return query.fetchone()[0]
+
+    def products(self, ids):
+        """Return a dictionary of product id to (code, description, unit)
+        of the products in ids."""
+        ids = list(ids)
+        products = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            query = self.cur.execute(
+                """SELECT id, code, description, unit FROM products
+                WHERE id IN (%s)""" % ",".join("?" * len(chunk)), chunk)
+            for row in query:
+                products[row[0]] = row[1:]
+        return products
+
+    def periodMovements(self, start, end):
+        """Return a cursor of (month, product id, issued, received) of every
+        movement line dated from start to end (YYYY-MM-DD). month counts
+        months from year 0 and adjustments are received with their sign.
+
+        The month of a transaction is computed once per header in the
+        materialized header lists instead of once per line. The opening
+        balances of archiveYear are not movements and are left out.
+        """
+        self.history(start)
+        heads = """SELECT id, CAST(substr(date, 7, 4) AS INTEGER) * 12 +
+            CAST(substr(date, 4, 2) AS INTEGER) - 1 AS month
+            FROM {{0}} WHERE {0} BETWEEN ? AND ?""".format(ISO_DATE.format("date"))
+        return self.con.execute(
+            """WITH inc AS MATERIALIZED ({0}),
+            outg AS MATERIALIZED ({1}),
+            adj AS MATERIALIZED ({2})
+            SELECT inc.month, product_id, 0.0, quantity FROM inc
+            JOIN in_transaction ON in_transaction.incoming_id = inc.id
+            UNION ALL
+            SELECT outg.month, product_id, quantity, 0.0 FROM outg
+            JOIN out_transaction ON out_transaction.outgoing_id = outg.id
+            UNION ALL
+            SELECT adj.month, product_id, 0.0, quantity FROM adj
+            JOIN adjust_trans ON adjust_trans.adjustment_id = adj.id
+            """.format(heads.format("incoming"), heads.format("outgoing"),
+                       heads.format("adjustment") +
+                       " AND id NOT IN (%s)" % OPENINGS),
+            (start, end) * 3)
+
+    def movedAfter(self, end):
+        """Return a cursor of (product id, net quantity) moved after end
+        (YYYY-MM-DD)."""
+        self.history(end)
+        sql, params = self._movements(end, "9999-12-31")
+        return self.con.execute(
+            """SELECT product_id, SUM(qty) FROM (%s)
+            GROUP BY product_id""" % sql, params)
+
+    def _movements(self, start, end, openings=True):
+        """Return the sql and parameters of all stock movements dated after
+        start and up to end (YYYY-MM-DD). Each row holds the product id, the
+        signed quantity and the received quantity and amount. openings
+        False leaves out the opening balances of archiveYear."""
+        sql = """
+            SELECT product_id, quantity AS qty, quantity AS rec_qty,
+            quantity * price AS rec_amount FROM in_transaction
+            JOIN incoming ON incoming.id = in_transaction.incoming_id
+            WHERE {0} > ? AND {0} <= ?
+            UNION ALL
+            SELECT product_id, -quantity, 0, 0 FROM out_transaction
+            JOIN outgoing ON outgoing.id = out_transaction.outgoing_id
+            WHERE {1} > ? AND {1} <= ?
+            UNION ALL
+            SELECT product_id, quantity, 0, 0 FROM adjust_trans
+            JOIN adjustment ON adjustment.id = adjust_trans.adjustment_id
+            WHERE {2} > ? AND {2} <= ?{3}
+            """.format(ISO_DATE.format("incoming.date"),
+                       ISO_DATE.format("outgoing.date"),
+                       ISO_DATE.format("adjustment.date"),
+                       "" if openings else
+                       " AND adjustment.id NOT IN (%s)" % OPENINGS)
+        return sql, (start, end) * 3
+
+    def _stockAsOf(self, end):
+        """Return the stock of every moved product as of end (YYYY-MM-DD).
+
+        The nearest snapshot on or before end is used as the opening balance
+        so only the movements after it have to be read. The result is a
+        dictionary of product id to [quantity, rec_qty, rec_amount].
+
+        Without the archives the opening balances stand for the archived
+        years, they are left out when the snapshot already covers them and
+        a snapshot of an archived date is not used.
+        """
+        history = self.history(end)
+        until = self.archivedUntil()
+        query = self.cur.execute(
+            """SELECT MAX(period) FROM stock_snapshot WHERE period <= ?""",
+            (end,))
+        base = query.fetchone()[0]
+        balances = {}
+        openings = True
+        if not history and until and base is not None:
+            if base >= until:
+                openings = False
+            else:
+                base = None
+        if base is None:
+            base = ""
+        else:
+            query = self.cur.execute(
+                """SELECT product_id, quantity, rec_qty, rec_amount
+                FROM stock_snapshot WHERE period=?""", (base,))
+            for row in query:
+                balances[row[0]] = list(row[1:])
+        sql, params = self._movements(base, end, openings)
+        query = self.cur.execute(
+            """SELECT product_id, SUM(qty), SUM(rec_qty), SUM(rec_amount)
+            FROM (%s) GROUP BY product_id""" % sql, params)
+        for row in query:
+            balance = balances.setdefault(row[0], [0.0, 0.0, 0.0])
+            balance[0] += row[1]
+            balance[1] += row[2]
+            balance[2] += row[3]
+        return balances
+
+    def _reopenPeriods(self, date):
+        """Drop the closing stock snapshots of the periods ending on or
+        after date (DD-MM-YYYY), which a document of that date changes.
+        Until they are closed again the stock is worked out from an earlier
+        snapshot. The year end snapshots of the archived years stay, they
+        stand for the lines moved out."""
+        self.cur.execute(
+            """DELETE FROM stock_snapshot
+            WHERE period >= %s AND period > :until"""
+            % ISO_DATE.format(":date"),
+            {'date': date, 'until': self.archivedUntil()})
+
+    def closePeriod(self, date):
+        """Write the closing stock snapshot of every product as of date
+        (DD-MM-YYYY), normally a month end. Return the number of rows."""
+        period = isoDate(date)
+        self.cur.execute(
+            """DELETE FROM stock_snapshot WHERE period=?""", (period,))
+        balances = self._stockAsOf(period)
+        rows = []
+        for product_id, (qty, rec_qty, rec_amount) in balances.items():
+            # Closing stock is valued at the average price of all receipts
+            # up to the date on purpose, the same rate as closingStock. The
+            # moving average and FIFO values of stock_value are only kept
+            # for today, so the Valuation report can differ.
+            rate = rec_amount / rec_qty if rec_qty else 0.0
+            rows.append((period, product_id, qty, qty * rate,
+                         rec_qty, rec_amount))
+        self.cur.executemany(
+            """INSERT INTO stock_snapshot VALUES(?, ?, ?, ?, ?, ?)""", rows)
+        self.con.commit()
+        return len(rows)
+
+    def closingStock(self, date):
+        """Return (id, code, description, unit, quantity, rate, value) of
+        every product as of date (DD-MM-YYYY)."""
+        balances = self._stockAsOf(isoDate(date))
+        query = self.cur.execute(
+            """SELECT id, code, description, unit FROM products ORDER BY id""")
+        data = []
+        for product in query:
+            qty, rec_qty, rec_amount = balances.get(product[0], (0.0, 0.0, 0.0))
+            rate = rec_amount / rec_qty if rec_qty else 0.0
+            data.append(product + (qty, rate, qty * rate))
+        return data
+
+    def consumption(self, date_from, date_to):
+        """Return a cursor over the issues between date_from and date_to
+        (DD-MM-YYYY) as (cost center code, cost center name, item code,
+        description, unit, quantity, amount) ordered by cost center and
+        item code, one row per cost center and product."""
+        self.history(isoDate(date_from))
+        query = self.con.execute(
+            """SELECT costcenters.code, costcenters.description,
+            products.code, products.description, products.unit,
+            SUM(out_transaction.quantity),
+            SUM(out_transaction.quantity * out_transaction.price)
+            FROM outgoing
+            JOIN out_transaction ON out_transaction.outgoing_id = outgoing.id
+            JOIN products ON products.id = out_transaction.product_id
+            LEFT JOIN costcenters ON costcenters.id = outgoing.costcenter_id
+            WHERE {0} BETWEEN ? AND ?
+            GROUP BY outgoing.costcenter_id, out_transaction.product_id
+            ORDER BY costcenters.code, products.code
+            """.format(ISO_DATE.format("outgoing.date")),
+            (isoDate(date_from), isoDate(date_to)))
+        return query
+
+    def register(self, kind, date_from, date_to, page_size=500):
+        """Yield the incoming, outgoing or adjustment documents between
+        date_from and date_to (DD-MM-YYYY) as (document no., date,
+        reference, party or remarks, number of lines, amount).
+
+        Documents are read page_size at a time ordered by date and id, each
+        page starting after the last (date, id) seen so that a page never
+        rescans the rows before it. Every page is one query, its documents
+        are joined to their lines by document id, which also reaches the
+        indexes of the archives through the history views.
+        """
+        tables = {'incoming': ("IN-", "h.dn_number, h.supplier",
+                               "in_transaction", "incoming_id", ""),
+                  'outgoing': ("OUT-", "c.code, c.description",
+                               "out_transaction", "outgoing_id",
+                               "LEFT JOIN costcenters c ON c.id = h.costcenter_id"),
+                  'adjustment': ("ADJ-", "'', h.remarks",
+                                 "adjust_trans", "adjustment_id", "")}
+        prefix, columns, lines, header_id, join = tables[kind]
+        self.history(isoDate(date_from))
+        iso_date = ISO_DATE.format("h.date")
+        sql = """WITH page(id, date, reference, party, day) AS (
+            SELECT h.id, h.date, {1}, {4}
+            FROM {0} h {3}
+            WHERE {4} >= ? AND {4} <= ? AND ({4} > ? OR h.id > ?)
+            ORDER BY {4}, h.id LIMIT ?)
+            SELECT page.id, page.date, page.reference, page.party, page.day,
+            IFNULL(t.lines, 0), IFNULL(t.amount, 0)
+            FROM page LEFT JOIN (
+            SELECT {2} AS id, COUNT(*) AS lines,
+            SUM(quantity * price) AS amount FROM {5}
+            WHERE {2} IN (SELECT id FROM page) GROUP BY {2}) t
+            ON t.id = page.id
+            ORDER BY page.day, page.id
+            """.format(kind, columns, header_id, join, iso_date, lines)
+        start = isoDate(date_from)
+        end = isoDate(date_to)
+        last_date = ""
+        last_id = 0
+        while True:
+            rows = self.con.execute(
+                sql, (max(start, last_date), end, last_date, last_id,
+                      page_size)).fetchall()
+            for row in rows:
+                yield (prefix + str(row[0]), row[1], row[2] or '',
+                       row[3] or '', row[5], row[6])
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+            last_date = rows[-1][4]
+
+    def loadTransaction(self, kind, transid):
+        """Load a saved incoming, outgoing or adjustment document with one
+        query. Return (PDF options, item list, remarks) in the form used by
+        renderTransaction, or None if there is no such document."""
+        if kind == "incoming":
+            columns = "h.dn_number, h.supplier, ''"
+            lines, header_id, join = "in_transaction", "incoming_id", ""
+        elif kind == "outgoing":
+            columns = "c.code, c.description, ''"
+            lines, header_id = "out_transaction", "outgoing_id"
+            join = "LEFT JOIN costcenters c ON c.id = h.costcenter_id"
+        else:
+            columns = "'', '', l.type"
+            lines, header_id, join = "adjust_trans", "adjustment_id", ""
+        sql = """SELECT h.date, h.remarks, {0}, p.code, p.description,
+            p.unit, l.quantity, l.price
+            FROM {1} h {4}
+            LEFT JOIN {2} l ON l.{3} = h.id
+            LEFT JOIN products p ON p.id = l.product_id
+            WHERE h.id=? ORDER BY l.id""".format(columns, kind, lines,
+                                                 header_id, join)
+        data = self.con.execute(sql, (int(transid),)).fetchall()
+        if len(data) == 0 and not self.history_views and self.history(None):
+            # The document may be in an archived year.
+            data = self.con.execute(sql, (int(transid),)).fetchall()
+        if len(data) == 0:
+            return None
+        date, remarks = data[0][0], data[0][1] or ''
+        options = {'mode': kind, 'transid': str(transid), 'date': date}
+        if kind == "incoming":
+            options['dn_number'] = data[0][2] or ''
+            options['supplier'] = data[0][3] or ''
+        elif kind == "outgoing":
+            options['costctrcode'] = data[0][2] or ''
+            options['costctrname'] = data[0][3] or ''
+        item_list = []
+        for serial, row in enumerate(data, 1):
+            if row[5] is None:
+                continue
+            quantity, price = row[8], row[9]
+            if kind == "adjustment":
+                adj_type = {'plus': '+', 'minus': '-'}.get(row[4], '')
+                item_list.append((str(serial), row[5], row[6], row[7],
+                                  adj_type, abs(quantity), price,
+                                  quantity * price))
+            else:
+                item_list.append((str(serial), row[5], row[6], row[7],
+                                  quantity, price, quantity * price))
+        return options, item_list, remarks
+
+    def reorderList(self):
+        """Return the products at or below their minimum stock as
+        (id, code, description, unit, on hand, min, max, order quantity)
+        where the order quantity brings the stock back to max."""
+        query = self.cur.execute(
+            """SELECT products.id, code, description, unit,
+            stock_balance.quantity, stock_balance.min, stock_balance.max,
+            stock_balance.max - stock_balance.quantity
+            FROM stock_balance
+            JOIN products ON products.id = stock_balance.product_id
+            WHERE stock_balance.quantity - stock_balance.min <= 0
+            AND stock_balance.max > stock_balance.quantity
+            ORDER BY code""")
+        return query.fetchall()
+
+    def checkUser(self, username, password):
+        """Return the type of the user if the password is right, else
+        None."""
+        password = hashlib.sha224(
+            (password + self.salt).encode("utf-8")).hexdigest()
+        query = self.cur.execute(
+            """SELECT usertype FROM users WHERE username=? AND password=?""",
+            (username, password))
+        row = query.fetchone()
+        return str(row[0]) if row is not None else None
+
+    def productStock(self, codes):
+        """Return (id, code, description, unit, price, min, max, on hand,
+        average cost) of the products with the item codes in codes."""
+        codes = list(codes)
+        rows = []
+        for i in range(0, len(codes), 500):
+            chunk = codes[i:i + 500]
+            query = self.cur.execute(
+                """SELECT products.id, code, description, unit, price,
+                products.min, products.max,
+                IFNULL(stock_balance.quantity, 0), IFNULL(avg_cost, 0)
+                FROM products
+                LEFT JOIN stock_balance
+                ON stock_balance.product_id = products.id
+                LEFT JOIN stock_value ON stock_value.product_id = products.id
+                WHERE code IN (%s) ORDER BY code"""
+                % ",".join("?" * len(chunk)), chunk)
+            rows.extend(query.fetchall())
+        return rows
+
+    def postDocument(self, kind, header, items, commit=True):
+        """Save an incoming, outgoing or adjustment document with the
+        fields of its header dictionary and its (product id, quantity,
+        price) items, return its id. Adjustment quantities below zero
+        take stock out. Invalid documents raise ValueError. Without commit
+        the caller ends the transaction."""
+        if kind not in DOCUMENTS:
+            raise ValueError("unknown document: %s" % kind)
+        table, fields, lines = DOCUMENTS[kind]
+        try:
+            isoDate(header.get('date', ''))
+        except (TypeError, ValueError):
+            raise ValueError("invalid date, use DD-MM-YYYY: %r"
+                             % header.get('date'))
+        if not items:
+            raise ValueError("a document needs at least one item")
+        try:
+            items = [(int(product_id), float(quantity), float(price))
+                     for product_id, quantity, price in items]
+        except (TypeError, ValueError):
+            raise ValueError("items are [product id, quantity, price]")
+        missing = set(item[0] for item in items) - set(
+            self.products(item[0] for item in items))
+        if missing:
+            raise ValueError("unknown product id: %s"
+                             % ", ".join(str(i) for i in sorted(missing)))
+        if kind == "outgoing":
+            query = self.cur.execute(
+                """SELECT id FROM costcenters WHERE id=?""",
+                (header.get('costcenter_id'),))
+            if query.fetchone() is None:
+                raise ValueError("unknown cost center id: %r"
+                                 % header.get('costcenter_id'))
+        self._reopenPeriods(header['date'])
+        self.cur.execute(
+            """INSERT INTO %s VALUES(null, %s)"""
+            % (table, ", ".join("?" * len(fields))),
+            [header.get(field, "") for field in fields])
+        transid = self.cur.lastrowid
+        if kind == "adjustment":
+            rows = [(transid, product_id, quantity, price,
+                     "minus" if quantity < 0 else "plus")
+                    for product_id, quantity, price in items]
+        else:
+            rows = [(transid,) + item for item in items]
+        self.cur.executemany(
+            """INSERT INTO %s VALUES(null, %s)"""
+            % (lines, ", ".join("?" * len(rows[0]))), rows)
+        self._postValuation()
+        if commit:
+            self.con.commit()
+        return transid
+
     def insertRecord(self, **kwargs):
         if kwargs['table'] == "users":
             username = kwargs['user']
@@ -2378,6 +4908,7 @@ class Database:
             dn_number = kwargs['dn_number']
             supplier = kwargs['supplier']
             remarks = kwargs['remarks']
+            self._reopenPeriods(tran_date)
             self.cur.execute(
                 """INSERT INTO
                 incoming VALUES(null, ?, ?, ?, ?)
@@ -2388,6 +4919,7 @@ class Database:
             tran_date = kwargs['date']
             costctr = kwargs['costcenter_id']
             remarks = kwargs['remarks']
+            self._reopenPeriods(tran_date)
             self.cur.execute(
                 """INSERT INTO
                 outgoing VALUES(null, ?, ?, ?)
@@ -2397,6 +4929,7 @@ class Database:
         elif kwargs['table'] == "adjustment":
             tran_date = kwargs['date']
             remarks = kwargs['remarks']
+            self._reopenPeriods(tran_date)
             self.cur.execute(
                 """INSERT INTO
                 adjustment VALUES(null, ?, ?)
@@ -2409,6 +4942,7 @@ class Database:
                 """INSERT INTO
                 adjust_trans VALUES(null, ?, ?, ?, ?, ?)
                 """, item_list)
+            self._postValuation()
             self.con.commit()
 
         elif kwargs['table'] == "costcenters":
@@ -2426,6 +4960,7 @@ class Database:
                 """INSERT INTO
                 in_transaction VALUES(null, ?, ?, ?, ?)
                 """, item_list)
+            self._postValuation()
             self.con.commit()
 
         elif kwargs['table'] == "out_transaction":
@@ -2434,6 +4969,7 @@ class Database:
                 """INSERT INTO
                 out_transaction VALUES(null, ?, ?, ?, ?)
                 """, item_list)
+            self._postValuation()
             self.con.commit()
 
     def deleteRecord(self, **kwargs):
@@ -2477,7 +5013,7 @@ class AdjustmentWindow(tk.Toplevel):
         with open('config.json', 'r') as cf:
             data = json.load(cf)
         self.db = Database()
-        db = data['default_db']
+        db = databaseName(data)
         self.db.openDB(db)
         self.setupUI()
 
@@ -2678,7 +5214,6 @@ class AdjustmentWindow(tk.Toplevel):
 
             item_list = []
             counter = 1
-            amount = 0
             for child in children:
                 serial = counter
                 itemcode = self.product_view.item(child)['values'][0]
@@ -2696,7 +5231,6 @@ class AdjustmentWindow(tk.Toplevel):
                     adj_type = '-'
                 else:
                     adj_type = ''
-                amount += float(value)
                 item_list.append((str(serial), itemcode, desc, unit, adj_type,
                                   quantity, price, value))
                 counter += 1
@@ -2704,33 +5238,10 @@ class AdjustmentWindow(tk.Toplevel):
                        'transid': transid,
                        'date': date
                        }
-            pdf = PDF(**options)
-            pdf.alias_nb_pages()
-            pdf.add_page()
-            # The rest of the report will be inserted here.
-            pdf.set_font('Courier', '', 10)
-            for item in item_list:
-                pdf.cell(13, 10, item[0])
-                pdf.cell(28, 10, item[1])
-                pdf.cell(55, 10, item[2][0:20])
-                pdf.cell(13, 10, item[3], 0, 0, 'C')
-                pdf.cell(13, 10, item[4], 0, 0, 'C')
-                pdf.cell(19, 10, format(item[5], '0.2f'))
-                pdf.cell(19, 10, format(item[6], '0.2f'))
-                pdf.cell(28, 10, format(item[7], '0,.2f'))
-                pdf.ln(5)
-            pdf.ln(25)
-            pdf.set_font('Courier', 'B', 10)
-            pdf.cell(105, 7, "Remarks: "+remarks)
-            pdf.cell(15, 7, "")
-            pdf.cell(40, 7, "Total Amount:", 0, 0, 'C')
-            pdf.cell(30, 7, format(amount, '0,.2f'), 1, 0, 'C')
-            pdf.output('reports/adjustment.pdf', 'F')
+            path = ReportOutput().create("adjustment", "pdf", renderTransaction,
+                                         options, item_list, remarks)
 
-            try:
-                os.system('start '+'reports/adjustment.pdf')
-            except:
-                print("Error Printing")
+            openReport(path)
         elif command == "Close":
             self._close()
 
@@ -2868,124 +5379,1457 @@ class AddItemAdjWin(tk.Toplevel):
         self.destroy()
 # End of AddItemAdjWin class.
 
+# Start of stock analytics. The movement lines of a period are grouped
+# by product either with NumPy arrays or, without NumPy, in Python.
+def stockAnalytics(db, date_from, date_to, vectorized=True):
+    """Return (id, code, description, unit, on hand, issued, daily use,
+    turnover, days of cover, trend) of every product for the period
+    date_from to date_to (DD-MM-YYYY).
+
+    The stock on hand at the end of the period is the current balance
+    less the movements after it. Turnover is the quantity issued over the
+    average of the opening and closing stock, days of cover the stock on
+    hand over the daily use and trend the least squares slope of the
+    monthly issues. Turnover and days of cover are None when they cannot
+    be computed.
+    """
+    start, end = isoDate(date_from), isoDate(date_to)
+    days = round((time.mktime(time.strptime(end, "%Y-%m-%d")) -
+                  time.mktime(time.strptime(start, "%Y-%m-%d"))) / 86400) + 1
+    first = int(start[0:4]) * 12 + int(start[5:7]) - 1
+    months = int(end[0:4]) * 12 + int(end[5:7]) - first
+    products = db.con.execute(
+        """SELECT products.id, code, description, unit,
+        IFNULL(stock_balance.quantity, 0) FROM products
+        LEFT JOIN stock_balance ON stock_balance.product_id = products.id
+        ORDER BY products.id""").fetchall()
+    if vectorized and numpy is not None:
+        metrics = _analyticsArrays(db, start, end, products, days, first,
+                                   months)
+    else:
+        metrics = _analyticsPython(db, start, end, products, days, first,
+                                   months)
+    return [product[0:4] + metric for product, metric in zip(products, metrics)]
+
+def _analyticsMetrics(on_hand, issued, received, moment, days, spread):
+    average = (on_hand - (received - issued) + on_hand) / 2
+    daily = issued / days
+    turnover = issued / average if average > 0 else None
+    cover = on_hand / daily if daily > 0 else None
+    trend = moment / spread if spread else 0.0
+    return (on_hand, issued, daily, turnover, cover, trend)
+
+def _analyticsPython(db, start, end, products, days, first, months):
+    middle = (months - 1) / 2.0
+    spread = sum((month - middle) ** 2 for month in range(months))
+    later = dict(db.movedAfter(end))
+    totals = {}
+    for month, product_id, issued, received in db.periodMovements(start, end):
+        total = totals.get(product_id)
+        if total is None:
+            total = totals[product_id] = [0.0, 0.0, 0.0]
+        total[0] += issued
+        total[1] += received
+        total[2] += (month - first - middle) * issued
+    metrics = []
+    for product in products:
+        issued, received, moment = totals.get(product[0], (0.0, 0.0, 0.0))
+        on_hand = product[4] - later.get(product[0], 0.0)
+        metrics.append(_analyticsMetrics(on_hand, issued, received, moment,
+                                         days, spread))
+    return metrics
+
+def _analyticsArrays(db, start, end, products, days, first, months):
+    ids = numpy.array([product[0] for product in products], dtype=numpy.int64)
+    balance = numpy.array([product[4] for product in products], dtype=float)
+    count = len(ids)
+    # The rows are flattened into one float array, which is much faster
+    # than building a structured array row by row.
+    data = numpy.fromiter(
+        itertools.chain.from_iterable(db.periodMovements(start, end)),
+        dtype=float).reshape(-1, 4)
+    month, product, issued, received = data.T
+    index = numpy.searchsorted(ids, product)
+    known = ids[numpy.minimum(index, max(count - 1, 0))] == product
+    index = index[known]
+    month = month[known]
+    issued = issued[known]
+    received = received[known]
+    # Sum the issues and receipts of each product over the lines sorted
+    # by product, reduceat adds up each run of equal products.
+    order = numpy.argsort(index, kind='stable')
+    sorted_index = index[order]
+    starts = numpy.flatnonzero(numpy.r_[True, sorted_index[1:] != sorted_index[:-1]])
+    issued_total = numpy.zeros(count)
+    received_total = numpy.zeros(count)
+    if len(sorted_index):
+        moved = sorted_index[starts]
+        issued_total[moved] = numpy.add.reduceat(issued[order], starts)
+        received_total[moved] = numpy.add.reduceat(received[order], starts)
+    middle = (months - 1) / 2.0
+    spread = ((numpy.arange(months) - middle) ** 2).sum()
+    moment = numpy.bincount(index, minlength=count,
+                            weights=(month - first - middle) * issued)
+    later = numpy.fromiter(itertools.chain.from_iterable(db.movedAfter(end)),
+                           dtype=float).reshape(-1, 2)
+    position = numpy.searchsorted(ids, later[:, 0])
+    found = ids[numpy.minimum(position, max(count - 1, 0))] == later[:, 0]
+    on_hand = balance.copy()
+    on_hand[position[found]] -= later[found, 1]
+    average = (on_hand - (received_total - issued_total) + on_hand) / 2
+    daily = issued_total / days
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        turnover = numpy.where(average > 0, issued_total / average, numpy.nan)
+        cover = numpy.where(daily > 0, on_hand / daily, numpy.nan)
+    trend = moment / spread if spread else numpy.zeros(count)
+    turnover = [None if value != value else value for value in turnover.tolist()]
+    cover = [None if value != value else value for value in cover.tolist()]
+    return list(zip(on_hand.tolist(), issued_total.tolist(), daily.tolist(),
+                    turnover, cover, trend.tolist()))
+
+def benchmarkAnalytics(db, date_from, date_to, repeat=3):
+    """Time stockAnalytics with and without NumPy. Return the best time
+    of each and of only reading the movement lines, in seconds, and
+    whether the results agree."""
+    results = {}
+    times = {}
+    start = time.perf_counter()
+    for row in db.periodMovements(isoDate(date_from), isoDate(date_to)):
+        pass
+    reading = time.perf_counter() - start
+    for vectorized in (False, True):
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            results[vectorized] = stockAnalytics(db, date_from, date_to,
+                                                 vectorized)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times[vectorized] = best
+    same = all(
+        (a is None and b is None) or (a is not None and b is not None and
+                                      abs(a - b) <= 1e-6 * max(1, abs(a)))
+        for left, right in zip(results[False], results[True])
+        for a, b in zip(left[4:], right[4:]))
+    return times[False], times[True], reading, same
+# End of stock analytics.
+
+# Start of demand forecasting. The monthly issues of every product are
+# forecast with a moving average or exponential smoothing and turned into
+# suggested reorder points (min) and maximum levels.
+FORECAST_SETTINGS = {'method': "smoothing", 'months': 12, 'window': 3,
+                     'alpha': 0.3, 'lead_days': 14, 'review_days': 30,
+                     'service_z': 1.65}
+
+def forecastSettings(data):
+    """Return the forecast settings, the defaults updated with the
+    "forecast" settings of the configuration data."""
+    settings = dict(FORECAST_SETTINGS)
+    settings.update(data.get('forecast', {}))
+    return settings
+
+def demandForecast(db, vectorized=True, **settings):
+    """Return (id, code, description, unit, min, max, monthly forecast,
+    suggested min, suggested max, months with issues) of every product.
+
+    The history is the complete months before the current one. The
+    suggested min covers the demand over the lead time plus a safety
+    stock of service_z standard deviations of it, the suggested max adds
+    the demand of one review period.
+    """
+    options = dict(FORECAST_SETTINGS)
+    options.update(settings)
+    month = datetime.date.today().replace(day=1)
+    history = []
+    for i in range(options['months']):
+        month = (month - datetime.timedelta(days=1)).replace(day=1)
+        history.insert(0, month.isoformat()[0:7])
+    products = db.con.execute(
+        """SELECT id, code, description, unit, min, max FROM products
+        ORDER BY id""").fetchall()
+    if vectorized and numpy is not None:
+        levels = _forecastArrays(db, products, history, options)
+    else:
+        levels = _forecastPython(db, products, history, options)
+    return [product + level for product, level in zip(products, levels)]
+
+def _forecastLevels(forecast, sigma, options):
+    """Return the suggested min and max for a monthly forecast and the
+    standard deviation sigma of the monthly demand."""
+    daily = forecast / (365 / 12.0)
+    lead = options['lead_days']
+    minimum = daily * lead + options['service_z'] * sigma * (lead / (365 / 12.0)) ** 0.5
+    return round(minimum, 2), round(minimum + daily * options['review_days'], 2)
+
+def _forecastPython(db, products, history, options):
+    months = options['months']
+    series = {}
+    for month, name in enumerate(history):
+        for product_id, quantity in db.monthlyUsage(name):
+            demand = series.get(product_id)
+            if demand is None:
+                demand = series[product_id] = [0.0] * months
+            demand[month] += quantity
+    levels = []
+    for product in products:
+        demand = series.get(product[0])
+        if demand is None:
+            levels.append((0.0, 0.0, 0.0, 0))
+            continue
+        if options['method'] == "average":
+            forecast = sum(demand[-options['window']:]) / options['window']
+        else:
+            forecast = demand[0]
+            for quantity in demand[1:]:
+                forecast += options['alpha'] * (quantity - forecast)
+        mean = sum(demand) / months
+        sigma = (sum((quantity - mean) ** 2 for quantity in demand) / months) ** 0.5
+        minimum, maximum = _forecastLevels(forecast, sigma, options)
+        active = sum(1 for quantity in demand if quantity)
+        levels.append((round(forecast, 2), minimum, maximum, active))
+    return levels
+
+def _forecastArrays(db, products, history, options):
+    months = options['months']
+    ids = numpy.array([product[0] for product in products], dtype=numpy.int64)
+    count = len(ids)
+    # One row of monthly demand per product, filled a month at a time.
+    demand = numpy.zeros((count, months))
+    for month, name in enumerate(history):
+        data = numpy.fromiter(itertools.chain.from_iterable(db.monthlyUsage(name)),
+                              dtype=float).reshape(-1, 2)
+        index = numpy.searchsorted(ids, data[:, 0])
+        known = ids[numpy.minimum(index, max(count - 1, 0))] == data[:, 0]
+        demand[:, month] = numpy.bincount(index[known], weights=data[known, 1],
+                                          minlength=count)
+    if options['method'] == "average":
+        forecast = demand[:, -options['window']:].sum(1) / options['window']
+    else:
+        forecast = demand[:, 0].copy()
+        for month in range(1, months):
+            forecast += options['alpha'] * (demand[:, month] - forecast)
+    sigma = demand.std(1)
+    daily = forecast / (365 / 12.0)
+    lead = options['lead_days']
+    minimum = daily * lead + options['service_z'] * sigma * (lead / (365 / 12.0)) ** 0.5
+    maximum = minimum + daily * options['review_days']
+    active = (demand != 0).sum(1)
+    return list(zip(forecast.round(2).tolist(), minimum.round(2).tolist(),
+                    maximum.round(2).tolist(), active.tolist()))
+
+def applyForecast(db, forecast):
+    """Save the suggested min and max of the products in forecast which
+    had issues and whose levels changed. Return the number updated."""
+    levels = [(row[7], row[8], row[0]) for row in forecast
+              if row[9] and (row[7] != row[4] or row[8] != row[5])]
+    db.updateLevels(levels)
+    return len(levels)
+# End of demand forecasting.
+
+# Start of report sources. Each one reads a report from the open Database
+# db and returns it as a ReportData whose rows are produced on demand.
+class Column:
+    """A report column, total is True if the column is summed. width, align
+    and fmt, a format string for the value, are used by PDF templates."""
+
+    def __init__(self, key, label, total=False, width=20, align='',
+                 fmt="{!s}"):
+        self.key = key
+        self.label = label
+        self.total = total
+        self.width = width
+        self.align = align
+        self.fmt = fmt
+
+class ReportData:
+    """The title, columns and row iterator of a report. Rows are tuples in
+    column order. If group is a column index the rows are sorted by it and
+    the renderers add a subtotal after every group. options are the PDF
+    header options of the report."""
+
+    def __init__(self, title, columns, rows, info="", group=None,
+                 options=None):
+        self.title = title
+        self.columns = columns
+        self.rows = rows
+        self.info = info
+        self.group = group
+        self.options = options or {}
+
+def currentStockData(db):
+    rows = (item[0:7] for item in db.valuation())
+    columns = [Column("id", "S. No."), Column("code", "Item Code"),
+               Column("description", "Description"), Column("unit", "Unit"),
+               Column("quantity", "Quantity"), Column("rate", "Rate"),
+               Column("amount", "Amount", True)]
+    today = time.strftime("%d-%b-%Y")
+    return ReportData("Current Stock", columns, rows, "Date: %s" % today,
+                      options={'date': today})
+
+def _window(date, days):
+    """Return the first and last day of the days long window ending on
+    date (DD-MM-YYYY), as YYYY-MM-DD and as DD-MM-YYYY."""
+    end = datetime.datetime.strptime(date, "%d-%m-%Y").date()
+    start = end - datetime.timedelta(days=days - 1)
+    return (start.isoformat(), end.isoformat(),
+            start.strftime("%d-%m-%Y"), end.strftime("%d-%m-%Y"))
+
+def abcData(db, date, days=365):
+    """ABC analysis of the issue value over the days long window ending on
+    date. Items are ranked by value with a partial sort which stops once
+    the A (first 80% of the value) and B (next 15%) items are found, the
+    C items are only counted."""
+    start, end, date_from, date_to = _window(date, days)
+    usage = [(-amount, product_id, quantity)
+             for product_id, quantity, amount in db.usage(start, end)]
+    total = -sum(item[0] for item in usage)
+    heapq.heapify(usage)
+    ranked = []
+    cumulative = 0.0
+    while usage and cumulative < 0.95 * total:
+        amount, product_id, quantity = heapq.heappop(usage)
+        share = -amount / total * 100
+        group = "A" if cumulative < 0.8 * total else "B"
+        cumulative -= amount
+        ranked.append((product_id, quantity, -amount, share,
+                       cumulative / total * 100, group))
+    products = db.products(item[0] for item in ranked)
+    rows = ((rank,) + products.get(item[0], ("", "", "")) + item[1:]
+            for rank, item in enumerate(ranked, 1))
+    columns = [Column("rank", "Rank"), Column("code", "Item Code"),
+               Column("description", "Description"), Column("unit", "Unit"),
+               Column("quantity", "Quantity"), Column("value", "Value", True),
+               Column("share", "Share %"), Column("cumulative", "Cum. %"),
+               Column("class", "Class")]
+    rest = -sum(item[0] for item in usage)
+    return ReportData("ABC Analysis", columns, rows,
+                      "Period: %s to %s, C items: %d worth %s"
+                      % (date_from, date_to, len(usage), format(rest, '0,.2f')),
+                      options={'date_from': date_from, 'date_to': date_to,
+                               'rest': len(usage), 'rest_value': rest})
+
+def slowMoverData(db, days=365, cover_days=180, limit=500):
+    """List the products in stock which were not issued in the last days
+    or whose stock lasts more than cover_days at the usage of that window,
+    the limit largest stock values first."""
+    start, end, date_from, date_to = _window(time.strftime("%d-%m-%Y"), days)
+    usage = dict((row[0], row[1]) for row in db.usage(start, end))
+    query = db.con.execute(
+        """SELECT product_id, quantity, quantity * avg_cost FROM stock_value
+        WHERE quantity > 0""")
+    candidates = []
+    for product_id, quantity, value in query:
+        issued = usage.get(product_id, 0.0)
+        if issued <= 0:
+            candidates.append((value, product_id, quantity, 0.0, None,
+                               "Non-moving"))
+        else:
+            cover = quantity / (issued / days)
+            if cover > cover_days:
+                candidates.append((value, product_id, quantity, issued, cover,
+                                   "Slow"))
+    if limit:
+        candidates = heapq.nlargest(limit, candidates)
+    else:
+        candidates.sort(reverse=True)
+    products = db.products(item[1] for item in candidates)
+    rows = []
+    for value, product_id, quantity, issued, cover, status in candidates:
+        last = db.lastIssued(product_id)
+        if last is not None:
+            last = "%s-%s-%s" % (last[8:10], last[5:7], last[0:4])
+        rows.append(products.get(product_id, ("", "", "")) +
+                    (quantity, value, issued, cover, last, status))
+    columns = [Column("code", "Item Code"),
+               Column("description", "Description"), Column("unit", "Unit"),
+               Column("on_hand", "On Hand"), Column("value", "Value", True),
+               Column("issued", "Issued"), Column("cover", "Days of Cover"),
+               Column("last_issued", "Last Issued"),
+               Column("status", "Status")]
+    return ReportData("Slow and Non-moving Stock", columns, iter(rows),
+                      "Period: %s to %s" % (date_from, date_to),
+                      options={'date_from': date_from, 'date_to': date_to})
+
+def forecastData(db):
+    columns = [Column("id", "S. No."), Column("code", "Item Code"),
+               Column("description", "Description"), Column("unit", "Unit"),
+               Column("min", "Min"), Column("max", "Max"),
+               Column("forecast", "Monthly Forecast"),
+               Column("new_min", "Suggested Min"),
+               Column("new_max", "Suggested Max"),
+               Column("months", "Months Issued")]
+    today = time.strftime("%d-%b-%Y")
+    return ReportData("Demand Forecast", columns,
+                      iter(demandForecast(db, **forecastSettings(loadConfig()))),
+                      "Date: %s" % today, options={'date': today})
+
+def valuationData(db):
+    columns = [Column("id", "S. No."), Column("code", "Item Code"),
+               Column("description", "Description"), Column("unit", "Unit"),
+               Column("quantity", "Quantity"),
+               Column("avg_cost", "Average Cost"),
+               Column("avg_value", "Average Value", True),
+               Column("fifo_value", "FIFO Value", True)]
+    today = time.strftime("%d-%b-%Y")
+    return ReportData("Stock Valuation", columns, db.valuation(),
+                      "Date: %s" % today, options={'date': today})
+
+def analyticsData(db, date_from, date_to):
+    columns = [Column("id", "S. No."), Column("code", "Item Code"),
+               Column("description", "Description"), Column("unit", "Unit"),
+               Column("on_hand", "On Hand"), Column("issued", "Issued", True),
+               Column("daily", "Daily Use"), Column("turnover", "Turnover"),
+               Column("cover", "Days of Cover"), Column("trend", "Trend")]
+    return ReportData("Stock Analytics", columns,
+                      iter(stockAnalytics(db, date_from, date_to)),
+                      "Period: %s to %s" % (date_from, date_to),
+                      options={'date_from': date_from, 'date_to': date_to})
+
+def closingStockData(db, date):
+    columns = [Column("id", "S. No."), Column("code", "Item Code"),
+               Column("description", "Description"), Column("unit", "Unit"),
+               Column("quantity", "Quantity"), Column("rate", "Rate"),
+               Column("amount", "Amount", True)]
+    return ReportData("Closing Stock", columns, iter(db.closingStock(date)),
+                      "As of: %s" % date, options={'date': date})
+
+def reorderData(db):
+    columns = [Column("serial", "S. No."), Column("code", "Item Code"),
+               Column("description", "Description"), Column("unit", "Unit"),
+               Column("on_hand", "On Hand"), Column("min", "Min"),
+               Column("max", "Max"), Column("order_qty", "Order", True)]
+    today = time.strftime("%d-%b-%Y")
+    rows = ((serial,) + item[1:]
+            for serial, item in enumerate(db.reorderList(), 1))
+    return ReportData("Reorder Level", columns, rows,
+                      "Date: %s" % today, options={'date': today})
+
+def registerData(db, kind, date_from, date_to):
+    columns = [Column("transid", "Trans. No."), Column("date", "Date"),
+               Column("reference", "Reference"),
+               Column("party", "Party / Remarks"),
+               Column("lines", "Lines", True),
+               Column("amount", "Amount", True)]
+    return ReportData(kind.title() + " Register", columns,
+                      db.register(kind, date_from, date_to),
+                      "Period: %s to %s" % (date_from, date_to),
+                      options={'title': kind.title() + " Register",
+                               'date_from': date_from, 'date_to': date_to})
+
+def consumptionData(db, date_from, date_to):
+    columns = [Column("costcenter", "Cost Center"), Column("name", "Name"),
+               Column("code", "Item Code"),
+               Column("description", "Description"), Column("unit", "Unit"),
+               Column("quantity", "Quantity"),
+               Column("amount", "Amount", True)]
+    return ReportData("Consumption by Cost Center", columns,
+                      db.consumption(date_from, date_to),
+                      "Period: %s to %s" % (date_from, date_to), group=0,
+                      options={'date_from': date_from, 'date_to': date_to})
+
+def _storeStock(db_name):
+    """Return the (code, description, unit, quantity, value) of the
+    products of the warehouse database db_name and the seconds it took.
+    Run in a worker process, one per warehouse."""
+    start = time.time()
+    db = Database()
+    db.openDB(db_name)
+    try:
+        rows = [item[1:5] + (item[6],) for item in db.valuation()]
+    finally:
+        db.closeDB()
+    return rows, time.time() - start
+
+def groupStock(stores, parallel=True):
+    """Return the stock of the (name, database file) warehouses in stores
+    merged by item code, as rows of code, description, unit, the quantity
+    in every store, the total quantity and value, and the seconds each
+    store took. The stores are read at the same time by worker processes
+    when parallel is True so the time is that of the slowest one."""
+    missing = [db_name for name, db_name in stores
+               if not os.path.isfile(db_name)]
+    if missing:
+        raise ValueError("warehouse database not found: %s"
+                         % ", ".join(missing))
+    files = [db_name for name, db_name in stores]
+    if parallel and len(stores) > 1:
+        with concurrent.futures.ProcessPoolExecutor(len(stores)) as pool:
+            results = list(pool.map(_storeStock, files))
+    else:
+        results = [_storeStock(db_name) for db_name in files]
+    count = len(stores)
+    merged = {}
+    for index, (rows, seconds) in enumerate(results):
+        for code, description, unit, quantity, value in rows:
+            item = merged.get(code)
+            if item is None:
+                item = merged[code] = ([code, description, unit]
+                                       + [0.0] * (count + 2))
+            item[3 + index] += quantity
+            item[3 + count] += quantity
+            item[4 + count] += value
+    timings = [(name, seconds)
+               for (name, db_name), (rows, seconds) in zip(stores, results)]
+    return [tuple(merged[code]) for code in sorted(merged, key=str)], timings
+
+def groupStockData(db):
+    """The current stock of all the warehouses of the settings, db is not
+    used as every warehouse has its own database."""
+    stores = warehouses(loadConfig())
+    rows, timings = groupStock(stores)
+    columns = ([Column("code", "Item Code"),
+                Column("description", "Description"), Column("unit", "Unit")]
+               + [Column("store_%d" % index, name)
+                  for index, (name, db_name) in enumerate(stores)]
+               + [Column("quantity", "Quantity"),
+                  Column("amount", "Amount", True)])
+    today = time.strftime("%d-%b-%Y")
+    names = ", ".join(name for name, db_name in stores)
+    return ReportData("Group Stock", columns, iter(rows),
+                      "Date: %s, warehouses: %s" % (today, names),
+                      options={'date': today, 'stores': names})
+# End of report sources.
+
+# Start of report renderers. A renderer writes a ReportData to a file
+# while iterating its rows once.
+class Renderer:
+    """Base class of the report renderers. Subclasses write the parts of
+    the report in begin, row, subtotal and end."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def render(self, report):
+        """Write report, adding subtotals and totals of the total columns."""
+        summed = [i for i, column in enumerate(report.columns) if column.total]
+        totals = dict((i, 0) for i in summed)
+        subtotals = dict((i, 0) for i in summed)
+        group = report.group
+        current = None
+        self.begin(report)
+        for row in report.rows:
+            if group is not None and row[group] != current:
+                if current is not None:
+                    self.subtotal(report, current, subtotals)
+                current = row[group]
+                subtotals = dict((i, 0) for i in summed)
+            self.row(report, row)
+            for i in summed:
+                totals[i] += row[i]
+                subtotals[i] += row[i]
+        if current is not None:
+            self.subtotal(report, current, subtotals)
+        self.end(report, totals)
+
+    def begin(self, report):
+        pass
+
+    def row(self, report, row):
+        pass
+
+    def subtotal(self, report, group, totals):
+        pass
+
+    def end(self, report, totals):
+        pass
+
+def _cellText(value):
+    """Return value as text, numbers with two decimals."""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return format(value, '0.2f')
+    return str(value)
+
+class CSVRenderer(Renderer):
+
+    def begin(self, report):
+        self.csvfile = open(self.path, 'w', newline='')
+        self.csvwriter = csv.writer(self.csvfile, delimiter=",")
+        self.csvwriter.writerow([column.key for column in report.columns])
+
+    def row(self, report, row):
+        self.csvwriter.writerow([_cellText(value) for value in row])
+
+    def subtotal(self, report, group, totals):
+        self.csvwriter.writerow(self._totalRow(report, group, "Subtotal", totals))
+
+    def end(self, report, totals):
+        self.csvwriter.writerow(self._totalRow(report, "", "Total", totals))
+        self.csvfile.close()
+
+    def _totalRow(self, report, group, label, totals):
+        row = [""] * len(report.columns)
+        if report.group is None:
+            row[0] = label
+        else:
+            row[report.group] = group
+            row[report.group + 1] = label
+        for i, value in totals.items():
+            row[i] = _cellText(float(value))
+        return row
+
+class HTMLRenderer(CSVRenderer):
+
+    def begin(self, report):
+        self.htmlfile = open(self.path, 'w')
+        self.htmlfile.write(
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+            "<title>%s</title></head><body>\n<h1>%s</h1>\n<p>%s</p>\n"
+            "<table border=\"1\">\n<tr>%s</tr>\n"
+            % (html.escape(report.title), html.escape(report.title),
+               html.escape(report.info),
+               "".join("<th>%s</th>" % html.escape(column.label)
+                       for column in report.columns)))
+
+    def row(self, report, row, tag="td"):
+        self.htmlfile.write(
+            "<tr>%s</tr>\n" % "".join("<%s>%s</%s>" % (tag, html.escape(_cellText(value)), tag)
+                                    for value in row))
+
+    def subtotal(self, report, group, totals):
+        self.row(report, self._totalRow(report, group, "Subtotal", totals), "th")
+
+    def end(self, report, totals):
+        self.row(report, self._totalRow(report, "", "Total", totals), "th")
+        self.htmlfile.write("</table>\n</body></html>\n")
+        self.htmlfile.close()
+
+class JSONRenderer(Renderer):
+    """Write one JSON object per row followed by one with the totals."""
+
+    def begin(self, report):
+        self.jsonfile = open(self.path, 'w')
+        self.keys = [column.key for column in report.columns]
+
+    def row(self, report, row):
+        self.jsonfile.write(json.dumps(dict(zip(self.keys, row))) + "\n")
+
+    def end(self, report, totals):
+        total = dict((self.keys[i], value) for i, value in totals.items())
+        self.jsonfile.write(json.dumps({'total': total}) + "\n")
+        self.jsonfile.close()
+# End of report renderers.
+
+# The available reports: name, source, PDF template, fixed source
+# arguments and the command line options passed after them.
+REPORTS = {'currentstock': (currentStockData, "currentstock", (), ()),
+           'closingstock': (closingStockData, "closingstock", (), ("date",)),
+           'reorder': (reorderData, "reorder", (), ()),
+           'valuation': (valuationData, "valuation", (), ()),
+           'forecast': (forecastData, "forecast", (), ()),
+           'abc': (abcData, "abc", (), ("date",)),
+           'slow_movers': (slowMoverData, "slow_movers", (), ()),
+           'incoming_register': (registerData, "register", ("incoming",),
+                                 ("date_from", "date_to")),
+           'outgoing_register': (registerData, "register", ("outgoing",),
+                                 ("date_from", "date_to")),
+           'adjustment_register': (registerData, "register", ("adjustment",),
+                                   ("date_from", "date_to")),
+           'consumption': (consumptionData, "consumption", (),
+                           ("date_from", "date_to")),
+           'analytics': (analyticsData, "analytics", (),
+                         ("date_from", "date_to")),
+           'group_stock': (groupStockData, "group_stock", (), ())}
+
+# The output formats besides PDF.
+RENDERERS = {'csv': CSVRenderer, 'html': HTMLRenderer, 'json': JSONRenderer}
+
+def writeReport(path, db, name, fmt, *args):
+    """Write report name to path in format fmt which is pdf, csv, html or
+    json. args are passed to the report source after db."""
+    source, mode = REPORTS[name][0:2]
+    report = source(db, *args)
+    if fmt == "pdf":
+        pdf = PDF(mode=mode, **report.options)
+        pdf.writeTable(report.rows, [column.key for column in report.columns])
+        pdf.output(path, 'F')
+    else:
+        RENDERERS[fmt](path).render(report)
+
+def loadConfig():
+    """Return the settings of config.json, empty if there is none yet."""
+    if not os.path.isfile('config.json'):
+        return {}
+    with open('config.json', 'r') as cf:
+        return json.load(cf)
+
+# The warehouse chosen at login as (name, database file), None until then
+# so the default database of config.json is used.
+_warehouse = None
+
+def warehouses(data):
+    """Return the (name, database file) of the warehouses in the settings,
+    set as {"warehouses": {name: file}}, or the default database alone."""
+    stores = data.get('warehouses')
+    if not stores:
+        return [("Default", data['default_db'])]
+    return list(stores.items())
+
+def selectWarehouse(name, db_name):
+    """Make the windows opened from now on use the database of warehouse
+    name."""
+    global _warehouse
+    _warehouse = (name, db_name)
+
+def warehouseName():
+    """Return the name of the selected warehouse, None if none was."""
+    return _warehouse[0] if _warehouse is not None else None
+
+def databaseName(data):
+    """Return the database file of the selected warehouse, the default
+    database of the settings data if none was selected."""
+    if _warehouse is not None:
+        return _warehouse[1]
+    return data['default_db']
+
+class ReportViewer:
+    """Open report files with the viewer of the platform without waiting
+    for it.
+
+    command is a program to use instead, e.g. "evince" or
+    "okular --print", and enabled False turns the viewer off for
+    terminals without a display.
+    """
+
+    def __init__(self, command=None, enabled=True):
+        self.command = command
+        self.enabled = enabled
+
+    @classmethod
+    def fromConfig(cls, data=None):
+        """Create the viewer from the viewer and open_reports settings."""
+        if data is None:
+            data = loadConfig()
+        return cls(data.get('viewer'), data.get('open_reports', True))
+
+    def open(self, path):
+        """Start the viewer on path. Raise OSError if it could not start."""
+        if not self.enabled:
+            return
+        path = os.path.abspath(path)
+        if self.command:
+            args = shlex.split(self.command) + [path]
+        elif sys.platform.startswith('win'):
+            os.startfile(path)
+            return
+        elif sys.platform == 'darwin':
+            args = ['open', path]
+        else:
+            args = ['xdg-open', path]
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL,
+                                   close_fds=True)
+        # Reap the viewer when it exits so it does not linger as a zombie.
+        threading.Thread(target=process.wait, daemon=True).start()
+
+def openReport(path):
+    """Show a finished report with the configured viewer, or tell the user
+    why it could not be opened."""
+    try:
+        ReportViewer.fromConfig().open(path)
+    except OSError:
+        mb.showerror("Error", "Could not open %s:\n%s"
+                     % (path, sys.exc_info()[1]))
+
+def writeAtomic(path, render, *args):
+    """Call render(temp, *args) and move the finished file to path, so a
+    reader never sees a partly written report."""
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    temp = '%s.%d-%d.tmp' % (path, os.getpid(), threading.get_ident())
+    try:
+        render(temp, *args)
+        os.replace(temp, path)
+    finally:
+        if os.path.isfile(temp):
+            os.remove(temp)
+
+class ReportOutput:
+    """Allocate unique, timestamped report files in the reports folder and
+    remove the ones older than keep_days."""
+
+    counter = itertools.count(1)
+
+    def __init__(self, folder='reports', keep_days=30):
+        self.folder = folder
+        self.keep_days = keep_days
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+    def allocate(self, name, ext):
+        """Return a new file path for report name, e.g.
+        reports/incoming-20170101-093000-1234-1.pdf."""
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        while True:
+            path = '%s/%s-%s-%d-%d.%s' % (self.folder, name, stamp, os.getpid(),
+                                          next(self.counter), ext)
+            if not os.path.exists(path):
+                return path
+
+    def create(self, name, ext, render, *args):
+        """Write report name with render(path, *args), return its path."""
+        path = self.allocate(name, ext)
+        writeAtomic(path, render, *args)
+        return path
+
+    def cleanup(self):
+        """Remove the report files older than keep_days, return the count."""
+        limit = time.time() - self.keep_days * 86400
+        count = 0
+        for name in os.listdir(self.folder):
+            path = '%s/%s' % (self.folder, name)
+            try:
+                if os.path.isfile(path) and os.path.getmtime(path) < limit:
+                    os.remove(path)
+                    count += 1
+            except OSError:
+                pass
+        return count
+
+class ReportQueue:
+    """Run report jobs in worker threads. Every job gets its own database
+    connection and output file so jobs never block or overwrite each
+    other. With snapshot each job reads in one read transaction (see
+    Database.beginSnapshot)."""
+
+    def __init__(self, db_name, output=None, workers=2, snapshot=False):
+        self.db_name = db_name
+        self.output = output or ReportOutput()
+        self.snapshot = snapshot
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+
+    def submit(self, name, ext, render, *args):
+        """Queue report name, return a future of the written path."""
+        return self.executor.submit(self._run, name, ext, render, args)
+
+    def _run(self, name, ext, render, args):
+        db = Database()
+        db.openDB(self.db_name)
+        try:
+            if self.snapshot:
+                db.beginSnapshot()
+            return self.output.create(name, ext, render, db, *args)
+        finally:
+            db.closeDB()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
+
+class ReportCache:
+    """Rendered report files kept in a folder under a key made of the
+    report name, its parameters and the database change counter. The
+    folder is only used by this cache, so evict never removes the
+    reprinted transactions kept in reports/cache."""
+
+    def __init__(self, folder='reports/cache/reports',
+                 max_bytes=50 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+    def path(self, name, params, seq, ext):
+        """Return the cache file of a report, it may not exist yet."""
+        key = repr((name, params, seq)).encode("utf-8")
+        digest = hashlib.sha1(key).hexdigest()[:16]
+        return '%s/%s-%s.%s' % (self.folder, name, digest, ext)
+
+    def fetch(self, path):
+        """Return True if path is cached and mark it as recently used."""
+        if not os.path.isfile(path):
+            return False
+        os.utime(path, None)
+        return True
+
+    def evict(self, keep=None):
+        """Remove the least recently used files until the folder fits in
+        max_bytes. The file keep is never removed."""
+        files = []
+        total = 0
+        for name in os.listdir(self.folder):
+            path = '%s/%s' % (self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        files.sort()
+        for mtime, size, path in files:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+class BackupRestarted(Exception):
+    """Raised when a paced backup was restarted too often by writes."""
+
+class Backup:
+    """Copy a database while it is in use with the SQLite backup API into
+    timestamped files in folder, keeping the newest keep copies.
+
+    The pages are copied a batch at a time with a pause in between so
+    writers get the database in the meantime. A write from another
+    connection makes SQLite start the copy again, after max_restarts of
+    those the rest is copied in one step which holds writers back until
+    it is done. The copy is checked with PRAGMA integrity_check when
+    verify is set and gzipped when compress is set.
+    """
+
+    def __init__(self, folder='backups', keep=7, compress=False, verify=True,
+                 pages=1024, sleep=0.05, max_restarts=3):
+        self.folder = folder
+        self.keep = keep
+        self.compress = compress
+        self.verify = verify
+        self.pages = pages
+        self.sleep = sleep
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self.seconds = 0.0
+        self._remaining = None
+
+    def run(self, db_name):
+        """Back up db_name, remove the old copies and return the path. The
+        folder is made by the first backup."""
+        stem = os.path.splitext(os.path.basename(db_name))[0]
+        path = '%s/%s-%s.db' % (self.folder, stem,
+                                time.strftime("%Y%m%d-%H%M%S"))
+        if self.compress:
+            path += '.gz'
+        start = time.time()
+        writeAtomic(path, self._copy, db_name)
+        self.seconds = time.time() - start
+        self.rotate(stem)
+        return path
+
+    def _copy(self, path, db_name):
+        temp = path + '.db' if self.compress else path
+        source = sqlite3.connect(db_name)
+        target = sqlite3.connect(temp)
+        try:
+            self.restarts = 0
+            self._remaining = None
+            try:
+                source.backup(target, pages=self.pages,
+                              progress=self._progress, sleep=self.sleep)
+            except BackupRestarted:
+                source.backup(target)
+            if self.verify:
+                query = target.execute("""PRAGMA integrity_check""")
+                check = query.fetchone()[0]
+                if check != "ok":
+                    raise sqlite3.DatabaseError(
+                        "backup of %s is damaged: %s" % (db_name, check))
+        finally:
+            target.close()
+            source.close()
+        if self.compress:
+            try:
+                with open(temp, 'rb') as src, gzip.open(path, 'wb', 6) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+            finally:
+                os.remove(temp)
+
+    def _progress(self, status, remaining, total):
+        if self._remaining is not None and remaining > self._remaining:
+            self.restarts += 1
+            if self.restarts > self.max_restarts:
+                raise BackupRestarted()
+        self._remaining = remaining
+
+    def files(self, stem):
+        """Return the backups of database stem, newest first. Only the
+        names run() gives match, so store.db does not claim the backups of
+        store-north.db."""
+        if not os.path.isdir(self.folder):
+            return []
+        pattern = re.compile(r'%s-\d{8}-\d{6}\.db(\.gz)?$' % re.escape(stem))
+        names = [name for name in os.listdir(self.folder)
+                 if pattern.match(name)]
+        return ['%s/%s' % (self.folder, name)
+                for name in sorted(names, reverse=True)]
+
+    def rotate(self, stem):
+        """Remove the backups of stem older than the newest keep."""
+        for path in self.files(stem)[self.keep:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def latest(self, db_name):
+        """Return the time of the newest backup of db_name, 0 if none."""
+        stem = os.path.splitext(os.path.basename(db_name))[0]
+        files = self.files(stem)
+        return os.path.getmtime(files[0]) if files else 0
+
+def backupSettings(data):
+    """Return the Backup of the settings in config.json data."""
+    return Backup(folder=data.get('backup_dir', 'backups'),
+                  keep=data.get('backup_keep', 7),
+                  compress=data.get('backup_compress', False))
+
+class ReportSnapshot:
+    """A copy of a database made with the SQLite backup API for reports to
+    read, so a long report holds no read transaction on the live file and
+    all its pages show the same moment. The copy is made again when it is
+    older than max_age seconds, the old one is removed once no report has
+    it open."""
+
+    def __init__(self, db_name, folder='reports/snapshot', max_age=900):
+        self.db_name = db_name
+        self.max_age = max_age
+        self.stem = os.path.splitext(os.path.basename(db_name))[0]
+        self.backup = Backup(folder=folder, keep=1, verify=False)
+        self.current = None
+
+    def stale(self):
+        """Return True if there is no copy or it is older than max_age."""
+        return time.time() - self.backup.latest(self.db_name) >= self.max_age
+
+    def refresh(self):
+        """Copy the database again and return the path of the copy."""
+        self.current = self.backup.run(self.db_name)
+        return self.current
+
+    def path(self):
+        """Return the path of the copy refresh made last, else of the
+        newest copy in the folder, making one if there is none."""
+        if self.current is not None and os.path.isfile(self.current):
+            return self.current
+        files = self.backup.files(self.stem)
+        return files[0] if files else self.refresh()
+
+def snapshotSettings(data):
+    """Return the report snapshot mode of the settings in config.json data,
+    "transaction" (the default), "copy" or "live", and for "copy" the
+    ReportSnapshot of the selected database.
+
+    A read transaction held by a report stops the writers unless the
+    database is in WAL mode, so without it "copy" is returned in place of
+    "transaction"."""
+    mode = data.get('report_snapshot', 'transaction')
+    db_name = databaseName(data)
+    if mode == "transaction" and journalMode(db_name) != "wal":
+        mode = "copy"
+    if mode != "copy":
+        return mode, None
+    return mode, ReportSnapshot(
+        db_name, max_age=data.get('report_snapshot_minutes', 15) * 60)
+
+def journalMode(db_name):
+    """Return the journal mode of the database file db_name, "delete" if
+    there is no such file."""
+    if not os.path.isfile(db_name):
+        return "delete"
+    con = sqlite3.connect(db_name)
+    try:
+        return con.execute("""PRAGMA journal_mode""").fetchone()[0]
+    finally:
+        con.close()
+
+def measureBackup(db_name, backup, interval=0.05, baseline=2.0):
+    """Back up db_name while another connection posts a small write every
+    interval seconds, as a clerk saving a receipt would. Return the path
+    and the write latencies (seconds) before and during the backup."""
+    stop = threading.Event()
+    samples = []
+
+    def post():
+        con = sqlite3.connect(db_name, timeout=60)
+        try:
+            while not stop.is_set():
+                began = time.time()
+                con.execute(
+                    """INSERT OR REPLACE INTO maintenance
+                    VALUES('latency_probe', ?, 0, '')""", (began,))
+                con.commit()
+                samples.append((began, time.time() - began))
+                time.sleep(interval)
+            con.execute("""DELETE FROM maintenance WHERE step='latency_probe'""")
+            con.commit()
+        finally:
+            con.close()
+
+    thread = threading.Thread(target=post)
+    thread.start()
+    try:
+        time.sleep(baseline)
+        started = time.time()
+        path = backup.run(db_name)
+    finally:
+        stop.set()
+        thread.join()
+    before = [latency for began, latency in samples if began < started]
+    during = [latency for began, latency in samples if began >= started]
+    return path, before, during
+
+def latencyText(samples):
+    """Return the count, median, 95th percentile and maximum of samples
+    (seconds) in milliseconds as text."""
+    if not samples:
+        return "no samples"
+    samples = sorted(samples)
+    return "%d writes, median %.1f ms, p95 %.1f ms, max %.1f ms" % (
+        len(samples), samples[len(samples) // 2] * 1000,
+        samples[int(len(samples) * 0.95)] * 1000, samples[-1] * 1000)
+
+def createReplica(master_name, path):
+    """Copy the database master_name to path with the SQLite backup API
+    and make the copy the replica of an offline terminal."""
+    if os.path.exists(path):
+        raise ValueError("%s exists already" % path)
+    source = sqlite3.connect(master_name)
+    target = sqlite3.connect(path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    db = Database()
+    try:
+        db.openDB(path)
+        db.makeReplica()
+    except Exception:
+        db.closeDB()
+        os.remove(path)
+        raise
+    db.closeDB()
+
+def renderTransaction(path, options, item_list, remarks):
+    """Write an incoming, outgoing or adjustment transaction to path.
+
+    options are the PDF header options and item_list holds one tuple per
+    line, (serial, itemcode, description, unit, quantity, price, amount),
+    with the adjustment type after the unit for adjustments.
+    """
+    pdf = PDF(**options)
+    pdf.writeTable(item_list, remarks=remarks)
+    pdf.output(path, 'F')
+
+def reprintTransaction(db, kind, transid):
+    """Render the saved transaction transid of kind (incoming, outgoing
+    or adjustment) and return the pdf path, None if it does not exist.
+
+    Rendered files are kept in the cache folder under the document id and
+    a hash of its content, so printing an unchanged document again only
+    reads the file.
+    """
+    data = db.loadTransaction(kind, transid)
+    if data is None:
+        return None
+    options, item_list, remarks = data
+    content = repr((options, item_list, remarks)).encode("utf-8")
+    digest = hashlib.sha1(content).hexdigest()[:16]
+    cache_dir = 'reports/cache'
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    path = '%s/%s-%s-%s.pdf' % (cache_dir, kind, transid, digest)
+    if not os.path.isfile(path):
+        writeAtomic(path, renderTransaction, options, item_list, remarks)
+    return path
+
+# Start of PDF templates.
+class PDFTemplate:
+    """The layout of a PDF report, declared once and shared by every
+    document made with it.
+
+    title and the lines in number, fields and info are format strings
+    filled with the PDF options. The transaction layout, with the image
+    and the number, is used when number is given. columns are the table
+    Columns. group formats the first row of a group and subtotal the
+    group totals, summary formats the totals of the columns in totals
+    and count, the number of rows. remarks adds the remarks line of the
+    transactions instead of the summary."""
+
+    def __init__(self, title, columns, image=None, number=None, fields=(),
+                 info=None, group=None, subtotal=None,
+                 summary="Total Amount: {amount:0,.2f}", totals=("amount",),
+                 remarks=False):
+        self.title = title
+        self.columns = columns
+        self.image = image
+        self.number = number
+        self.fields = fields
+        self.info = info
+        self.group = group
+        self.subtotal = subtotal
+        self.summary = summary
+        self.totals = totals
+        self.remarks = remarks
+
+def _stockColumns():
+    return [Column("id", "S. No.", width=15, align='C'),
+            Column("code", "Item Code", width=30, align='C'),
+            Column("description", "Description", width=60, fmt="{!s:.25}"),
+            Column("unit", "Unit", width=15, align='C'),
+            Column("quantity", "Quantity", align='R', fmt="{:0.2f}"),
+            Column("rate", "Rate", align='R', fmt="{:0.2f}"),
+            Column("amount", "Amount", width=30, align='R', fmt="{:0,.2f}")]
+
+def _transactionColumns():
+    return [Column("serial", "S. No.", width=15),
+            Column("code", "Item Code", width=30),
+            Column("description", "Description", width=60, fmt="{!s:.25}"),
+            Column("unit", "Unit", width=15, align='C'),
+            Column("quantity", "Quantity", fmt="{:0.2f}"),
+            Column("rate", "Rate", fmt="{:0.2f}"),
+            Column("amount", "Amount", width=30, fmt="{:0,.2f}")]
+
+PDF_TEMPLATES = {
+    'incoming': PDFTemplate(
+        "Incoming Transaction", _transactionColumns(),
+        image='images/cart-12.png', number="Trans. No.: IN-{transid}",
+        fields=("Date: {date}", "Supplier Ref: {dn_number}",
+                "Supplier: {supplier}"), remarks=True),
+    'outgoing': PDFTemplate(
+        "Outgoing Transaction", _transactionColumns(),
+        image='images/cashier-1.png', number="Trans. No.: OUT-{transid}",
+        fields=("Date: {date}", "Cost Ctr. Code: {costctrcode}",
+                "Cost Ctr. Name: {costctrname}"), remarks=True),
+    'adjustment': PDFTemplate(
+        "Adjustment Transaction",
+        [Column("serial", "S. No.", width=13),
+         Column("code", "Item Code", width=28),
+         Column("description", "Description", width=55, fmt="{!s:.20}"),
+         Column("unit", "Unit", width=13, align='C'),
+         Column("type", "Type", width=13, align='C'),
+         Column("quantity", "Quantity", width=19, fmt="{:0.2f}"),
+         Column("rate", "Rate", width=19, fmt="{:0.2f}"),
+         Column("amount", "Amount", width=28, fmt="{:0,.2f}")],
+        image='images/tape.png', number="Trans. No.: ADJ-{transid}",
+        fields=("Date: {date}",), remarks=True),
+    'currentstock': PDFTemplate("Current Stock", _stockColumns(),
+                                info="Date: {date}"),
+    'closingstock': PDFTemplate("Closing Stock", _stockColumns(),
+                                info="As of: {date}"),
+    'valuation': PDFTemplate(
+        "Stock Valuation",
+        [Column("id", "S. No.", width=15, align='C'),
+         Column("code", "Item Code", width=25, align='C'),
+         Column("description", "Description", width=45, fmt="{!s:.18}"),
+         Column("unit", "Unit", width=15, align='C'),
+         Column("quantity", "Quantity", align='R', fmt="{:0.2f}"),
+         Column("avg_cost", "Avg. Cost", align='R', fmt="{:0.2f}"),
+         Column("avg_value", "Avg. Value", width=25, align='R',
+                fmt="{:0,.2f}"),
+         Column("fifo_value", "FIFO Value", width=25, align='R',
+                fmt="{:0,.2f}")],
+        info="Date: {date}",
+        summary="Average: {avg_value:0,.2f}  FIFO: {fifo_value:0,.2f}",
+        totals=("avg_value", "fifo_value")),
+    'analytics': PDFTemplate(
+        "Stock Analytics",
+        [Column("code", "Item Code", width=25, align='C'),
+         Column("description", "Description", width=45, fmt="{!s:.18}"),
+         Column("unit", "Unit", width=12, align='C'),
+         Column("on_hand", "On Hand", align='R', fmt="{:0.2f}"),
+         Column("issued", "Issued", align='R', fmt="{:0.2f}"),
+         Column("daily", "Daily", width=18, align='R', fmt="{:0.2f}"),
+         Column("turnover", "Turns", width=16, align='R', fmt="{:0.2f}"),
+         Column("cover", "Cover", width=16, align='R', fmt="{:0.0f}"),
+         Column("trend", "Trend", width=18, align='R', fmt="{:+0.2f}")],
+        info="Period: {date_from} to {date_to}",
+        summary="Total Issued: {issued:0,.2f}", totals=("issued",)),
+    'forecast': PDFTemplate(
+        "Demand Forecast",
+        [Column("code", "Item Code", width=25, align='C'),
+         Column("description", "Description", width=45, fmt="{!s:.18}"),
+         Column("unit", "Unit", width=12, align='C'),
+         Column("min", "Min", align='R', fmt="{:0.2f}"),
+         Column("max", "Max", align='R', fmt="{:0.2f}"),
+         Column("forecast", "Monthly", width=22, align='R', fmt="{:0.2f}"),
+         Column("new_min", "New Min", width=23, align='R', fmt="{:0.2f}"),
+         Column("new_max", "New Max", width=23, align='R', fmt="{:0.2f}")],
+        info="Date: {date}", summary="Items: {count}", totals=()),
+    'abc': PDFTemplate(
+        "ABC Analysis",
+        [Column("rank", "Rank", width=12, align='R'),
+         Column("code", "Item Code", width=25, align='C'),
+         Column("description", "Description", width=50, fmt="{!s:.20}"),
+         Column("unit", "Unit", width=12, align='C'),
+         Column("quantity", "Quantity", align='R', fmt="{:0.2f}"),
+         Column("value", "Value", width=25, align='R', fmt="{:0,.2f}"),
+         Column("share", "Share", width=15, align='R', fmt="{:0.1f}"),
+         Column("cumulative", "Cum.", width=16, align='R', fmt="{:0.1f}"),
+         Column("class", "Class", width=15, align='C')],
+        info="Period: {date_from} to {date_to}",
+        summary="A and B: {value:0,.2f}  C: {rest} items, {rest_value:0,.2f}",
+        totals=("value",)),
+    'slow_movers': PDFTemplate(
+        "Slow and Non-moving Stock",
+        [Column("code", "Item Code", width=25, align='C'),
+         Column("description", "Description", width=30, fmt="{!s:.12}"),
+         Column("unit", "Unit", width=12, align='C'),
+         Column("on_hand", "On Hand", align='R', fmt="{:0.2f}"),
+         Column("value", "Value", width=25, align='R', fmt="{:0,.2f}"),
+         Column("issued", "Issued", width=18, align='R', fmt="{:0.2f}"),
+         Column("cover", "Cover", width=15, align='R', fmt="{:0.0f}"),
+         Column("last_issued", "Last Issue", width=25, align='C'),
+         Column("status", "Status", align='C')],
+        info="Period: {date_from} to {date_to}",
+        summary="Total Value: {value:0,.2f}", totals=("value",)),
+    'reorder': PDFTemplate(
+        "Reorder Level",
+        [Column("serial", "S. No.", width=15, align='C'),
+         Column("code", "Item Code", width=30, align='C'),
+         Column("description", "Description", width=50, fmt="{!s:.20}"),
+         Column("unit", "Unit", width=15, align='C'),
+         Column("on_hand", "On Hand", align='R', fmt="{:0.2f}"),
+         Column("min", "Min", align='R', fmt="{:0.2f}"),
+         Column("max", "Max", align='R', fmt="{:0.2f}"),
+         Column("order_qty", "Order", align='R', fmt="{:0.2f}")],
+        info="Date: {date}", summary="Items to Order: {count}", totals=()),
+    'register': PDFTemplate(
+        "{title}",
+        [Column("transid", "Trans. No.", width=25),
+         Column("date", "Date", width=25, align='C'),
+         Column("reference", "Reference", width=35, fmt="{!s:.14}"),
+         Column("party", "Party / Remarks", width=60, fmt="{!s:.25}"),
+         Column("lines", "Lines", width=15, align='R'),
+         Column("amount", "Amount", width=30, align='R', fmt="{:0,.2f}")],
+        info="Period: {date_from} to {date_to}"),
+    'consumption': PDFTemplate(
+        "Consumption by Cost Center",
+        [Column("code", "Item Code", width=30, align='C'),
+         Column("description", "Description", width=70, fmt="{!s:.30}"),
+         Column("unit", "Unit", width=15, align='C'),
+         Column("quantity", "Quantity", width=25, align='R', fmt="{:0.2f}"),
+         Column("amount", "Amount", width=35, align='R', fmt="{:0,.2f}")],
+        info="Period: {date_from} to {date_to}",
+        group="{costcenter} - {name}", subtotal="Subtotal: {amount:0,.2f}"),
+    'group_stock': PDFTemplate(
+        "Group Stock",
+        [Column("code", "Item Code", width=30, align='C'),
+         Column("description", "Description", width=70, fmt="{!s:.30}"),
+         Column("unit", "Unit", width=15, align='C'),
+         Column("quantity", "Quantity", width=25, align='R', fmt="{:0.2f}"),
+         Column("amount", "Amount", width=35, align='R', fmt="{:0,.2f}")],
+        info="Date: {date}  Warehouses: {stores}"),
+}
+# End of PDF templates.
+
 class PDF(FPDF):
 
     def __init__(self, **kwargs):
         FPDF.__init__(self)
+        self.options = kwargs
         self.mode = kwargs['mode']
-        if self.mode == "incoming":
-            self.transid = kwargs['transid']
-            self.dn_number = kwargs['dn_number']
-            self.supplier = kwargs['supplier']
-            self.date = kwargs['date']
-        elif self.mode == "outgoing":
-            self.transid = kwargs['transid']
-            self.costctrcode = kwargs['costctrcode']
-            self.costctrname = kwargs['costctrname']
-            self.date = kwargs['date']
-        elif self.mode == "adjustment":
-            self.transid = kwargs['transid']
-            self.date = kwargs['date']
-        else:
-            pass
+        self.template = PDF_TEMPLATES[self.mode]
+        # The header text is the same on every page.
+        template = self.template
+        self.title_text = template.title.format(**kwargs)
+        self.number_text = None
+        if template.number is not None:
+            self.number_text = template.number.format(**kwargs)
+        self.field_lines = [field.format(**kwargs) for field in template.fields]
+        self.info_text = None
+        if template.info is not None:
+            self.info_text = template.info.format(**kwargs)
 
     def header(self):
-        if self.mode == "incoming":
-            # Set the logo.
-            self.image('images/cart-12.png', 10, 8, 33)
-            # Set the font.
-            self.set_font('Times', 'B', 16)
-            # Add the title.
-            self.cell(0, 10, 'Incoming Transaction', 0, 0, 'C')
-            # Add a line break.
-            self.ln(45)
-            # Add custom header.
-            self.set_font('Courier', 'B', 13)
-            self.cell(0, 7, "Trans. No.: IN-"+self.transid, 0, 1, 'R')
-            self.set_font('Courier', 'B', 10)
-            self.cell(30, 7, "Date: "+self.date, 0, 1)
-            self.cell(30, 7, "Supplier Ref: "+self.dn_number, 0, 1)
-            self.cell(30, 7, "Supplier: "+self.supplier, 0, 1)
-            self.ln(5)
-            self.cell(15, 7, "S. No.", 1, 0, 'C')
-            self.cell(30, 7, "Item Code", 1, 0, 'C')
-            self.cell(60, 7, "Description", 1, 0, 'C')
-            self.cell(15, 7, "Unit", 1, 0, 'C')
-            self.cell(20, 7, "Quantity", 1, 0, 'C')
-            self.cell(20, 7, "Rate", 1, 0, 'C')
-            self.cell(30, 7, "Amount", 1, 0, 'C')
-            self.ln(10)
-        elif self.mode == "outgoing":
+        template = self.template
+        if template.image is not None:
             # Set the logo.
-            self.image('images/cashier-1.png', 10, 8, 33)
-            # Set the font.
-            self.set_font('Times', 'B', 16)
-            # Add the title.
-            self.cell(0, 10, 'Outgoing Transaction', 0, 0, 'C')
-            # Add a line break.
+            self.image(template.image, 10, 8, 33)
+        self.set_font('Times', 'B', 16)
+        # Add the title.
+        self.cell(0, 10, self.title_text, 0, 0, 'C')
+        # Add custom header.
+        if self.number_text is not None:
             self.ln(45)
-            # Add custom header.
             self.set_font('Courier', 'B', 13)
-            self.cell(0, 7, "Trans. No.: OUT-"+self.transid, 0, 1, 'R')
+            self.cell(0, 7, self.number_text, 0, 1, 'R')
             self.set_font('Courier', 'B', 10)
-            self.cell(30, 7, "Date: "+self.date, 0, 1)
-            self.cell(30, 7, "Cost Ctr. Code: "+self.costctrcode, 0, 1)
-            self.cell(30, 7, "Cost Ctr. Name: "+self.costctrname, 0, 1)
+            for line in self.field_lines:
+                self.cell(30, 7, line, 0, 1)
             self.ln(5)
-            self.cell(15, 7, "S. No.", 1, 0, 'C')
-            self.cell(30, 7, "Item Code", 1, 0, 'C')
-            self.cell(60, 7, "Description", 1, 0, 'C')
-            self.cell(15, 7, "Unit", 1, 0, 'C')
-            self.cell(20, 7, "Quantity", 1, 0, 'C')
-            self.cell(20, 7, "Rate", 1, 0, 'C')
-            self.cell(30, 7, "Amount", 1, 0, 'C')
-            self.ln(10)
-
-        elif self.mode == "adjustment":
-            # Set the logo.
-            self.image('images/tape.png', 10, 8, 33)
-            # Set the font.
-            self.set_font('Times', 'B', 16)
-            # Add the title.
-            self.cell(0, 10, 'Adjustment Transaction', 0, 0, 'C')
-            # Add a line break.
-            self.ln(45)
-            # Add custom header.
-            self.set_font('Courier', 'B', 13)
-            self.cell(0, 7, "Trans. No.: ADJ-"+self.transid, 0, 1, 'R')
-            self.set_font('Courier', 'B', 10)
-            self.cell(30, 7, "Date: "+self.date, 0, 1)
-            self.ln(5)
-            self.cell(13, 7, "S. No.", 1, 0, 'C')
-            self.cell(28, 7, "Item Code", 1, 0, 'C')
-            self.cell(55, 7, "Description", 1, 0, 'C')
-            self.cell(13, 7, "Unit", 1, 0, 'C')
-            self.cell(13, 7, "Type", 1, 0, 'C')
-            self.cell(19, 7, "Quantity", 1, 0, 'C')
-            self.cell(19, 7, "Rate", 1, 0, 'C')
-            self.cell(28, 7, "Amount", 1, 0, 'C')
-            self.ln(10)
-
-        elif self.mode == "currentstock":
-            self.set_font('Times', 'B', 16)
-            # Add the title.
-            self.cell(0, 10, 'Current Stock', 0, 0, 'C')
-            # Add a line break.
+        else:
             self.ln(12)
-            # Add custom header.
             self.set_font('Courier', 'B', 10)
-            date_of_report = time.strftime("%d-%b-%Y")
-            self.cell(0, 7, "Date: %s" % date_of_report, 0, 1, "R") 
-            self.cell(15, 7, "S. No.", 1, 0, 'C')
-            self.cell(30, 7, "Item Code", 1, 0, 'C')
-            self.cell(60, 7, "Description", 1, 0, 'C')
-            self.cell(15, 7, "Unit", 1, 0, 'C')
-            self.cell(20, 7, "Quantity", 1, 0, 'C')
-            self.cell(20, 7, "Rate", 1, 0, 'C')
-            self.cell(30, 7, "Amount", 1, 0, 'C')
-            self.ln(10)
+            self.cell(0, 7, self.info_text, 0, 1, "R")
+        for column in template.columns:
+            self.cell(column.width, 7, column.label, 1, 0, 'C')
+        self.ln(10)
+
+    def rowPlan(self, keys=None):
+        """Return the (index, width, align, format) of each template
+        column. keys are the names of the row fields, the rows are in
+        template column order if keys is None."""
+        plan = []
+        for i, column in enumerate(self.template.columns):
+            index = i if keys is None else keys.index(column.key)
+            plan.append((index, column.width, column.align,
+                         column.fmt.format))
+        return plan
+
+    def writeTable(self, rows, keys=None, remarks=""):
+        """Write the pages of rows in the template layout followed by the
+        summary, or the remarks line for transactions. The column
+        positions and formatters are looked up once in the row plan."""
+        template = self.template
+        names = keys or [column.key for column in template.columns]
+        summed = [names.index(key) for key in template.totals]
+        totals = [0] * len(summed)
+        subtotals = [0] * len(summed)
+        count = 0
+        current = None
+        if template.group is not None:
+            grouped = [names.index(field[1]) for field
+                       in string.Formatter().parse(template.group) if field[1]]
+        self.alias_nb_pages()
+        self.add_page()
+        self.set_font('Courier', '', 10)
+        plan = self.rowPlan(keys)
+        for row in rows:
+            if template.group is not None:
+                group = [row[index] for index in grouped]
+                if group != current:
+                    if current is not None:
+                        self._subtotal(subtotals)
+                    current = group
+                    subtotals = [0] * len(summed)
+                    self.set_font('Courier', 'B', 10)
+                    self.cell(0, 7, template.group.format(**dict(zip(names, row))),
+                              0, 1)
+                    self.set_font('Courier', '', 10)
+            for index, width, align, fmt in plan:
+                value = row[index]
+                value = "" if value is None else fmt(value)
+                self.cell(width, 10, value, 0, 0, align)
+            self.ln(5)
+            count += 1
+            for i, index in enumerate(summed):
+                totals[i] += float(row[index])
+                subtotals[i] += float(row[index])
+        if current is not None:
+            self._subtotal(subtotals)
+        self.ln(25)
+        self.set_font('Courier', 'B', 10)
+        if template.remarks:
+            self.cell(105, 7, "Remarks: "+remarks)
+            self.cell(15, 7, "")
+            self.cell(40, 7, "Total Amount:", 0, 0, 'C')
+            self.cell(30, 7, format(totals[0], '0,.2f'), 1, 0, 'C')
         else:
-            pass
+            values = dict(self.options, count=count)
+            values.update(zip(template.totals, totals))
+            self.cell(0, 7, template.summary.format(**values), 1, 0, 'R')
+
+    def _subtotal(self, subtotals):
+        self.set_font('Courier', 'B', 10)
+        values = dict(zip(self.template.totals, subtotals))
+        self.cell(0, 7, self.template.subtotal.format(**values), 0, 1, 'R')
+        self.set_font('Courier', '', 10)
 
     def footer(self):
         # Position at 1.5 cm from bottom
@@ -2995,7 +6839,735 @@ class PDF(FPDF):
         # Page number
         self.cell(0, 10, 'Page ' + str(self.page_no()) + '/{nb}', 0, 0, 'C')
 
+# Start of WriteQueue class.
+class WriteQueue:
+    """Save the postings of many threads with group commit.
+
+    One writer thread owns the connection. Once a posting arrives it
+    waits up to window seconds for more, at most max_batch in all, and
+    saves them in one transaction with a savepoint for each, so a failing
+    posting is rolled back alone and only its caller gets the error. A
+    longer window means fewer commits for the same postings, which pays
+    when a commit waits long on the disk, at the cost of the latency of
+    every posting. With 0 the postings queued while the previous commit
+    ran make the next batch.
+
+    With wal the database is switched to WAL mode, where readers and the
+    writer do not block each other. The mode stays with the file, so it
+    is only for databases on a local disk which every client opens on
+    the same machine, WAL does not work over a network share.
+    """
+
+    def __init__(self, db_name, window=0.0, max_batch=200, wal=False):
+        self.db_name = db_name
+        self.window = window
+        self.max_batch = max_batch
+        self.wal = wal
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.postings = 0
+        self.failed = 0
+        self.batches = 0
+        self.largest = 0
+        self.commit_seconds = 0.0
+        # Seconds from submit to result of the latest postings.
+        self.latencies = collections.deque(maxlen=1000)
+        self.closed = False
+        self.error = None
+        opened = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(opened,),
+                                       daemon=True)
+        self.thread.start()
+        opened.wait()
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, kind, header, items):
+        """Queue a posting for Database.postDocument, return a future of
+        its id."""
+        if self.closed:
+            raise RuntimeError("the write queue is closed")
+        future = concurrent.futures.Future()
+        self.queue.put(((kind, header, items), future, time.time()))
+        return future
+
+    def post(self, kind, header, items):
+        """Save a posting and return its id once it is committed."""
+        return self.submit(kind, header, items).result()
+
+    def close(self):
+        """Save the postings already queued and close the connection."""
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+
+    def metrics(self):
+        """Return the counts, the batch sizes and the commit time and
+        latency in milliseconds of the postings so far."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            batches = self.batches
+            result = {'postings': self.postings, 'failed': self.failed,
+                      'batches': batches, 'largest_batch': self.largest,
+                      'queued': self.queue.qsize(),
+                      'window_ms': self.window * 1000}
+            result['avg_batch'] = self.postings / batches if batches else 0.0
+            result['commit_ms'] = (self.commit_seconds * 1000 / batches
+                                   if batches else 0.0)
+        for name, share in (('p50_ms', 0.5), ('p99_ms', 0.99)):
+            result[name] = (latencies[int((len(latencies) - 1) * share)]
+                            * 1000 if latencies else 0.0)
+        return result
+
+    def _run(self, opened):
+        try:
+            self.db = Database()
+            self.db.openDB(self.db_name)
+            if self.wal:
+                self.db.cur.execute(
+                    """PRAGMA journal_mode = WAL""").fetchone()
+        except Exception as error:
+            self.error = error
+            opened.set()
+            return
+        opened.set()
+        stop = False
+        try:
+            while not stop:
+                item = self.queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                deadline = time.time() + self.window
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self.queue.get(
+                            timeout=max(deadline - time.time(), 0))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._commit(batch)
+        finally:
+            self.db.closeDB()
+
+    def _commit(self, batch):
+        """Save the postings of batch in one transaction and hand every
+        caller its id or exception."""
+        start = time.time()
+        results = self._save([posting for posting, future, queued in batch])
+        done = time.time()
+        with self.lock:
+            self.batches += 1
+            self.postings += len(batch)
+            self.largest = max(self.largest, len(batch))
+            self.commit_seconds += done - start
+            for (posting, future, queued), result in zip(batch, results):
+                self.latencies.append(done - queued)
+                if isinstance(result, Exception):
+                    self.failed += 1
+        for (posting, future, queued), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _save(self, postings):
+        cur = self.db.cur
+        results = []
+        try:
+            cur.execute("""BEGIN IMMEDIATE""")
+            for kind, header, items in postings:
+                cur.execute("""SAVEPOINT posting""")
+                try:
+                    results.append(self.db.postDocument(
+                        kind, header, items, commit=False))
+                except (ValueError, TypeError, sqlite3.IntegrityError) as error:
+                    cur.execute("""ROLLBACK TO posting""")
+                    results.append(error)
+                cur.execute("""RELEASE posting""")
+            self.db.con.commit()
+        except Exception as error:
+            # Nothing of the batch was saved, every caller gets the error.
+            if self.db.con.in_transaction:
+                self.db.con.rollback()
+            return [error] * len(postings)
+        return results
+# End of WriteQueue class.
+
+# Start of InventoryServer class.
+class InventoryServer:
+    """Serve the database of a warehouse as JSON over HTTP so terminals
+    need not open the file, often on a network share, themselves.
+
+    Reads run on a pool of reader connections. Postings go through a
+    WriteQueue, the one writer connection, which commits them in groups.
+    Requests are checked with HTTP basic authentication against the
+    users of the database.
+
+    GET  /products?code=C&code=D or ?search=text  products
+    GET  /stock?code=C                            on hand and value
+    POST /documents/incoming|outgoing|adjustment  {header..., "items":
+         [[product id, quantity, price], ...]}, returns {"transid": id}
+    GET  /reports/NAME?format=json&date=&date_from=&date_to=
+    GET  /status
+    """
+
+    # Report formats and their content types.
+    CONTENT_TYPES = {'pdf': "application/pdf", 'csv': "text/csv",
+                     'html': "text/html", 'json': "application/x-ndjson"}
+
+    def __init__(self, db_name, host="127.0.0.1", port=8765, readers=4,
+                 window=0.0, max_batch=200, max_body=1024 * 1024, wal=False):
+        self.db_name = db_name
+        self.host = host
+        self.port = port
+        self.window = window
+        self.max_batch = max_batch
+        self.wal = wal
+        self.max_body = max_body
+        self.reader_count = readers
+        self.readers = concurrent.futures.ThreadPoolExecutor(readers)
+        self.local = threading.local()
+
+    def _readDB(self):
+        """Return the database connection of the current reader thread."""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = Database()
+            db.openDB(self.db_name)
+        return db
+
+    def _closeReader(self, barrier):
+        # Every reader thread waits here for the others, so each one takes
+        # one of the calls and closes its own connection.
+        barrier.wait()
+        db = getattr(self.local, 'db', None)
+        if db is not None:
+            db.closeDB()
+
+    async def serve(self, started=None):
+        """Serve until cancelled. started is called with the server once
+        it listens."""
+        loop = asyncio.get_running_loop()
+        self.writes = await loop.run_in_executor(
+            self.readers, WriteQueue, self.db_name, self.window,
+            self.max_batch, self.wal)
+        server = await asyncio.start_server(self._handle, self.host,
+                                            self.port)
+        if started is not None:
+            started(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await loop.run_in_executor(self.readers, self.writes.close)
+            barrier = threading.Barrier(self.reader_count)
+            await asyncio.gather(*[self._read(self._closeReader, barrier)
+                                   for count in range(self.reader_count)])
+            self.readers.shutdown()
+
+    async def post(self, kind, header, items):
+        """Queue a posting and return its id once it is committed."""
+        return await asyncio.wrap_future(
+            self.writes.submit(kind, header, items))
+
+    async def _read(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.readers, function, *args)
+
+    async def _handle(self, reader, writer):
+        """Answer the requests of one connection, keeping it open between
+        requests unless the client asks to close it."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    await self._respond(writer, 400,
+                                        {'error': "bad request"}, False)
+                    break
+                if length > self.max_body:
+                    await self._respond(writer, 413,
+                                        {'error': "request too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep = (version == "HTTP/1.1" and
+                        headers.get('connection', "").lower() != "close")
+                try:
+                    status, result = await self._dispatch(
+                        method, target, headers, body)
+                except ValueError as error:
+                    status, result = 400, {'error': str(error)}
+                except Exception as error:
+                    sys.stderr.write("%s %s: %r\n" % (method, target, error))
+                    status, result = 500, {'error': str(error)}
+                await self._respond(writer, status, result, keep)
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, result, keep):
+        """Send result, a dictionary sent as JSON or a (content type,
+        bytes) tuple."""
+        if isinstance(result, tuple):
+            content_type, payload = result
+        else:
+            content_type = "application/json"
+            payload = json.dumps(result).encode("utf-8")
+        reasons = {200: "OK", 400: "Bad Request", 401: "Unauthorized",
+                   404: "Not Found", 405: "Method Not Allowed",
+                   413: "Payload Too Large", 500: "Internal Server Error"}
+        head = ["HTTP/1.1 %d %s" % (status, reasons[status]),
+                "Content-Type: %s" % content_type,
+                "Content-Length: %d" % len(payload),
+                "Connection: %s" % ("keep-alive" if keep else "close")]
+        if status == 401:
+            head.append('WWW-Authenticate: Basic realm="JTS-Inventory"')
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1")
+                     + payload)
+        await writer.drain()
+
+    def _user(self, authorization):
+        """Return the type of the user of a basic authorization header,
+        None if it is missing or wrong."""
+        if not authorization.startswith("Basic "):
+            return None
+        try:
+            text = base64.b64decode(authorization[6:]).decode("utf-8")
+        except ValueError:
+            return None
+        username, _, password = text.partition(":")
+        return self._readDB().checkUser(username, password)
+
+    async def _dispatch(self, method, target, headers, body):
+        """Return the status and the result of a request."""
+        url = urllib.parse.urlsplit(target)
+        params = urllib.parse.parse_qs(url.query)
+        path = [part for part in url.path.split("/") if part]
+        user = await self._read(self._user, headers.get('authorization', ""))
+        if user is None:
+            return 401, {'error': "login required"}
+        if len(path) == 2 and path[0] == "documents":
+            if method != "POST":
+                return 405, {'error': "use POST"}
+            try:
+                document = json.loads(body.decode("utf-8"))
+            except ValueError:
+                raise ValueError("the body is not JSON")
+            if not isinstance(document, dict):
+                raise ValueError("the body is not a JSON object")
+            items = document.pop('items', None)
+            transid = await self.post(path[1], document, items)
+            return 200, {'transid': transid}
+        if method != "GET":
+            return 405, {'error': "use GET"}
+        if path == ["products"]:
+            return 200, {'products': await self._read(self._products, params)}
+        if path == ["stock"]:
+            return 200, {'stock': await self._read(self._stock, params)}
+        if len(path) == 2 and path[0] == "reports":
+            return 200, await self._read(self._report, path[1], params)
+        if path == ["status"]:
+            return 200, await self._read(self._status)
+        return 404, {'error': "not found: %s" % url.path}
+
+    def _products(self, params):
+        db = self._readDB()
+        keys = ("id", "code", "description", "unit", "price", "min", "max")
+        if 'search' in params:
+            query = db.cur.execute(
+                """SELECT id, code, description, unit, price, min, max
+                FROM products WHERE code LIKE ? OR description LIKE ?
+                ORDER BY code LIMIT 50""",
+                ("%%%s%%" % params['search'][0],) * 2)
+            rows = query.fetchall()
+        else:
+            rows = [row[0:7] for row in db.productStock(params.get('code', []))]
+        return [dict(zip(keys, row)) for row in rows]
+
+    def _stock(self, params):
+        keys = ("id", "code", "on_hand", "avg_cost", "value")
+        return [dict(zip(keys, (row[0], row[1], row[7], row[8],
+                                row[7] * row[8])))
+                for row in self._readDB().productStock(params.get('code', []))]
+
+    def _report(self, name, params):
+        if name not in REPORTS:
+            raise ValueError("unknown report: %s" % name)
+        fmt = params.get('format', ["json"])[0]
+        if fmt not in self.CONTENT_TYPES:
+            raise ValueError("unknown format: %s" % fmt)
+        fixed, options = REPORTS[name][2:4]
+        try:
+            values = [params[option][0] for option in options]
+        except KeyError as error:
+            raise ValueError("missing parameter: %s" % error.args[0])
+        for option, value in zip(options, values):
+            isoDate(value)
+        path = ReportOutput().allocate(name, fmt)
+        writeAtomic(path, writeReport, self._readDB(), name, fmt,
+                    *(fixed + tuple(values)))
+        try:
+            with open(path, 'rb') as report:
+                return self.CONTENT_TYPES[fmt], report.read()
+        finally:
+            os.remove(path)
+
+    def _status(self):
+        db = self._readDB()
+        return {'database': self.db_name, 'schema': db.schemaVersion(),
+                'changes': db.changeCounter(),
+                'writes': self.writes.metrics()}
+# End of InventoryServer class.
+
+def writeCSV(header, rows, path=None):
+    """Write a header and rows as CSV into path, or to stdout without one."""
+    if path is None:
+        csvwriter = csv.writer(sys.stdout)
+        csvwriter.writerow(header)
+        csvwriter.writerows(rows)
+        return
+    with open(path, 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(header)
+        csvwriter.writerows(rows)
+
+def archiveCommand(args, db, db_name):
+    folder = args.folder or loadConfig().get('archive_dir', 'archive')
+    start = time.time()
+    count = db.archiveYear(args.year, folder)
+    print("%d lines archived in %.2f s" % (count, time.time() - start))
+
+def backupCommand(args, db, db_name):
+    backup = backupSettings(loadConfig())
+    if args.folder is not None:
+        backup = Backup(folder=args.folder, keep=backup.keep,
+                        compress=backup.compress)
+    if args.keep is not None:
+        backup.keep = args.keep
+    backup.compress = backup.compress or args.compress
+    backup.verify = not args.no_verify
+    if args.measure:
+        path, before, during = measureBackup(db_name, backup)
+        print("before the backup: %s" % latencyText(before))
+        print("during the backup: %s" % latencyText(during))
+    else:
+        path = backup.run(db_name)
+    print("%s, %d bytes in %.2f s, %d restart/s"
+          % (path, os.path.getsize(path), backup.seconds, backup.restarts))
+
+def maintainCommand(args, db, db_name):
+    if args.full:
+        start = time.time()
+        reclaimed = db.compact()
+        print("vacuum %.2f s, %d bytes reclaimed"
+              % (time.time() - start, reclaimed))
+    for step, seconds, detail in db.maintain(budget=args.budget,
+                                             analyze_days=0):
+        print("%s %.2f s %s" % (step, seconds, detail))
+
+def reorderCommand(args, db, db_name):
+    writeCSV(("id", "code", "description", "unit",
+              "on_hand", "min", "max", "order_qty"),
+             db.reorderList(), args.output)
+
+def forecastCommand(args, db, db_name):
+    settings = forecastSettings(loadConfig())
+    for name in ("method", "lead_days", "review_days"):
+        if getattr(args, name) is not None:
+            settings[name] = getattr(args, name)
+    start = time.time()
+    data = demandForecast(db, **settings)
+    if args.apply:
+        count = applyForecast(db, data)
+        print("%d products updated in %.2f s" % (count, time.time() - start))
+    else:
+        writeCSV(("id", "code", "description", "unit", "min", "max",
+                  "forecast", "new_min", "new_max", "months"),
+                 data, args.output)
+
+def migrateCommand(args, db, db_name):
+    # Opening the database applied the migrations, the backfills they
+    # queued are finished here.
+    start = time.time()
+    count = db.backfillsLeft()
+    db.runBackfills()
+    print("schema version %d, %d rows backfilled in %.2f s"
+          % (db.schemaVersion(), count, time.time() - start))
+
+def serveCommand(args, db, db_name):
+    config = loadConfig()
+    window = args.window
+    if window is None:
+        window = config.get('write_window_ms', 0)
+    max_batch = args.max_batch or config.get('write_batch', 200)
+    server = InventoryServer(db_name, args.host, args.port, args.readers,
+                             window / 1000.0, max_batch,
+                             wal=args.wal or config.get('wal', False))
+
+    def started(listener):
+        address = listener.sockets[0].getsockname()
+        print("serving %s on http://%s:%d/"
+              % (db_name, address[0], address[1]))
+        sys.stdout.flush()
+
+    try:
+        asyncio.run(server.serve(started))
+    except KeyboardInterrupt:
+        pass
+
+def replicaCommand(args, db, db_name):
+    start = time.time()
+    createReplica(db_name, args.path)
+    print("replica %s of %s made in %.2f s"
+          % (args.path, db_name, time.time() - start))
+
+def syncCommand(args, db, db_name):
+    master = args.master or loadConfig().get('master_db')
+    if not master:
+        raise ValueError("no master database given")
+    start = time.time()
+    try:
+        result = db.sync(master)
+    except IOError as error:
+        raise ValueError(str(error))
+    print("%d sent, %d sent before, %d rejected, %d master data, "
+          "%d rows received in %.2f s"
+          % (result['pushed'], result['duplicates'], result['rejected'],
+             result['master_data'], result['pulled'], time.time() - start))
+    for table, code in result['conflicts']:
+        sys.stderr.write("conflict: %s %s kept as on the master\n"
+                         % (table, code))
+
+def groupStockCommand(args, db, db_name):
+    stores = warehouses(loadConfig())
+    start = time.time()
+    data, timings = groupStock(stores, parallel=not args.serial)
+    elapsed = time.time() - start
+    writeCSV(["code", "description", "unit"]
+             + [name for name, store in stores] + ["quantity", "amount"],
+             data, args.output)
+    for name, seconds in timings:
+        sys.stderr.write("%s %.2f s\n" % (name, seconds))
+    sys.stderr.write("%d items from %d warehouses in %.2f s, stores "
+                     "took %.2f s together\n"
+                     % (len(data), len(stores), elapsed,
+                        sum(seconds for name, seconds in timings)))
+
+def revalueCommand(args, db, db_name):
+    start = time.time()
+    count = db.recomputeValuation()
+    print("%d movements valued in %.2f s" % (count, time.time() - start))
+
+def benchmarkCommand(args, db, db_name):
+    if numpy is None:
+        print("NumPy is not installed")
+        return 1
+    python_time, numpy_time, reading, same = benchmarkAnalytics(
+        db, args.date_from, args.date_to)
+    print("python %.3f s, numpy %.3f s (%.1fx), reading the movements"
+          " %.3f s, results %s"
+          % (python_time, numpy_time, python_time / numpy_time,
+             reading, "agree" if same else "differ"))
+
+def reportCommand(args, db, db_name):
+    mode = args.snapshot or loadConfig().get('report_snapshot', 'transaction')
+    if mode == "transaction" and db.pragma("journal_mode") != "wal":
+        # A held read transaction would stop the writers.
+        sys.stderr.write("%s is not in WAL mode, the reports read a copy\n"
+                         % db_name)
+        mode = "copy"
+    source = db_name
+    if mode == "copy":
+        start = time.time()
+        source = ReportSnapshot(db_name).refresh()
+        sys.stderr.write("snapshot %s made in %.2f s\n"
+                         % (source, time.time() - start))
+    queue = ReportQueue(source, workers=args.workers,
+                        snapshot=mode == "transaction")
+    jobs = []
+    for name in args.reports:
+        fixed, options = REPORTS[name][2:4]
+        values = [getattr(args, option) for option in options]
+        jobs.append(queue.submit(name, args.format, writeReport, name,
+                                 args.format, *(fixed + tuple(values))))
+    for job in jobs:
+        print(job.result())
+    queue.shutdown()
+
+def runCommand(argv):
+    """Run a command line report without the graphical user interface.
+
+    Every subcommand has its own function, set as func of its parser, which
+    gets the arguments, the open database and its file name. A ValueError
+    from it is reported as a usage error.
+    """
+    parser = argparse.ArgumentParser(prog="jtsinventory.py",
+                                     description=__doc__)
+    parser.add_argument("--db", help="database file, default from config.json")
+    parser.add_argument("--warehouse",
+                        help="use the database of this warehouse of config.json")
+    commands = parser.add_subparsers(dest="command")
+    reorder = commands.add_parser("reorder",
+                                  help="list the products which need ordering")
+    reorder.add_argument("-o", "--output", help="csv file, default stdout")
+    reorder.set_defaults(func=reorderCommand)
+    revalue = commands.add_parser(
+        "revalue", help="value all stock movements again from the start")
+    revalue.set_defaults(func=revalueCommand)
+    migrate = commands.add_parser(
+        "migrate", help="bring the database to the current schema")
+    migrate.set_defaults(func=migrateCommand)
+    archive = commands.add_parser(
+        "archive", help="move the transactions of past years to archives")
+    archive.add_argument("year", type=int,
+                         help="last year to archive, earlier ones go too")
+    archive.add_argument("--folder",
+                         help="archive folder, default from config.json")
+    archive.set_defaults(func=archiveCommand)
+    backup = commands.add_parser(
+        "backup", help="copy the database while it is in use")
+    backup.add_argument("--folder", help="backup folder, default from config.json")
+    backup.add_argument("--keep", type=int, help="number of copies to keep")
+    backup.add_argument("--compress", action="store_true", help="gzip the copy")
+    backup.add_argument("--no-verify", action="store_true",
+                        help="skip the integrity check of the copy")
+    backup.add_argument("--measure", action="store_true",
+                        help="post test writes during the backup and "
+                        "report their latency")
+    backup.set_defaults(func=backupCommand)
+    maintain = commands.add_parser(
+        "maintain", help="analyze the database and return its free space")
+    maintain.add_argument("--budget", type=float, default=60,
+                          help="seconds after which no step is started")
+    maintain.add_argument("--full", action="store_true",
+                          help="rebuild the whole file with VACUUM first")
+    maintain.set_defaults(func=maintainCommand)
+    forecast = commands.add_parser(
+        "forecast", help="forecast the demand and suggest min and max levels")
+    forecast.add_argument("-o", "--output", help="csv file, default stdout")
+    forecast.add_argument("--apply", action="store_true",
+                          help="save the suggested levels to the products")
+    forecast.add_argument("--method", choices=["average", "smoothing"],
+                          help="moving average or exponential smoothing")
+    forecast.add_argument("--lead-days", type=int,
+                          help="days from ordering to receiving")
+    forecast.add_argument("--review-days", type=int,
+                          help="days between orders")
+    forecast.set_defaults(func=forecastCommand)
+    serve = commands.add_parser(
+        "serve", help="serve the database as JSON over HTTP")
+    serve.add_argument("--host", default="127.0.0.1",
+                       help="address to listen on, default 127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765,
+                       help="port to listen on, default 8765")
+    serve.add_argument("--readers", type=int, default=4,
+                       help="number of reader connections")
+    serve.add_argument("--window", type=float,
+                       help="milliseconds to wait for more postings before "
+                       "a commit, default from config.json or 0")
+    serve.add_argument("--max-batch", type=int,
+                       help="most postings per commit, default 200")
+    serve.add_argument("--wal", action="store_true",
+                       help="switch the database to WAL mode for good, only "
+                       "for a file on a local disk, default from config.json")
+    serve.set_defaults(func=serveCommand)
+    replica = commands.add_parser(
+        "replica", help="copy the database for an offline terminal")
+    replica.add_argument("path", help="file of the replica")
+    replica.set_defaults(func=replicaCommand)
+    sync = commands.add_parser(
+        "sync", help="exchange the changes of a replica with its master")
+    sync.add_argument("master", nargs="?",
+                      help="master database, default master_db of config.json")
+    sync.set_defaults(func=syncCommand)
+    group = commands.add_parser(
+        "group-stock", help="merge the current stock of all the warehouses")
+    group.add_argument("-o", "--output", help="csv file, default stdout")
+    group.add_argument("--serial", action="store_true",
+                       help="read the warehouses one after the other")
+    group.set_defaults(func=groupStockCommand)
+    benchmark = commands.add_parser(
+        "benchmark", help="time the stock analytics with and without NumPy")
+    benchmark.add_argument("--from", dest="date_from",
+                           default=time.strftime("01-01-%Y"),
+                           help="first date of the period")
+    benchmark.add_argument("--to", dest="date_to",
+                           default=time.strftime("%d-%m-%Y"),
+                           help="last date of the period")
+    benchmark.set_defaults(func=benchmarkCommand)
+    report = commands.add_parser("report",
+                                 help="write reports into the reports folder")
+    report.add_argument("reports", nargs="+", choices=sorted(REPORTS),
+                        help="reports to write, they are made in parallel")
+    report.add_argument("--date", default=time.strftime("%d-%m-%Y"),
+                        help="closing stock date (DD-MM-YYYY)")
+    report.add_argument("--from", dest="date_from",
+                        default=time.strftime("01-%m-%Y"),
+                        help="first date of registers and consumption")
+    report.add_argument("--to", dest="date_to",
+                        default=time.strftime("%d-%m-%Y"),
+                        help="last date of registers and consumption")
+    report.add_argument("--format", default="pdf",
+                        choices=["pdf"] + sorted(RENDERERS),
+                        help="output format, default pdf")
+    report.add_argument("--workers", type=int, default=2,
+                        help="number of reports made at the same time")
+    report.add_argument("--snapshot", choices=["live", "transaction", "copy"],
+                        help="read the live database, each report in one "
+                        "read transaction or all from a fresh copy, default "
+                        "from config.json or transaction")
+    report.set_defaults(func=reportCommand)
+    args = parser.parse_args(argv)
+
+    db_name = args.db
+    if args.warehouse is not None:
+        stores = dict(warehouses(loadConfig()))
+        if args.warehouse not in stores:
+            parser.error("unknown warehouse: %s" % args.warehouse)
+        db_name = stores[args.warehouse]
+    elif db_name is None:
+        with open('config.json', 'r') as cf:
+            db_name = json.load(cf)['default_db']
+    if not os.path.isfile(db_name):
+        parser.error("database not found: %s" % db_name)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    db = Database()
+    db.openDB(db_name)
+    try:
+        left = db.backfillsLeft()
+        if left and args.command != "migrate":
+            sys.stderr.write("%d rows are still to be backfilled, run the"
+                             " migrate command to finish\n" % left)
+        return args.func(args, db, db_name) or 0
+    except ValueError as error:
+        parser.error(str(error))
+    finally:
+        db.closeDB()
+
 def main():
+    if len(sys.argv) > 1:
+        return runCommand(sys.argv[1:])
     processid = str(os.getpid())
     process_dir = "pid"
     process_file = 'jtsinventory.pid'
@@ -3019,4 +7591,4 @@ def main():
         os.rmdir(process_dir)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import jtsinventory  # noqa: E402
+
+
+def openDatabase(path):
+    db = jtsinventory.Database()
+    db.openDB(str(path))
+    return db
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A new database in a temporary folder with three products and a
+    cost center. The images the PDF headers load are linked in."""
+    monkeypatch.chdir(tmp_path)
+    os.symlink(os.path.join(ROOT, "images"), str(tmp_path / "images"))
+    database = openDatabase(tmp_path / "test.db")
+    for number in range(1, 4):
+        database.insertRecord(table="products", itemcode="P%03d" % number,
+                              description="Product %d" % number, unit="pc",
+                              price=10, max_qty=100, min_qty=10)
+    database.insertRecord(table="costcenters", code="CC1", name="Workshop")
+    yield database
+    database.closeDB()
+
+
+def receive(db, date, items):
+    """Save a receipt of (product id, quantity, price) items the way the
+    incoming window does and return its id."""
+    db.insertRecord(table="incoming", date=date, dn_number="DN",
+                    supplier="Supplier", remarks="")
+    incoming_id = db.cur.lastrowid
+    db.insertRecord(table="in_transaction",
+                    itemlist=[(incoming_id,) + tuple(item) for item in items])
+    return incoming_id
+
+
+def issue(db, date, items, costcenter_id=1):
+    """Save an issue of (product id, quantity, price) items the way the
+    outgoing window does and return its id."""
+    db.insertRecord(table="outgoing", date=date,
+                    costcenter_id=costcenter_id, remarks="")
+    outgoing_id = db.cur.lastrowid
+    db.insertRecord(table="out_transaction",
+                    itemlist=[(outgoing_id,) + tuple(item) for item in items])
+    return outgoing_id
+
+
+def adjust(db, date, items):
+    """Save an adjustment of (product id, signed quantity, price) items the
+    way the adjustment window does and return its id."""
+    db.insertRecord(table="adjustment", date=date, remarks="")
+    adjustment_id = db.cur.lastrowid
+    db.insertRecord(table="adjust_trans",
+                    itemlist=[(adjustment_id, product_id, quantity, price,
+                               "plus" if quantity > 0 else "minus")
+                              for product_id, quantity, price in items])
+    return adjustment_id
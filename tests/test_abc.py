@@ -0,0 +1,45 @@
+import datetime
+
+import pytest
+
+import jtsinventory
+from conftest import issue, receive
+
+
+def test_usage_window_matches_the_issues(db):
+    receive(db, "01-01-2025", [(1, 100, 10), (2, 100, 5)])
+    for day in ("30-01-2025", "31-01-2025", "01-02-2025", "15-02-2025",
+                "28-02-2025", "01-03-2025", "02-03-2025"):
+        issue(db, day, [(1, 1, 10), (2, 2, 5)])
+    for start, end, count in (("2025-01-31", "2025-03-01", 5),
+                              ("2025-02-01", "2025-02-28", 3),
+                              ("2025-02-10", "2025-02-20", 1),
+                              ("2024-12-01", "2025-12-31", 7)):
+        rows = sorted(db.usage(start, end))
+        assert rows == [(1, count, count * 10), (2, 2 * count, count * 10)]
+
+
+def test_abc_stops_after_the_b_items(db):
+    receive(db, "01-01-2025", [(1, 100, 10), (2, 100, 5), (3, 100, 5)])
+    issue(db, "01-03-2025", [(1, 8, 10), (2, 3, 5), (3, 1, 5)])
+    report = jtsinventory.abcData(db, "31-03-2025")
+    rows = list(report.rows)
+    assert [(row[1], row[-1]) for row in rows] == [("P001", "A"),
+                                                   ("P002", "B")]
+    assert rows[0][5:8] == (80, 80, 80)
+    assert report.options['rest'] == 1
+    assert report.options['rest_value'] == 5
+
+
+def test_slow_and_non_moving_stock(db):
+    today = datetime.date.today()
+    earlier = (today - datetime.timedelta(days=10)).strftime("%d-%m-%Y")
+    later = (today - datetime.timedelta(days=5)).strftime("%d-%m-%Y")
+    receive(db, earlier, [(1, 100, 10), (2, 100, 10)])
+    issue(db, later, [(2, 1, 10)])
+    rows = list(jtsinventory.slowMoverData(db).rows)
+    assert [(row[0], row[-1]) for row in rows] == [("P001", "Non-moving"),
+                                                   ("P002", "Slow")]
+    assert rows[1][6] == pytest.approx(99 * 365)
+    assert rows[1][7] == later
+    assert rows[0][7] is None
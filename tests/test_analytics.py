@@ -0,0 +1,38 @@
+import pytest
+
+import jtsinventory
+from conftest import issue, receive
+
+
+def post(db):
+    receive(db, "01-01-2025", [(1, 100, 2.0)])
+    issue(db, "15-01-2025", [(1, 10, 2.0)])
+    issue(db, "15-02-2025", [(1, 20, 2.0)])
+    issue(db, "15-03-2025", [(1, 30, 2.0)])
+    issue(db, "10-04-2025", [(1, 5, 2.0)])
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_stock_analytics(db, vectorized):
+    if vectorized and jtsinventory.numpy is None:
+        pytest.skip("NumPy is not installed")
+    post(db)
+    rows = jtsinventory.stockAnalytics(db, "01-01-2025", "31-03-2025",
+                                       vectorized)
+    on_hand, issued, daily, turnover, cover, trend = rows[0][4:]
+    assert rows[0][1] == "P001"
+    assert (on_hand, issued) == (40, 60)
+    assert daily == pytest.approx(60 / 90.0)
+    assert turnover == pytest.approx(3.0)
+    assert cover == pytest.approx(60.0)
+    assert trend == pytest.approx(10.0)
+    assert rows[1][4:] == (0, 0, 0, None, None, 0)
+
+
+def test_benchmark_paths_agree(db):
+    if jtsinventory.numpy is None:
+        pytest.skip("NumPy is not installed")
+    post(db)
+    same = jtsinventory.benchmarkAnalytics(db, "01-01-2025", "31-03-2025",
+                                           repeat=1)[3]
+    assert same
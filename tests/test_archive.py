@@ -0,0 +1,49 @@
+from conftest import issue, openDatabase, receive
+
+
+def ledger(db):
+    """Closing stock on a few dates and the incoming register, each read
+    on a connection of its own."""
+    results = []
+    for date in ("31-12-2023", "30-06-2024", "31-12-2025"):
+        database = openDatabase(db.dbName())
+        results.append(database.closingStock(date))
+        database.closeDB()
+    database = openDatabase(db.dbName())
+    results.append(list(database.register("incoming", "01-01-2023",
+                                          "31-12-2025")))
+    database.closeDB()
+    return results
+
+
+def test_archived_years_read_as_before(db):
+    receive(db, "10-03-2023", [(1, 50, 2.0), (2, 20, 1.0)])
+    issue(db, "05-02-2024", [(1, 10, 2.0)])
+    receive(db, "20-08-2024", [(1, 30, 3.0)])
+    issue(db, "15-01-2025", [(2, 5, 1.0)])
+    receive(db, "01-04-2025", [(3, 12, 4.0)])
+    before = ledger(db)
+    # 2023 goes first, its opening balance of 2024 is archived with 2024.
+    assert db.archiveYear(2024, "archive") == 6
+    query = db.cur.execute("""SELECT COUNT(*) FROM in_transaction
+        WHERE incoming_id IN (SELECT id FROM incoming
+        WHERE substr(date, 7, 4) < '2025')""")
+    assert query.fetchone()[0] == 0
+    assert ledger(db) == before
+    # Postings after the archived years still count.
+    issue(db, "01-05-2025", [(3, 2, 4.0)])
+    closing = dict((row[0], row[4]) for row in ledger(db)[2])
+    assert closing == {1: 70, 2: 15, 3: 10}
+
+
+def test_backdated_posting_keeps_archived_year_end(db):
+    receive(db, "10-03-2023", [(1, 50, 2.0)])
+    receive(db, "20-02-2025", [(1, 10, 3.0)])
+    db.archiveYear(2024, "archive")
+    db.closePeriod("31-03-2025")
+    issue(db, "15-06-2024", [(1, 5, 2.0)])
+    periods = db.cur.execute(
+        "SELECT DISTINCT period FROM stock_snapshot ORDER BY period")
+    # The year ends stand for the archived lines, the later month end is
+    # open again.
+    assert [row[0] for row in periods] == ["2023-12-31", "2024-12-31"]
@@ -0,0 +1,72 @@
+import gzip
+import os
+import sqlite3
+
+import jtsinventory
+from conftest import openDatabase, receive
+
+
+def touch(folder, names):
+    for name in names:
+        with open(os.path.join(str(folder), name), 'w'):
+            pass
+
+
+def test_backup_copies_and_verifies(db, tmp_path):
+    receive(db, "01-01-2025", [(1, 50, 2.0)])
+    backup = jtsinventory.Backup(folder=str(tmp_path / "backups"))
+    assert not os.path.isdir(backup.folder)
+    assert backup.latest(str(tmp_path / "test.db")) == 0
+    path = backup.run(str(tmp_path / "test.db"))
+    assert os.path.basename(path).startswith("test-")
+    copy = sqlite3.connect(path)
+    try:
+        count = copy.execute("SELECT COUNT(*) FROM in_transaction")
+        assert count.fetchone()[0] == 1
+    finally:
+        copy.close()
+    assert backup.files("test") == [path]
+
+
+def test_backup_compressed(db, tmp_path):
+    backup = jtsinventory.Backup(folder=str(tmp_path / "backups"),
+                                 compress=True)
+    path = backup.run(str(tmp_path / "test.db"))
+    assert path.endswith(".db.gz")
+    with gzip.open(path, 'rb') as src:
+        assert src.read(16) == b"SQLite format 3\x00"
+    assert os.listdir(backup.folder) == [os.path.basename(path)]
+
+
+def test_rotation_keeps_other_warehouses(tmp_path):
+    # store and store-north share a prefix, rotating one must leave the
+    # backups of the other alone.
+    folder = tmp_path / "backups"
+    folder.mkdir()
+    store = ["store-2025010%d-120000.db" % day for day in range(1, 5)]
+    north = ["store-north-2025010%d-120000.db.gz" % day for day in range(1, 4)]
+    touch(folder, store + north + ["store-notes.txt", "store-old.db"])
+    backup = jtsinventory.Backup(folder=str(folder), keep=2)
+    assert backup.files("store") == [
+        "%s/%s" % (folder, name) for name in sorted(store, reverse=True)]
+    backup.rotate("store")
+    left = sorted(os.listdir(str(folder)))
+    assert left == sorted(store[2:] + north +
+                          ["store-notes.txt", "store-old.db"])
+    backup.rotate("store-north")
+    assert sorted(os.listdir(str(folder))) == sorted(
+        store[2:] + north[1:] + ["store-notes.txt", "store-old.db"])
+
+
+def test_backup_command(db, tmp_path, capsys):
+    assert jtsinventory.runCommand(
+        ["--db", str(tmp_path / "test.db"), "backup",
+         "--folder", str(tmp_path / "copies"), "--keep", "1"]) == 0
+    path = capsys.readouterr().out.split(",")[0]
+    assert os.path.isfile(path)
+    copy = openDatabase(path)
+    try:
+        count = copy.cur.execute("SELECT COUNT(*) FROM products")
+        assert count.fetchone()[0] == 3
+    finally:
+        copy.closeDB()
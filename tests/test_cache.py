@@ -0,0 +1,37 @@
+import os
+
+import jtsinventory
+from conftest import receive
+
+
+def test_change_counter_follows_the_data(db):
+    seq = db.changeCounter()
+    receive(db, "01-01-2025", [(1, 5, 2.0)])
+    assert db.changeCounter() > seq
+    seq = db.changeCounter()
+    db.closingStock("31-01-2025")
+    assert db.changeCounter() == seq
+
+
+def test_cache_key_changes_with_the_counter():
+    cache = jtsinventory.ReportCache()
+    first = cache.path("reorder", ("01-01-2025",), 1, "pdf")
+    assert cache.path("reorder", ("01-01-2025",), 1, "pdf") == first
+    assert cache.path("reorder", ("01-01-2025",), 2, "pdf") != first
+    assert not cache.fetch(first)
+
+
+def test_evict_keeps_recent_and_reprinted_files(db):
+    transid = receive(db, "01-01-2025", [(1, 5, 2.0)])
+    reprint = jtsinventory.reprintTransaction(db, "incoming", transid)
+    cache = jtsinventory.ReportCache(max_bytes=2500)
+    paths = []
+    for seq in range(3):
+        path = cache.path("reorder", (), seq, "pdf")
+        with open(path, 'wb') as report:
+            report.write(b"x" * 1000)
+        os.utime(path, (seq, seq))
+        paths.append(path)
+    cache.evict(keep=paths[0])
+    assert [os.path.isfile(path) for path in paths] == [True, False, True]
+    assert os.path.isfile(reprint)
@@ -0,0 +1,32 @@
+import jtsinventory
+
+
+def test_poll_delivers_changed_rows(db):
+    feed = jtsinventory.ChangeFeed(db)
+    delivered = []
+    feed.subscribe("products", lambda table, rows: delivered.append(rows))
+    db.insertRecord(table="products", itemcode="P004",
+                    description="Product 4", unit="pc", price=10,
+                    max_qty=100, min_qty=10)
+    db.cur.execute("""UPDATE products SET price=12 WHERE id IN (1, 4)""")
+    db.con.commit()
+    assert feed.poll() == 3
+    assert delivered == [{4: "I", 1: "U"}]
+    assert feed.poll() == 0
+
+
+def test_poll_reloads_after_pruning(db, monkeypatch):
+    feed = jtsinventory.ChangeFeed(db)
+    delivered = []
+    feed.subscribe("products", lambda table, rows: delivered.append(rows))
+    for price in (11, 12, 13):
+        db.cur.execute("""UPDATE products SET price=? WHERE id=2""", (price,))
+        db.con.commit()
+    monkeypatch.setattr(jtsinventory, "CHANGELOG_KEEP", 1)
+    db.maintain(budget=60, analyze_days=0)
+    assert feed.poll() == 1
+    assert delivered == [None]
+    db.cur.execute("""UPDATE products SET price=14 WHERE id=3""")
+    db.con.commit()
+    assert feed.poll() == 1
+    assert delivered == [None, {3: "U"}]
@@ -0,0 +1,30 @@
+import csv
+
+import jtsinventory
+from conftest import issue, receive
+
+
+def test_consumption_groups_by_cost_center_and_product(db):
+    db.insertRecord(table="costcenters", code="CC2", name="Garage")
+    receive(db, "01-01-2025", [(1, 50, 10), (2, 50, 4)])
+    issue(db, "05-01-2025", [(1, 5, 10), (2, 2, 4)])
+    issue(db, "06-01-2025", [(1, 3, 10)])
+    issue(db, "07-01-2025", [(1, 1, 10)], costcenter_id=2)
+    issue(db, "01-02-2025", [(1, 7, 10)])
+    rows = list(db.consumption("01-01-2025", "31-01-2025"))
+    assert [(row[0], row[2], row[5], row[6]) for row in rows] == [
+        ("CC1", "P001", 8, 80), ("CC1", "P002", 2, 8),
+        ("CC2", "P001", 1, 10)]
+
+
+def test_consumption_csv_has_subtotals_and_total(db, tmp_path):
+    receive(db, "01-01-2025", [(1, 50, 10)])
+    issue(db, "05-01-2025", [(1, 5, 10)])
+    path = tmp_path / "consumption.csv"
+    jtsinventory.writeReport(str(path), db, "consumption", "csv",
+                             "01-01-2025", "31-01-2025")
+    with open(path, newline='') as csvfile:
+        rows = list(csv.reader(csvfile))
+    assert rows[1][2] == "P001"
+    assert rows[2][1] == "Subtotal" and rows[2][6] == "50.00"
+    assert rows[3][1] == "Total" and rows[3][6] == "50.00"
@@ -0,0 +1,26 @@
+import pytest
+
+from conftest import issue, receive
+
+
+def test_dashboard_follows_the_postings(db):
+    db.insertRecord(table="costcenters", code="CC2", name="Garage")
+    receive(db, "01-03-2025", [(1, 50, 2.0), (2, 5, 4.0)])
+    issue(db, "02-03-2025", [(1, 10, 2.0)])
+    issue(db, "02-03-2025", [(1, 20, 2.0), (2, 1, 4.0)], costcenter_id=2)
+    issue(db, "02-02-2025", [(2, 1, 4.0)])
+    data = db.dashboard("2025-03-02")
+    assert data['stock_value'] == pytest.approx(20 * 2.0 + 3 * 4.0)
+    assert data['below_min'] == len(db.reorderList()) == 2
+    assert data['receipts'] == (0, 0.0)
+    assert data['issues'] == (3, 64.0)
+    assert data['top'] == [("CC2", "Garage", 44.0), ("CC1", "Workshop", 20.0)]
+    assert db.dashboard("2025-03-01")['receipts'] == (2, 120.0)
+
+
+def test_stock_value_survives_a_revaluation(db):
+    receive(db, "01-03-2025", [(1, 10, 2.0)])
+    receive(db, "02-03-2025", [(1, 10, 4.0)])
+    db.recomputeValuation()
+    db.con.commit()
+    assert db.dashboard("2025-03-02")['stock_value'] == pytest.approx(60.0)
@@ -0,0 +1,54 @@
+import datetime
+
+import pytest
+
+import jtsinventory
+from conftest import issue, receive
+
+
+def post(db):
+    month = datetime.date.today().replace(day=1)
+    receive(db, (month - datetime.timedelta(days=120)).strftime("%d-%m-%Y"),
+            [(1, 500, 2.0), (2, 500, 2.0)])
+    for quantity in (30, 30, 30):
+        month = (month - datetime.timedelta(days=1)).replace(day=1)
+        issue(db, month.replace(day=15).strftime("%d-%m-%Y"),
+              [(1, quantity, 2.0), (2, 1, 2.0)])
+    return month.isoformat()[0:7]
+
+
+def test_monthly_usage_is_ordered_by_product(db):
+    first = post(db)
+    assert list(db.monthlyUsage(first)) == [(1, 30), (2, 1)]
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_moving_average_forecast(db, vectorized):
+    if vectorized and jtsinventory.numpy is None:
+        pytest.skip("NumPy is not installed")
+    post(db)
+    rows = jtsinventory.demandForecast(db, vectorized, method="average",
+                                       lead_days=0, review_days=0)
+    assert [row[6] for row in rows] == [30, 1, 0]
+    assert [row[9] for row in rows] == [3, 3, 0]
+    assert rows[0][7] == 0
+
+
+def test_both_paths_agree(db):
+    if jtsinventory.numpy is None:
+        pytest.skip("NumPy is not installed")
+    post(db)
+    assert (jtsinventory.demandForecast(db, True) ==
+            jtsinventory.demandForecast(db, False))
+
+
+def test_apply_keeps_products_without_history(db, tmp_path, capsys):
+    post(db)
+    assert jtsinventory.runCommand(
+        ["--db", str(tmp_path / "test.db"), "forecast", "--apply"]) == 0
+    assert "2 products updated" in capsys.readouterr().out
+    db.con.rollback()
+    levels = db.cur.execute(
+        "SELECT min, max FROM products ORDER BY id").fetchall()
+    assert levels[0] != (10, 100) and levels[1] != (10, 100)
+    assert levels[2] == (10, 100)
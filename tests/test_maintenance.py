@@ -0,0 +1,36 @@
+import jtsinventory
+from conftest import receive
+
+
+def test_maintain_records_steps(db):
+    receive(db, "01-01-2025", [(1, 50, 2.0)])
+    done = db.maintain(budget=10, analyze_days=0)
+    steps = [step for step, seconds, detail in done]
+    assert steps[:2] == ["analyze", "optimize"]
+    recorded = db.cur.execute("SELECT step FROM maintenance").fetchall()
+    assert sorted(step for step, in recorded) == sorted(steps)
+    # The statistics are fresh, so ANALYZE is not due again.
+    steps = [step for step, seconds, detail in db.maintain(budget=10)]
+    assert "analyze" not in steps
+
+
+def test_maintain_returns_free_pages(db):
+    assert db.pragma("auto_vacuum") == 2
+    db.cur.execute("CREATE TABLE scratch(data TEXT)")
+    db.cur.executemany("INSERT INTO scratch VALUES(?)",
+                       [("x" * 1000,) for number in range(2000)])
+    db.cur.execute("DROP TABLE scratch")
+    db.con.commit()
+    assert db.pragma("freelist_count") > 0
+    done = dict((step, detail) for step, seconds, detail
+                in db.maintain(budget=10, analyze_days=0))
+    assert "bytes reclaimed" in done["vacuum"]
+    assert db.pragma("freelist_count") == 0
+
+
+def test_maintain_command_full(db, tmp_path, capsys):
+    assert jtsinventory.runCommand(
+        ["--db", str(tmp_path / "test.db"), "maintain", "--full"]) == 0
+    out = capsys.readouterr().out
+    assert "bytes reclaimed" in out.splitlines()[0]
+    assert "analyze" in out
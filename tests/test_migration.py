@@ -0,0 +1,170 @@
+import sqlite3
+
+import pytest
+
+import jtsinventory
+from conftest import issue, openDatabase
+
+
+def legacyDatabase(path):
+    """Write a database with the tables of the first release, user_version
+    0, and a few receipts, issues and adjustments on them."""
+    db = jtsinventory.Database()
+    db.con = sqlite3.connect(str(path))
+    db.cur = db.con.cursor()
+    db._createDB()
+    db.cur.executemany(
+        """INSERT INTO products(code, description, unit, price, max, min)
+        VALUES(?, ?, 'pc', 10, 100, 10)""",
+        [("P%03d" % number, "Product %d" % number) for number in (1, 2, 3)])
+    db.cur.execute("""INSERT INTO costcenters(code, description)
+        VALUES('CC1', 'Workshop')""")
+    for number, (date, lines) in enumerate(
+            [("05-01-2025", [(1, 50, 2.0), (2, 30, 4.0)]),
+             ("10-02-2025", [(1, 20, 3.0), (3, 40, 1.0)])], 1):
+        db.cur.execute("""INSERT INTO incoming(date, dn_number, supplier,
+            remarks) VALUES(?, 'DN', 'Supplier', '')""", (date,))
+        db.cur.executemany("""INSERT INTO in_transaction(incoming_id,
+            product_id, quantity, price) VALUES(?, ?, ?, ?)""",
+                           [(number,) + line for line in lines])
+    for number, (date, lines) in enumerate(
+            [("20-01-2025", [(1, 15, 2.0), (2, 5, 4.0)]),
+             ("15-02-2025", [(1, 25, 2.4), (3, 10, 1.0)])], 1):
+        db.cur.execute("""INSERT INTO outgoing(date, costcenter_id, remarks)
+            VALUES(?, 1, '')""", (date,))
+        db.cur.executemany("""INSERT INTO out_transaction(outgoing_id,
+            product_id, quantity, price) VALUES(?, ?, ?, ?)""",
+                           [(number,) + line for line in lines])
+    db.cur.execute("""INSERT INTO adjustment(date, remarks)
+        VALUES('01-03-2025', '')""")
+    db.cur.execute("""INSERT INTO adjust_trans(adjustment_id, product_id,
+        quantity, price, type) VALUES(1, 2, -3, 4.0, 'OUT')""")
+    db.con.commit()
+    db.con.close()
+
+
+def balances(db):
+    query = db.cur.execute(
+        """SELECT product_id, quantity FROM stock_balance ORDER BY 1""")
+    return query.fetchall()
+
+
+def test_old_database_is_migrated_and_backfilled(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    legacyDatabase(tmp_path / "old.db")
+    db = openDatabase(tmp_path / "old.db")
+    try:
+        assert db.schemaVersion() == jtsinventory.MIGRATIONS[-1][0]
+        assert db.backfillsLeft() == 0
+        assert balances(db) == [(1, 30), (2, 22), (3, 30)]
+        query = db.cur.execute(
+            """SELECT month, product_id, quantity FROM monthly_usage
+            ORDER BY 1, 2""")
+        assert query.fetchall() == [("2025-01", 1, 15), ("2025-01", 2, 5),
+                                    ("2025-02", 1, 25), ("2025-02", 3, 10)]
+        query = db.cur.execute(
+            """SELECT day, kind, lines, amount FROM daily_totals
+            ORDER BY 1, 2""")
+        assert query.fetchall() == [("2025-01-05", "in", 2, 220.0),
+                                    ("2025-01-20", "out", 2, 50.0),
+                                    ("2025-02-10", "in", 2, 100.0),
+                                    ("2025-02-15", "out", 2, 70.0)]
+        # The triggers keep the backfilled tables up to date.
+        issue(db, "01-04-2025", [(3, 5, 1.0)])
+        assert balances(db) == [(1, 30), (2, 22), (3, 25)]
+    finally:
+        db.closeDB()
+
+
+def test_interrupted_backfill_resumes_without_counting_twice(tmp_path,
+                                                              monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    legacyDatabase(tmp_path / "old.db")
+    backfill = jtsinventory.Database._backfillBalance
+    calls = []
+
+    def interrupted(self, source, first, last):
+        calls.append((source, first, last))
+        if len(calls) == 3:
+            raise KeyboardInterrupt()
+        backfill(self, source, first, last)
+
+    monkeypatch.setattr(jtsinventory.Database, "_backfillBalance",
+                        interrupted)
+    run = jtsinventory.Database.runBackfills
+    monkeypatch.setattr(jtsinventory.Database, "runBackfills",
+                        lambda self, **kwargs: run(self, batch=1))
+    db = jtsinventory.Database()
+    with pytest.raises(KeyboardInterrupt):
+        db.openDB(str(tmp_path / "old.db"))
+    # The uncommitted batch is lost as in a crash.
+    db.con.close()
+    con = sqlite3.connect(str(tmp_path / "old.db"))
+    query = con.execute("""SELECT source, done FROM backfill
+        WHERE name='_backfillBalance' ORDER BY rowid""")
+    assert query.fetchall() == [("in_transaction", 2),
+                                ("out_transaction", 0), ("adjust_trans", 0)]
+    con.close()
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+    db = openDatabase(tmp_path / "old.db")
+    try:
+        assert db.backfillsLeft() == 0
+        assert balances(db) == [(1, 30), (2, 22), (3, 30)]
+    finally:
+        db.closeDB()
+
+
+def test_failed_migration_keeps_the_last_version(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    legacyDatabase(tmp_path / "old.db")
+    last, name = jtsinventory.MIGRATIONS[-1]
+
+    def failing(self):
+        self.cur.execute("""CREATE TABLE half_done(id INTEGER)""")
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(jtsinventory.Database, name, failing)
+    db = jtsinventory.Database()
+    with pytest.raises(sqlite3.OperationalError):
+        db.openDB(str(tmp_path / "old.db"))
+    db.con.close()
+    con = sqlite3.connect(str(tmp_path / "old.db"))
+    assert con.execute("""PRAGMA user_version""").fetchone()[0] == last - 1
+    con.close()
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+    db = openDatabase(tmp_path / "old.db")
+    try:
+        query = db.cur.execute(
+            """SELECT name FROM sqlite_master WHERE name='half_done'""")
+        assert query.fetchone() is None
+        assert db.schemaVersion() == last
+    finally:
+        db.closeDB()
+
+
+def test_opening_leaves_the_rest_to_migrate(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    legacyDatabase(tmp_path / "old.db")
+    monkeypatch.setattr(jtsinventory, "BACKFILL_BUDGET", 0)
+    run = jtsinventory.Database.runBackfills
+    monkeypatch.setattr(jtsinventory.Database, "runBackfills",
+                        lambda self, batch=1, budget=None:
+                        run(self, 1, budget))
+    db = openDatabase(tmp_path / "old.db")
+    left = db.backfillsLeft()
+    db.closeDB()
+    # Of the 21 rows only one batch of one row is done on every open.
+    assert left == 20
+    path = str(tmp_path / "old.db")
+    assert jtsinventory.runCommand(["--db", path, "reorder"]) == 0
+    assert "19 rows are still to be backfilled" in capsys.readouterr().err
+    assert jtsinventory.runCommand(["--db", path, "migrate"]) == 0
+    assert "18 rows backfilled" in capsys.readouterr().out
+    db = openDatabase(tmp_path / "old.db")
+    try:
+        assert db.backfillsLeft() == 0
+        assert balances(db) == [(1, 30), (2, 22), (3, 30)]
+    finally:
+        db.closeDB()
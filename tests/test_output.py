@@ -0,0 +1,62 @@
+import os
+import time
+
+import pytest
+
+import jtsinventory
+from conftest import receive
+
+
+def test_allocate_gives_unique_paths(tmp_path):
+    output = jtsinventory.ReportOutput(str(tmp_path / "reports"))
+    paths = set(output.allocate("reorder", "pdf") for _ in range(5))
+    assert len(paths) == 5
+    assert all(path.startswith(str(tmp_path / "reports" / "reorder-"))
+               for path in paths)
+
+
+def test_cleanup_removes_old_files(tmp_path):
+    output = jtsinventory.ReportOutput(str(tmp_path), keep_days=1)
+    old = tmp_path / "old.pdf"
+    new = tmp_path / "new.pdf"
+    old.write_bytes(b"x")
+    new.write_bytes(b"x")
+    stamp = time.time() - 2 * 86400
+    os.utime(str(old), (stamp, stamp))
+    assert output.cleanup() == 1
+    assert not old.exists() and new.exists()
+
+
+def test_write_atomic_leaves_nothing_on_failure(tmp_path):
+    def render(path):
+        with open(path, 'w') as report:
+            report.write("part")
+        raise RuntimeError("render failed")
+    with pytest.raises(RuntimeError):
+        jtsinventory.writeAtomic(str(tmp_path / "report.csv"), render)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_report_queue_runs_reports_in_parallel(db, tmp_path):
+    receive(db, "01-01-2025", [(1, 5, 2.0)])
+    output = jtsinventory.ReportOutput(str(tmp_path / "out"))
+    queue = jtsinventory.ReportQueue(str(tmp_path / "test.db"), output,
+                                     workers=3)
+    jobs = [queue.submit(name, "csv", jtsinventory.writeReport,
+                         "consumption", "csv", "01-01-2025", "31-01-2025")
+            for name in ("one", "two", "three")]
+    paths = [job.result() for job in jobs]
+    queue.shutdown()
+    assert len(set(paths)) == 3
+    assert all(os.path.isfile(path) for path in paths)
+
+
+def test_report_command(db, tmp_path, capsys):
+    receive(db, "01-01-2025", [(1, 5, 2.0)])
+    assert jtsinventory.runCommand(
+        ["--db", str(tmp_path / "test.db"), "report", "reorder",
+         "consumption", "--from", "01-01-2025",
+         "--to", "31-01-2025"]) == 0
+    paths = capsys.readouterr().out.split()
+    assert len(paths) == 2
+    assert all(os.path.isfile(path) for path in paths)
@@ -0,0 +1,58 @@
+import jtsinventory
+from conftest import receive
+
+
+class RecordingPDF(jtsinventory.PDF):
+    """A PDF keeping the text of every cell written."""
+
+    def __init__(self, **kwargs):
+        jtsinventory.PDF.__init__(self, **kwargs)
+        self.texts = []
+
+    def cell(self, w, h=0, txt='', *args, **kwargs):
+        self.texts.append(txt)
+        return jtsinventory.PDF.cell(self, w, h, txt, *args, **kwargs)
+
+
+def test_header_text_is_formatted_once(tmp_path):
+    pdf = jtsinventory.PDF(mode="incoming", transid="7", date="01-01-2025",
+                           dn_number="DN", supplier="Supplier")
+    assert pdf.number_text == "Trans. No.: IN-7"
+    assert pdf.field_lines[1] == "Supplier Ref: DN"
+
+
+def test_table_groups_and_totals(tmp_path):
+    pdf = RecordingPDF(mode="consumption", date_from="01-01-2025",
+                       date_to="31-01-2025")
+    keys = ["costcenter", "name", "code", "description", "unit",
+            "quantity", "amount"]
+    pdf.writeTable([("CC1", "Workshop", "P001", "Product 1", "pc", 2.0, 20.0),
+                    ("CC1", "Workshop", "P002", "Product 2", "pc", 1.0, 5.0),
+                    ("CC2", "Garage", "P001", "Product 1", "pc", 1.0, 10.0)],
+                   keys)
+    assert "CC1 - Workshop" in pdf.texts
+    assert "Subtotal: 25.00" in pdf.texts
+    assert "Subtotal: 10.00" in pdf.texts
+    assert pdf.texts[-1] == "Total Amount: 35.00"
+    pdf.output(str(tmp_path / "consumption.pdf"), 'F')
+
+
+def test_reorder_pdf_numbers_its_rows(db, tmp_path):
+    receive(db, "01-01-2025", [(1, 50, 10)])
+    report = jtsinventory.reorderData(db)
+    pdf = RecordingPDF(mode="reorder", **report.options)
+    pdf.writeTable(report.rows, [column.key for column in report.columns])
+    body = pdf.texts[pdf.texts.index("Order") + 1:]
+    assert body[0:2] == ["1", "P002"]
+    assert body[8:10] == ["2", "P003"]
+    assert pdf.texts[-1] == "Items to Order: 2"
+
+
+def test_long_tables_break_pages(tmp_path):
+    pdf = jtsinventory.PDF(mode="currentstock", date="01-01-2025")
+    pdf.writeTable((i, "C%d" % i, "Product", "pc", 1.0, 2.0, 2.0)
+                   for i in range(200))
+    assert pdf.page_no() > 1
+    path = tmp_path / "stock.pdf"
+    pdf.output(str(path), 'F')
+    assert path.read_bytes().startswith(b"%PDF")
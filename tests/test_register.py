@@ -0,0 +1,22 @@
+from conftest import issue, receive
+
+
+def test_register_pages_and_totals(db):
+    for day in (3, 1, 2, 2, 5):
+        receive(db, "%02d-01-2025" % day, [(1, day, 2.0), (2, 1, 1.5)])
+    receive(db, "01-02-2025", [(1, 1, 1.0)])
+    rows = list(db.register("incoming", "01-01-2025", "31-01-2025",
+                            page_size=2))
+    assert [row[0:2] for row in rows] == [
+        ("IN-2", "01-01-2025"), ("IN-3", "02-01-2025"),
+        ("IN-4", "02-01-2025"), ("IN-1", "03-01-2025"),
+        ("IN-5", "05-01-2025")]
+    assert [row[4:] for row in rows] == [
+        (2, 3.5), (2, 5.5), (2, 5.5), (2, 7.5), (2, 11.5)]
+
+
+def test_outgoing_register_names_the_cost_center(db):
+    receive(db, "01-01-2025", [(1, 10, 2.0)])
+    issue(db, "02-01-2025", [(1, 4, 2.0)])
+    assert list(db.register("outgoing", "01-01-2025", "31-01-2025")) == [
+        ("OUT-1", "02-01-2025", "CC1", "Workshop", 1, 8.0)]
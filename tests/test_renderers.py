@@ -0,0 +1,65 @@
+import csv
+import json
+
+import jtsinventory
+from conftest import issue, receive
+
+
+def sample():
+    columns = [jtsinventory.Column("group", "Group"),
+               jtsinventory.Column("name", "Name"),
+               jtsinventory.Column("amount", "Amount", True)]
+    rows = iter([("A", "one", 1.0), ("A", "<two>", 2.5), ("B", "three", 4.0)])
+    return jtsinventory.ReportData("Sample", columns, rows, "info", group=0)
+
+
+def test_csv_renderer_adds_subtotals(tmp_path):
+    path = str(tmp_path / "sample.csv")
+    jtsinventory.CSVRenderer(path).render(sample())
+    with open(path, newline='') as csvfile:
+        rows = list(csv.reader(csvfile))
+    assert rows == [["group", "name", "amount"],
+                    ["A", "one", "1.00"], ["A", "<two>", "2.50"],
+                    ["A", "Subtotal", "3.50"],
+                    ["B", "three", "4.00"], ["B", "Subtotal", "4.00"],
+                    ["", "Total", "7.50"]]
+
+
+def test_html_renderer_escapes_values(tmp_path):
+    path = tmp_path / "sample.html"
+    jtsinventory.HTMLRenderer(str(path)).render(sample())
+    text = path.read_text()
+    assert "<td>&lt;two&gt;</td>" in text
+    assert "<th>Total</th><th>7.50</th>" in text
+
+
+def test_json_renderer_writes_one_object_per_row(tmp_path):
+    path = tmp_path / "sample.json"
+    jtsinventory.JSONRenderer(str(path)).render(sample())
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines[0] == {'group': "A", 'name': "one", 'amount': 1.0}
+    assert lines[-1] == {'total': {'amount': 7.5}}
+
+
+def test_reorder_report_numbers_its_rows(db, tmp_path):
+    receive(db, "01-01-2025", [(1, 50, 10)])
+    path = str(tmp_path / "reorder.csv")
+    jtsinventory.writeReport(path, db, "reorder", "csv")
+    with open(path, newline='') as csvfile:
+        rows = list(csv.reader(csvfile))
+    assert [row[0:2] for row in rows[1:3]] == [["1", "P002"], ["2", "P003"]]
+
+
+def test_every_report_writes_every_format(db, tmp_path):
+    # The group stock report reads the warehouses of config.json.
+    (tmp_path / "config.json").write_text(json.dumps({'default_db': "test.db"}))
+    receive(db, "01-01-2025", [(1, 50, 10)])
+    issue(db, "02-01-2025", [(1, 5, 10)])
+    arguments = {'date': "31-01-2025", 'date_from': "01-01-2025",
+                 'date_to': "31-01-2025"}
+    for name, (source, writer, fixed, options) in jtsinventory.REPORTS.items():
+        values = fixed + tuple(arguments[option] for option in options)
+        for fmt in ["pdf"] + sorted(jtsinventory.RENDERERS):
+            path = tmp_path / ("%s.%s" % (name, fmt))
+            jtsinventory.writeReport(str(path), db, name, fmt, *values)
+            assert path.stat().st_size > 0
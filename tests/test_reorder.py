@@ -0,0 +1,32 @@
+import csv
+
+import jtsinventory
+from conftest import issue, receive
+
+
+def test_reorder_list_holds_products_at_or_below_min(db):
+    receive(db, "01-01-2025", [(1, 50, 10), (2, 8, 10), (3, 10, 10)])
+    issue(db, "02-01-2025", [(1, 45, 10)])
+    rows = db.reorderList()
+    assert [row[1] for row in rows] == ["P001", "P002", "P003"]
+    assert [row[4] for row in rows] == [5, 8, 10]
+    assert [row[7] for row in rows] == [95, 92, 90]
+
+
+def test_reorder_list_follows_the_product_limits(db):
+    receive(db, "01-01-2025", [(1, 50, 10), (2, 50, 10), (3, 50, 10)])
+    assert db.reorderList() == []
+    db.cur.execute("UPDATE products SET min=60 WHERE id=2")
+    db.con.commit()
+    assert [row[1] for row in db.reorderList()] == ["P002"]
+
+
+def test_reorder_command_writes_csv(db, tmp_path):
+    receive(db, "01-01-2025", [(1, 50, 10)])
+    out = tmp_path / "reorder.csv"
+    assert jtsinventory.runCommand(
+        ["--db", str(tmp_path / "test.db"), "reorder", "-o", str(out)]) == 0
+    with open(out, newline='') as csvfile:
+        rows = list(csv.reader(csvfile))
+    assert rows[0][:2] == ["id", "code"]
+    assert [row[1] for row in rows[1:]] == ["P002", "P003"]
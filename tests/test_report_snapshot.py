@@ -0,0 +1,69 @@
+import os
+
+import jtsinventory
+from conftest import openDatabase, receive
+
+
+def onHand(db, product_id):
+    query = db.cur.execute(
+        "SELECT quantity FROM stock_balance WHERE product_id=?", (product_id,))
+    return query.fetchone()[0]
+
+
+def test_transaction_snapshot_in_wal_mode(db, tmp_path):
+    receive(db, "01-01-2025", [(1, 50, 2.0)])
+    db.cur.execute("PRAGMA journal_mode = WAL").fetchone()
+    reader = openDatabase(tmp_path / "test.db")
+    try:
+        assert reader.beginSnapshot()
+        assert onHand(reader, 1) == 50
+        # A posting made meanwhile is not seen until the snapshot ends.
+        receive(db, "02-01-2025", [(1, 5, 2.0)])
+        assert onHand(reader, 1) == 50
+        reader.endSnapshot()
+        assert onHand(reader, 1) == 55
+    finally:
+        reader.closeDB()
+
+
+def test_without_wal_the_reports_read_a_copy(db, tmp_path):
+    receive(db, "01-01-2025", [(1, 50, 2.0)])
+    assert not db.beginSnapshot()
+    mode, snapshot = jtsinventory.snapshotSettings({'default_db': "test.db"})
+    assert mode == "copy"
+    path = snapshot.path()
+    receive(db, "02-01-2025", [(1, 5, 2.0)])
+    copy = openDatabase(path)
+    try:
+        assert onHand(copy, 1) == 50
+    finally:
+        copy.closeDB()
+    config = {'default_db': "test.db", 'report_snapshot': "live"}
+    assert jtsinventory.snapshotSettings(config) == ("live", None)
+
+
+def test_path_is_the_copy_refresh_made(db, tmp_path):
+    folder = str(tmp_path / "snapshots")
+    snapshot = jtsinventory.ReportSnapshot(str(tmp_path / "test.db"),
+                                           folder=folder)
+    first = snapshot.refresh()
+    assert snapshot.path() == first
+    # A later copy in the folder, such as one of another database with
+    # the same beginning of its name, is not taken for it.
+    open(os.path.join(folder, "test-north-29991231-235959.db"), 'w').close()
+    open(os.path.join(folder, "test-29991231-235959.db.tmp"), 'w').close()
+    assert snapshot.path() == first
+    other = jtsinventory.ReportSnapshot(str(tmp_path / "test.db"),
+                                        folder=folder)
+    assert other.path() == first
+
+
+def test_report_command_tells_about_the_copy(db, tmp_path, capsys):
+    receive(db, "01-01-2025", [(1, 50, 2.0)])
+    assert jtsinventory.runCommand(
+        ["--db", str(tmp_path / "test.db"), "report", "reorder",
+         "--format", "csv"]) == 0
+    out, err = capsys.readouterr()
+    assert "not in WAL mode, the reports read a copy" in err
+    assert "snapshot " in err
+    assert os.path.isfile(out.strip())
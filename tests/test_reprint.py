@@ -0,0 +1,37 @@
+import os
+
+import jtsinventory
+from conftest import issue, receive
+
+
+def test_load_transaction(db):
+    transid = receive(db, "01-01-2025", [(1, 5, 2.0), (2, 1, 1.5)])
+    options, item_list, remarks = db.loadTransaction("incoming", transid)
+    assert options['mode'] == "incoming"
+    assert options['date'] == "01-01-2025"
+    assert options['supplier'] == "Supplier"
+    assert item_list == [("1", "P001", "Product 1", "pc", 5, 2.0, 10.0),
+                         ("2", "P002", "Product 2", "pc", 1, 1.5, 1.5)]
+    assert db.loadTransaction("incoming", transid + 1) is None
+
+
+def test_load_outgoing_names_the_cost_center(db):
+    receive(db, "01-01-2025", [(1, 5, 2.0)])
+    transid = issue(db, "02-01-2025", [(1, 2, 2.0)])
+    options = db.loadTransaction("outgoing", transid)[0]
+    assert options['costctrcode'] == "CC1"
+    assert options['costctrname'] == "Workshop"
+
+
+def test_reprint_reuses_the_rendered_file(db):
+    transid = receive(db, "01-01-2025", [(1, 5, 2.0)])
+    path = jtsinventory.reprintTransaction(db, "incoming", transid)
+    assert os.path.isfile(path)
+    mtime = os.path.getmtime(path)
+    os.utime(path, (mtime - 100, mtime - 100))
+    assert jtsinventory.reprintTransaction(db, "incoming", transid) == path
+    assert os.path.getmtime(path) == mtime - 100
+    db.cur.execute("UPDATE in_transaction SET quantity=6")
+    db.con.commit()
+    assert jtsinventory.reprintTransaction(db, "incoming", transid) != path
+    assert jtsinventory.reprintTransaction(db, "incoming", 99) is None
@@ -0,0 +1,96 @@
+import asyncio
+import base64
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import jtsinventory
+from conftest import receive
+
+
+@pytest.fixture
+def server(db, tmp_path):
+    """A server of the db database on a free port, run by a thread of its
+    own. Yields the base URL."""
+    db.insertRecord(table="users", user="clerk", password="secret",
+                    usertype="user")
+    receive(db, "01-01-2025", [(1, 50, 2.0)])
+    server = jtsinventory.InventoryServer(str(tmp_path / "test.db"), port=0,
+                                          readers=2)
+    loop = asyncio.new_event_loop()
+    listening = threading.Event()
+    address = []
+
+    def started(listener):
+        address.append(listener.sockets[0].getsockname()[1])
+        listening.set()
+
+    task = loop.create_task(server.serve(started))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert listening.wait(10)
+    yield "http://127.0.0.1:%d" % address[0]
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(10)
+    loop.close()
+
+
+def request(url, body=None, password="secret"):
+    """Return the status and the JSON answer of a request as clerk."""
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(url, data=data)
+    if password is not None:
+        token = base64.b64encode(("clerk:%s" % password).encode("utf-8"))
+        req.add_header("Authorization", "Basic " + token.decode("ascii"))
+    try:
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return response.status, json.loads(response.read().decode("utf-8"))
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read().decode("utf-8"))
+
+
+def test_login_required(server):
+    assert request(server + "/stock", password=None)[0] == 401
+    assert request(server + "/stock", password="wrong")[0] == 401
+
+
+def test_stock_and_posting(server, db):
+    status, answer = request(server + "/stock?code=P001")
+    assert status == 200
+    assert answer['stock'][0]['code'] == "P001"
+    assert answer['stock'][0]['on_hand'] == 50
+    status, answer = request(server + "/documents/outgoing",
+                             {'date': "02-01-2025", 'costcenter_id': 1,
+                              'remarks': "", 'items': [[1, 5, 2.0]]})
+    assert status == 200 and answer['transid'] == 1
+    status, answer = request(server + "/stock?code=P001")
+    assert answer['stock'][0]['on_hand'] == 45
+
+
+def test_bad_posting_fails_alone(server):
+    status, answer = request(server + "/documents/outgoing",
+                             {'date': "02-01-2025", 'costcenter_id': 9,
+                              'items': [[1, 5, 2.0]]})
+    assert status == 400
+    assert "cost center" in answer['error']
+
+
+def test_posting_reopens_closed_period(db):
+    receive(db, "01-01-2025", [(1, 50, 2.0)])
+    db.closePeriod("31-01-2025")
+    db.postDocument("outgoing", {'date': "15-01-2025", 'costcenter_id': 1,
+                                 'remarks': ""}, [(1, 5, 2.0)])
+    query = db.cur.execute("SELECT COUNT(*) FROM stock_snapshot")
+    assert query.fetchone()[0] == 0
+    closing = dict((row[0], row[4]) for row in db.closingStock("31-01-2025"))
+    assert closing[1] == 45
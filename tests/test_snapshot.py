@@ -0,0 +1,36 @@
+from conftest import issue, receive
+
+
+def closing(db, date):
+    return dict((row[0], row[4]) for row in db.closingStock(date))
+
+
+def test_snapshot_matches_ledger(db):
+    receive(db, "01-01-2025", [(1, 50, 2.0), (3, 200, 5.0)])
+    issue(db, "15-03-2025", [(3, 8, 5.0)])
+    before = closing(db, "31-07-2025")
+    assert db.closePeriod("30-06-2025") == 2
+    assert closing(db, "31-07-2025") == before
+    assert before[3] == 192
+
+
+def test_backdated_posting_reopens_closed_period(db):
+    receive(db, "01-01-2025", [(3, 200, 5.0)])
+    issue(db, "15-03-2025", [(3, 8, 5.0)])
+    db.closePeriod("31-01-2025")
+    db.closePeriod("30-06-2025")
+    receive(db, "01-02-2025", [(3, 1000, 5.0)])
+    assert closing(db, "31-07-2025")[3] == 1192
+    query = db.cur.execute("""SELECT DISTINCT period FROM stock_snapshot""")
+    assert [row[0] for row in query] == ["2025-01-31"]
+
+
+def test_backdated_adjustment_reopens_closed_period(db):
+    receive(db, "01-01-2025", [(3, 200, 5.0)])
+    db.closePeriod("30-06-2025")
+    db.insertRecord(table="adjustment", date="01-02-2025", remarks="count")
+    adjustment_id = db.cur.execute(
+        """SELECT MAX(id) FROM adjustment""").fetchone()[0]
+    db.insertRecord(table="adjust_trans",
+                    itemlist=[(adjustment_id, 3, -20, 5.0, "minus")])
+    assert closing(db, "31-07-2025")[3] == 180
@@ -0,0 +1,132 @@
+import pytest
+
+import jtsinventory
+from conftest import issue, openDatabase, receive
+
+
+@pytest.fixture
+def replica(db, tmp_path):
+    """The replica of the db fixture, saved as replica.db."""
+    db.con.commit()
+    jtsinventory.createReplica(db.dbName(), str(tmp_path / "replica.db"))
+    database = openDatabase(tmp_path / "replica.db")
+    yield database
+    database.closeDB()
+
+
+def table(db, sql):
+    return db.cur.execute(sql).fetchall()
+
+
+def test_sync_sends_postings_and_takes_master_ids(db, replica):
+    receive(db, "01-01-2025", [(1, 50, 2.0)])
+    replica.insertRecord(table="products", itemcode="P004",
+                         description="Product 4", unit="pc", price=10,
+                         max_qty=100, min_qty=10)
+    local = table(replica, """SELECT id FROM products WHERE code='P004'""")
+    assert local[0][0] >= jtsinventory.REPLICA_BASE
+    receive(replica, "02-01-2025", [(local[0][0], 5, 3.0), (2, 8, 1.0)])
+    issue(replica, "03-01-2025", [(2, 3, 1.0)])
+    assert replica.pendingPostings() == 2
+    result = replica.sync(db.dbName())
+    # The new product is sent and comes back with the master id.
+    assert (result['pushed'], result['duplicates'], result['rejected'],
+            result['master_data']) == (2, 0, 0, 2)
+    assert replica.pendingPostings() == 0
+    for sql in ("""SELECT * FROM products ORDER BY id""",
+                """SELECT * FROM incoming ORDER BY id""",
+                """SELECT * FROM in_transaction ORDER BY id""",
+                """SELECT * FROM out_transaction ORDER BY id""",
+                """SELECT * FROM stock_balance ORDER BY product_id""",
+                """SELECT * FROM stock_value ORDER BY product_id"""):
+        assert table(replica, sql) == table(db, sql)
+    assert table(db, """SELECT product_id, quantity FROM stock_balance
+        WHERE quantity <> 0 ORDER BY 1""") == [(1, 50), (2, 5), (4, 5)]
+
+
+def test_sync_broken_off_after_the_push_saves_nothing_twice(db, replica,
+                                                            monkeypatch):
+    receive(replica, "02-01-2025", [(1, 5, 3.0)])
+    pull = jtsinventory.Database._pull
+
+    def unreachable(self, master, batch, result):
+        raise IOError("master database not reachable")
+
+    monkeypatch.setattr(jtsinventory.Database, "_pull", unreachable)
+    with pytest.raises(IOError):
+        replica.sync(db.dbName())
+    assert replica.pendingPostings() == 1
+    monkeypatch.setattr(jtsinventory.Database, "_pull", pull)
+    result = replica.sync(db.dbName())
+    assert (result['pushed'], result['duplicates']) == (0, 1)
+    assert table(db, """SELECT COUNT(*) FROM in_transaction""") == [(1,)]
+    assert table(replica, """SELECT COUNT(*) FROM in_transaction""") == [(1,)]
+
+
+def test_sync_keeps_the_master_version_on_conflicts(db, replica):
+    replica.cur.execute("""UPDATE products SET description='Replica'
+        WHERE id IN (1, 2)""")
+    replica.con.commit()
+    db.cur.execute("""UPDATE products SET description='Master' WHERE id=2""")
+    db.con.commit()
+    for database, description in ((db, "Master 4"), (replica, "Replica 4")):
+        database.insertRecord(table="products", itemcode="P004",
+                              description=description, unit="pc", price=10,
+                              max_qty=100, min_qty=10)
+    result = replica.sync(db.dbName())
+    assert sorted(result['conflicts']) == [("products", "P002"),
+                                           ("products", "P004")]
+    expected = [(1, "Replica"), (2, "Master"), (3, "Product 3"),
+                (4, "Master 4")]
+    for database in (db, replica):
+        assert table(database, """SELECT id, description FROM products
+            ORDER BY id""") == expected
+
+
+def test_sync_repeated_after_the_master_data_is_no_conflict(db, replica,
+                                                             monkeypatch):
+    replica.cur.execute("""UPDATE products SET price=12 WHERE id=1""")
+    replica.con.commit()
+    replica.insertRecord(table="products", itemcode="P004",
+                         description="Product 4", unit="pc", price=10,
+                         max_qty=100, min_qty=10)
+    push = jtsinventory.Database._pushPostings
+
+    def unreachable(self, master, mapping, batch, result):
+        raise IOError("master database not reachable")
+
+    monkeypatch.setattr(jtsinventory.Database, "_pushPostings", unreachable)
+    with pytest.raises(IOError):
+        replica.sync(db.dbName())
+    # The master kept the products, the replica still has them to send.
+    assert table(db, """SELECT COUNT(*) FROM products""") == [(4,)]
+    monkeypatch.setattr(jtsinventory.Database, "_pushPostings", push)
+    result = replica.sync(db.dbName())
+    assert result['conflicts'] == []
+    assert table(db, """SELECT COUNT(*) FROM products""") == [(4,)]
+    for database in (db, replica):
+        assert table(database, """SELECT id, code, price FROM products
+            WHERE id IN (1, 4) ORDER BY id""") == [(1, "P001", 12),
+                                                   (4, "P004", 10)]
+
+
+def test_pull_reopens_closed_periods(db, replica):
+    replica.closePeriod("31-01-2025")
+    receive(db, "15-01-2025", [(1, 50, 2.0)])
+    replica.sync(db.dbName())
+    assert table(replica, """SELECT COUNT(*) FROM stock_snapshot""") == [(0,)]
+    closing = dict((row[0], row[4])
+                   for row in replica.closingStock("31-01-2025"))
+    assert closing[1] == 50
+
+
+def test_sync_keeps_refused_postings(db, replica):
+    db.cur.execute("""DELETE FROM products WHERE id=3""")
+    db.con.commit()
+    issue(replica, "03-01-2025", [(3, 1, 1.0)])
+    result = replica.sync(db.dbName())
+    assert (result['pushed'], result['rejected']) == (0, 1)
+    assert table(replica, """SELECT tbl, error FROM rejected""") == [
+        ("outgoing", "unknown product id: 3")]
+    assert table(db, """SELECT COUNT(*) FROM outgoing""") == [(0,)]
+    assert table(replica, """SELECT COUNT(*) FROM outgoing""") == [(0,)]
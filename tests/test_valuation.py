@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+import jtsinventory
+from conftest import adjust, issue, openDatabase, receive
+
+
+def valuation(db):
+    values = db.cur.execute(
+        """SELECT product_id, ROUND(quantity, 6), ROUND(avg_cost, 6),
+        ROUND(fifo_value, 6) FROM stock_value ORDER BY product_id""").fetchall()
+    layers = db.cur.execute(
+        """SELECT move_id, product_id, ROUND(remaining, 6), cost
+        FROM cost_layer ORDER BY move_id""").fetchall()
+    return values, layers
+
+
+def post(db):
+    receive(db, "01-01-2025", [(1, 10, 2.0), (2, 5, 4.0)])
+    receive(db, "02-01-2025", [(1, 10, 3.0)])
+    issue(db, "03-01-2025", [(1, 15, 2.5), (2, 1, 4.0)])
+    adjust(db, "04-01-2025", [(1, 2, 4.0), (2, -1, 4.0)])
+    receive(db, "05-01-2025", [(1, 3, 5.0)])
+
+
+def test_moving_average_and_fifo(db):
+    post(db)
+    values, layers = valuation(db)
+    # 10 @ 2 and 10 @ 3 average 2.5, 15 issued, 2 @ 4 and 3 @ 5 added.
+    assert values[0] == (1, 10.0, round((5 * 2.5 + 8 + 15) / 10, 6),
+                         round(5 * 3 + 8 + 15, 6))
+    assert [layer[2:] for layer in layers if layer[1] == 1] == [
+        (5.0, 3.0), (2.0, 4.0), (3.0, 5.0)]
+
+
+@pytest.mark.parametrize("vectorized", [True, False])
+def test_recompute_agrees_with_posting(db, monkeypatch, vectorized):
+    post(db)
+    posted = valuation(db)
+    if not vectorized:
+        monkeypatch.setattr(jtsinventory, "numpy", None)
+    elif jtsinventory.numpy is None:
+        pytest.skip("NumPy is not installed")
+    assert db.recomputeValuation() == 8
+    assert valuation(db) == posted
+
+
+def test_pending_moves_are_posted_once(db, tmp_path, monkeypatch):
+    # Lines saved without valuing them, as by a session which stopped.
+    db.cur.execute("""INSERT INTO incoming VALUES(null, '01-01-2025', '',
+        '', '')""")
+    db.cur.execute("""INSERT INTO in_transaction VALUES(null, 1, 1, 10, 2.0)""")
+    db.con.commit()
+    path = str(tmp_path / "test.db")
+    slow = jtsinventory.applyMove
+
+    def applyMove(*args):
+        time.sleep(0.2)
+        slow(*args)
+
+    monkeypatch.setattr(jtsinventory, "applyMove", applyMove)
+    start = threading.Barrier(3)
+    errors = []
+
+    def run():
+        start.wait()
+        try:
+            openDatabase(path).closeDB()
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=run) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert valuation(db) == ([(1, 10.0, 2.0, 20.0)],
+                             [(1, 1, 10.0, 2.0)])
@@ -0,0 +1,39 @@
+import json
+import sys
+import time
+
+import pytest
+
+import jtsinventory
+
+
+def test_viewer_starts_the_configured_command(tmp_path):
+    shown = tmp_path / "shown.txt"
+    command = '"%s" -c "import sys; open(%r, \'w\').write(sys.argv[1])"' % (
+        sys.executable, str(shown))
+    report = tmp_path / "report.pdf"
+    jtsinventory.ReportViewer(command).open(str(report))
+    for _ in range(100):
+        if shown.exists() and shown.read_text():
+            break
+        time.sleep(0.05)
+    assert shown.read_text() == str(report)
+
+
+def test_viewer_raises_when_the_command_is_missing(tmp_path):
+    viewer = jtsinventory.ReportViewer(str(tmp_path / "no-viewer"))
+    with pytest.raises(OSError):
+        viewer.open("report.pdf")
+    jtsinventory.ReportViewer(str(tmp_path / "no-viewer"),
+                              enabled=False).open("report.pdf")
+
+
+def test_open_report_shows_the_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open("config.json", "w") as cf:
+        json.dump({'viewer': str(tmp_path / "no-viewer")}, cf)
+    errors = []
+    monkeypatch.setattr(jtsinventory.mb, "showerror",
+                        lambda title, message: errors.append(message))
+    jtsinventory.openReport("report.pdf")
+    assert len(errors) == 1 and "report.pdf" in errors[0]
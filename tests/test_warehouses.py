@@ -0,0 +1,62 @@
+import csv
+import json
+
+import pytest
+
+import jtsinventory
+from conftest import issue, openDatabase, receive
+
+
+@pytest.fixture
+def stores(db, tmp_path):
+    """A second warehouse next to the db one, both listed in config.json.
+    The second one stocks P002 and a product of its own."""
+    north = openDatabase(tmp_path / "north.db")
+    for code in ("P002", "N001"):
+        north.insertRecord(table="products", itemcode=code,
+                           description="Item %s" % code, unit="pc",
+                           price=10, max_qty=100, min_qty=10)
+    receive(north, "01-01-2025", [(1, 7, 3.0), (2, 4, 5.0)])
+    north.closeDB()
+    receive(db, "01-01-2025", [(1, 50, 2.0), (2, 20, 1.0)])
+    issue(db, "02-01-2025", [(1, 10, 2.0)])
+    config = {'default_db': "test.db",
+              'warehouses': {"Main": "test.db", "North": "north.db"}}
+    (tmp_path / "config.json").write_text(json.dumps(config))
+    return jtsinventory.warehouses(config)
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_group_stock_merges_by_code(stores, parallel):
+    rows, timings = jtsinventory.groupStock(stores, parallel=parallel)
+    assert [row[:6] for row in rows] == [
+        ("N001", "Item N001", "pc", 0.0, 4.0, 4.0),
+        ("P001", "Product 1", "pc", 40.0, 0.0, 40.0),
+        ("P002", "Product 2", "pc", 20.0, 7.0, 27.0),
+        ("P003", "Product 3", "pc", 0.0, 0.0, 0.0)]
+    assert rows[1][6] == pytest.approx(80.0)
+    assert [name for name, seconds in timings] == ["Main", "North"]
+
+
+def test_group_stock_missing_warehouse(tmp_path):
+    with pytest.raises(ValueError, match="south.db"):
+        jtsinventory.groupStock([("South", str(tmp_path / "south.db"))])
+
+
+def test_selected_warehouse_database(monkeypatch):
+    monkeypatch.setattr(jtsinventory, "_warehouse", None)
+    assert jtsinventory.databaseName({'default_db': "a.db"}) == "a.db"
+    jtsinventory.selectWarehouse("North", "north.db")
+    assert jtsinventory.warehouseName() == "North"
+    assert jtsinventory.databaseName({'default_db': "a.db"}) == "north.db"
+
+
+def test_group_stock_command(stores, tmp_path):
+    out = tmp_path / "group.csv"
+    assert jtsinventory.runCommand(
+        ["--db", "test.db", "group-stock", "--serial", "-o", str(out)]) == 0
+    with open(str(out), newline='') as csvfile:
+        rows = list(csv.reader(csvfile))
+    assert rows[0] == ["code", "description", "unit", "Main", "North",
+                       "quantity", "amount"]
+    assert len(rows) == 5
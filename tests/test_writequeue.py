@@ -0,0 +1,74 @@
+import concurrent.futures
+import sqlite3
+
+import pytest
+
+import jtsinventory
+
+
+def outgoing(quantity, costcenter_id=1):
+    return ("outgoing", {'date': "02-01-2025", 'costcenter_id': costcenter_id,
+                         'remarks': ""}, [(1, quantity, 2.0)])
+
+
+@pytest.fixture
+def writes(db, tmp_path):
+    queue = jtsinventory.WriteQueue(str(tmp_path / "test.db"), window=0.2)
+    yield queue
+    queue.close()
+
+
+def test_postings_are_committed_in_groups(writes, db):
+    futures = [writes.submit(*outgoing(1)) for count in range(20)]
+    ids = [future.result(10) for future in futures]
+    assert sorted(ids) == list(range(1, 21))
+    metrics = writes.metrics()
+    assert metrics['postings'] == 20 and metrics['failed'] == 0
+    # The window gathers the postings queued at once into a few commits.
+    assert metrics['batches'] < 20
+    assert metrics['largest_batch'] > 1
+    query = db.cur.execute("SELECT COUNT(*) FROM out_transaction")
+    assert query.fetchone()[0] == 20
+
+
+def test_failing_posting_fails_alone(writes, db):
+    futures = [writes.submit(*outgoing(1)),
+               writes.submit(*outgoing(1, costcenter_id=9)),
+               writes.submit(*outgoing(2))]
+    assert futures[0].result(10) == 1
+    with pytest.raises(ValueError, match="cost center"):
+        futures[1].result(10)
+    assert futures[2].result(10) == 2
+    assert writes.metrics()['failed'] == 1
+    query = db.cur.execute("SELECT SUM(quantity) FROM out_transaction")
+    assert query.fetchone()[0] == 3
+
+
+def test_closed_queue_refuses_postings(writes):
+    writes.close()
+    with pytest.raises(RuntimeError):
+        writes.submit(*outgoing(1))
+
+
+def journalMode(path):
+    """Return the journal mode a new connection to path gets."""
+    con = sqlite3.connect(path)
+    try:
+        return con.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        con.close()
+
+
+def test_wal_is_opt_in(db, tmp_path):
+    path = str(tmp_path / "test.db")
+    jtsinventory.WriteQueue(path).close()
+    assert journalMode(path) == "delete"
+    jtsinventory.WriteQueue(path, wal=True).close()
+    assert journalMode(path) == "wal"
+
+
+def test_posts_from_many_threads(writes):
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        ids = list(pool.map(lambda count: writes.post(*outgoing(1)),
+                            range(40)))
+    assert sorted(ids) == list(range(1, 41))